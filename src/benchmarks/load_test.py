@@ -0,0 +1,504 @@
+"""
+Load test of the Dash callbacks: concurrent sessions driving a locally started app.
+
+Each session talks to the real `/_dash-update-component` endpoint the way the browser does:
+it loads the page (firing the initial callbacks), builds a graph, drags the time slider from
+0 to 100, opens and closes the matrices modal and taps a few nodes. Callbacks chain as in
+the Dash renderer: outputs trigger the callbacks that take them as inputs, and callbacks
+whose inputs are ready are requested in parallel. The report has the p50/p95/p99 latency of
+every callback and user action, and the throughput.
+
+The app is started on synthetic users (see `stub_server`), with the development server or
+gunicorn, e.g. `python -m src.benchmarks.load_test --sessions 16 --server gunicorn`.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+
+from src.benchmarks.run_benchmarks import DEFAULT_OUTPUT_DIR, git_commit
+from src.benchmarks.stub_server import (
+    CORE_USERS_ENV_VAR, EDGES_PER_USER_ENV_VAR, SEED_ENV_VAR, DEFAULT_CORE_USERS, DEFAULT_EDGES_PER_USER,
+    synthetic_corpus
+)
+from src.data_caching.cache import SHARED_CACHE_ENV_VAR
+
+logger = logging.getLogger(__name__)
+
+SLIDER_POSITIONS = list(range(10, 101, 10))
+# Browsers open about this many connections per host
+PARALLEL_REQUESTS_PER_SESSION = 4
+REQUEST_TIMEOUT_SECONDS = 300
+SERVER_START_TIMEOUT_SECONDS = 120
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+
+
+def _http_session():
+    """This thread's keep-alive session."""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    return session
+
+def _split_output(output):
+    """(id, property) of every output in a callback's output string, e.g. '..a.b...c.d@hash..'."""
+    specs = output[2:-2].split('...') if output.startswith('..') else [output]
+    return [tuple(spec.split('.', 1)) for spec in specs]
+
+def _prop(component_id, prop):
+    # Outputs with `allow_duplicate` carry a suffix; the value lives on the plain property
+    return f"{component_id}.{prop.split('@')[0]}"
+
+def apply_patch(value, patch):
+    """Apply the operations of a serialized `dash.Patch` to `value` in place, as the renderer does; returns the result."""
+    for operation in patch['operations']:
+        name, location, params = operation['operation'], operation['location'], operation['params']
+        if not location and name == 'Assign':
+            value = params['value']
+            continue
+        target = value
+        path = location[:-1] if name in ('Assign', 'Delete') else location
+        for key in path:
+            target = target[key]
+        if name == 'Assign':
+            target[location[-1]] = params['value']
+        elif name == 'Delete':
+            del target[location[-1]]
+        elif name == 'Extend':
+            target.extend(params['value'])
+        elif name == 'Append':
+            target.append(params['value'])
+        elif name == 'Prepend':
+            target.insert(0, params['value'])
+        elif name == 'Insert':
+            target.insert(params['index'], params['value'])
+        elif name == 'Merge':
+            target.update(params['value'])
+        elif name == 'Clear':
+            target.clear()
+        elif name == 'Reverse':
+            target.reverse()
+        elif name == 'Remove':
+            target.remove(params['value'])
+        else:
+            raise ValueError(f"Unsupported patch operation '{name}'")
+    return value
+
+
+class DashCallbacks:
+    """The callback graph and initial component properties of a running Dash app."""
+
+    def __init__(self, base_url):
+        dependencies = requests.get(f"{base_url}/_dash-dependencies", timeout=REQUEST_TIMEOUT_SECONDS).json()
+        layout = requests.get(f"{base_url}/_dash-layout", timeout=REQUEST_TIMEOUT_SECONDS).json()
+
+        # Clientside callbacks run in the browser and never reach the server
+        self.callbacks = []
+        for dependency in dependencies:
+            if dependency.get('clientside_function'):
+                continue
+            outputs = _split_output(dependency['output'])
+            self.callbacks.append({
+                'output': dependency['output'],
+                'outputs': outputs,
+                'label': _prop(*outputs[0]),
+                'inputs': [_prop(i['id'], i['property']) for i in dependency['inputs']],
+                'state': [_prop(s['id'], s['property']) for s in dependency['state']],
+                'prevent_initial_call': dependency.get('prevent_initial_call', False)
+            })
+        self.triggers = defaultdict(list)
+        for index, callback in enumerate(self.callbacks):
+            for prop in callback['inputs']:
+                self.triggers[prop].append(index)
+        self.reach = [self._reach(index) for index in range(len(self.callbacks))]
+
+        self.initial_props = {}
+        self._collect_props(layout)
+
+    def _reach(self, index):
+        """Every property that a call of callback `index` can end up changing, through the callbacks it triggers."""
+        reached, todo, seen = set(), [index], {index}
+        while todo:
+            for prop in (_prop(*output) for output in self.callbacks[todo.pop()]['outputs']):
+                reached.add(prop)
+                for triggered in self.triggers.get(prop, ()):
+                    if triggered not in seen:
+                        seen.add(triggered)
+                        todo.append(triggered)
+        return reached
+
+    def _collect_props(self, component):
+        if isinstance(component, list):
+            for child in component:
+                self._collect_props(child)
+        elif isinstance(component, dict) and 'props' in component:
+            props = component['props']
+            if isinstance(props.get('id'), str):
+                for name, value in props.items():
+                    if name != 'children' or not isinstance(value, (dict, list)):
+                        self.initial_props[_prop(props['id'], name)] = value
+            self._collect_props(props.get('children'))
+
+
+class LoadRecorder:
+    """Latencies per callback and per user action, shared by all sessions."""
+
+    def __init__(self):
+        self.callbacks = defaultdict(list)
+        self.actions = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sessions_completed = 0
+        self._lock = threading.Lock()
+
+    def callback(self, label, seconds, error=False):
+        with self._lock:
+            self.callbacks[label].append(seconds)
+            if error:
+                self.errors[label] += 1
+
+    def action(self, name, seconds):
+        with self._lock:
+            self.actions[name].append(seconds)
+
+    def session_completed(self):
+        with self._lock:
+            self.sessions_completed += 1
+
+
+class DashSession:
+    """One browser tab: its own component properties, chaining callbacks like the Dash renderer."""
+
+    def __init__(self, dash_callbacks, base_url, recorder, pool):
+        self.dash = dash_callbacks
+        self.url = f"{base_url}/_dash-update-component"
+        self.recorder = recorder
+        self.pool = pool
+        # Patched outputs are updated in place, so no session may share a value with another
+        self.props = copy.deepcopy(dash_callbacks.initial_props)
+
+    def load(self):
+        """Fire the initial callbacks, as on page load."""
+        pending = {
+            index: set() for index, callback in enumerate(self.dash.callbacks)
+            if not callback['prevent_initial_call']
+        }
+        self._run('load', pending)
+
+    def act(self, name, **changes):
+        """Set properties (keyed `component_id__property`) and run every callback that follows."""
+        pending = defaultdict(set)
+        for key, value in changes.items():
+            prop = _prop(*key.split('__', 1))
+            self.props[prop] = value
+            for index in self.dash.triggers.get(prop, ()):
+                pending[index].add(prop)
+        self._run(name, pending)
+
+    def click(self, name, button_id):
+        self.act(name, **{f"{button_id}__n_clicks": (self.props.get(f"{button_id}.n_clicks") or 0) + 1})
+
+    def _run(self, name, pending):
+        start = time.perf_counter()
+        pending = dict(pending)
+        while pending:
+            # A callback waits while another pending one may still change its inputs
+            ready = [
+                index for index in pending
+                if not any(self.dash.reach[other] & set(self.dash.callbacks[index]['inputs']) for other in pending if other != index)
+            ] or list(pending)
+            calls = [(index, pending.pop(index)) for index in ready]
+            for changed in self.pool.map(lambda call: self._call(*call), calls):
+                self.props.update(changed)
+                for prop in changed:
+                    for index in self.dash.triggers.get(prop, ()):
+                        pending.setdefault(index, set()).add(prop)
+        self.recorder.action(name, time.perf_counter() - start)
+
+    def _call(self, index, changed):
+        """Request one callback; returns the properties it changed."""
+        callback = self.dash.callbacks[index]
+        outputs = [{'id': component_id, 'property': prop} for component_id, prop in callback['outputs']]
+        body = {
+            'output': callback['output'],
+            'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+            'inputs': [self._value(prop) for prop in callback['inputs']],
+            'state': [self._value(prop) for prop in callback['state']],
+            'changedPropIds': sorted(changed)
+        }
+        start = time.perf_counter()
+        try:
+            try:
+                response = _http_session().post(self.url, json=body, timeout=REQUEST_TIMEOUT_SECONDS)
+            except requests.ConnectionError as e:
+                if isinstance(e, requests.Timeout):
+                    raise
+                # The server closed an idle keep-alive connection; browsers retry those once too
+                response = _http_session().post(self.url, json=body, timeout=REQUEST_TIMEOUT_SECONDS)
+        except requests.RequestException as e:
+            logger.warning(f"{callback['label']} failed: {e}")
+            self.recorder.callback(callback['label'], time.perf_counter() - start, error=True)
+            return {}
+        # 204: the callback raised PreventUpdate
+        error = response.status_code not in (200, 204)
+        result = response.json() if response.status_code == 200 else None
+        self.recorder.callback(callback['label'], time.perf_counter() - start, error=error)
+        if error:
+            logger.warning(f"{callback['label']} returned HTTP {response.status_code}")
+        if not result:
+            return {}
+        changed = {}
+        for component_id, props in result['response'].items():
+            for prop, value in props.items():
+                prop = _prop(component_id, prop)
+                if isinstance(value, dict) and '__dash_patch_update' in value:
+                    value = apply_patch(self.props.get(prop), value)
+                changed[prop] = value
+        return changed
+
+    def _value(self, prop):
+        component_id, name = prop.split('.', 1)
+        return {'id': component_id, 'property': name, 'value': self.props.get(prop)}
+
+
+def run_session(session, fids, rng, lod=False, node_taps=3, think_time=0):
+    """A user building a graph of `fids` and exploring it."""
+    def pause():
+        if think_time:
+            time.sleep(rng.exponential(think_time))
+
+    session.load()
+    pause()
+    session.props['user-ids-input.value'] = ','.join(fids)
+    session.props['lod-mode.value'] = ['lod'] if lod else []
+    session.click('build_graph', 'build-graph-button')
+    for value in SLIDER_POSITIONS:
+        pause()
+        session.act('slider', **{'time-slider__value': value})
+    pause()
+    session.click('open_matrices', 'open-matrices-modal')
+    pause()
+    session.click('close_matrices', 'close-matrices-modal')
+
+    nodes = [element['data'] for element in session.props.get('cytoscape-graph.elements') or [] if 'source' not in element['data']]
+    for position in rng.permutation(len(nodes))[:node_taps].tolist():
+        pause()
+        session.act('tap_node', **{'cytoscape-graph__tapNodeData': nodes[position]})
+        pause()
+        session.click('close_node_modal', 'close-modal')
+
+def run_load_test(base_url, fid_sets, sessions=8, iterations=1, lod=False, node_taps=3, think_time=0, ramp_up=0, seed=0):
+    """
+    Run `sessions` concurrent sessions of `iterations` scenarios each against the app at `base_url`.
+
+    Session `k` builds `fid_sets[k % len(fid_sets)]` first and moves on to the next sets, so
+    fewer FID sets than sessions means more sessions hit graphs another one already built.
+    """
+    dash_callbacks = DashCallbacks(base_url)
+    recorder = LoadRecorder()
+
+    def run_user(k):
+        time.sleep(ramp_up * k / sessions)
+        with ThreadPoolExecutor(max_workers=PARALLEL_REQUESTS_PER_SESSION) as pool:
+            for iteration in range(iterations):
+                fids = fid_sets[(k + iteration * sessions) % len(fid_sets)]
+                rng = np.random.default_rng([seed, k, iteration])
+                try:
+                    run_session(DashSession(dash_callbacks, base_url, recorder, pool), fids, rng,
+                                lod=lod, node_taps=node_taps, think_time=think_time)
+                except Exception as e:
+                    logger.error(f"Session {k} failed: {e}")
+                    continue
+                recorder.session_completed()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as users:
+        list(users.map(run_user, range(sessions)))
+    duration = time.perf_counter() - start
+
+    num_requests = sum(len(latencies) for latencies in recorder.callbacks.values())
+    return {
+        'duration_seconds': duration,
+        'requests': num_requests,
+        'errors': sum(recorder.errors.values()),
+        'requests_per_second': num_requests / duration,
+        'sessions_completed': recorder.sessions_completed,
+        'sessions_per_minute': recorder.sessions_completed / duration * 60,
+        'callbacks': {
+            label: {**latency_summary(latencies), 'errors': recorder.errors.get(label, 0)}
+            for label, latencies in sorted(recorder.callbacks.items())
+        },
+        'actions': {name: latency_summary(latencies) for name, latencies in recorder.actions.items()}
+    }
+
+def latency_summary(latencies):
+    summary = {'count': len(latencies)}
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"p{percentile}_seconds"] = float(value)
+    summary['max_seconds'] = max(latencies)
+    return summary
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, corpus, log_file, workers=None, threads=None):
+    """Start the stub app in a subprocess and wait until it answers; returns the process."""
+    num_core_users, edges_per_user, seed = corpus
+    env = {
+        **os.environ,
+        CORE_USERS_ENV_VAR: str(num_core_users),
+        EDGES_PER_USER_ENV_VAR: str(edges_per_user),
+        SEED_ENV_VAR: str(seed)
+    }
+    if mode == 'gunicorn':
+        # A fresh shared cache, so earlier runs don't serve this one's graphs
+        env[SHARED_CACHE_ENV_VAR] = os.path.join(tempfile.mkdtemp(prefix='load_test_'), 'shared_cache.db')
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'src/graph_viz/gunicorn_config.py', '--bind', f"127.0.0.1:{port}"]
+        if workers:
+            command += ['--workers', str(workers)]
+        if threads:
+            command += ['--threads', str(threads)]
+        command.append('src.benchmarks.stub_server:create_server()')
+    else:
+        command = [sys.executable, '-m', 'src.benchmarks.stub_server', '--port', str(port)]
+    process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}; see {log_file.name}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/_dash-layout", timeout=5).ok:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"Server didn't answer within {SERVER_START_TIMEOUT_SECONDS} seconds; see {log_file.name}")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def synthetic_fid_sets(core_fids, num_sets, fids_per_graph, seed=0):
+    rng = np.random.default_rng(seed)
+    fids_per_graph = min(fids_per_graph, len(core_fids))
+    return [[core_fids[i] for i in rng.choice(len(core_fids), fids_per_graph, replace=False).tolist()] for _ in range(num_sets)]
+
+
+def print_results(results):
+    print(f"{results['sessions_completed']} sessions, {results['requests']} requests ({results['errors']} errors) "
+          f"in {results['duration_seconds']:.1f} s: {results['requests_per_second']:.1f} requests/s, "
+          f"{results['sessions_per_minute']:.1f} sessions/min")
+    for title, rows in (('callback', results['callbacks']), ('action', results['actions'])):
+        print(f"  {title:<32} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name, row in rows.items():
+            errors = f"  ({row['errors']} errors)" if row.get('errors') else ''
+            print(f"  {name:<32} {row['count']:>6} {row['p50_seconds'] * 1000:9.1f} {row['p95_seconds'] * 1000:9.1f} "
+                  f"{row['p99_seconds'] * 1000:9.1f} {row['max_seconds'] * 1000:9.1f}{errors}")
+
+def compare_results(baseline, current):
+    """Print the p50 and p95 change per callback and action, and the throughput change, between two result files."""
+    before, after = baseline['results'], current['results']
+    print(f"Throughput: {before['requests_per_second']:.1f} -> {after['requests_per_second']:.1f} requests/s")
+    for group in ('callbacks', 'actions'):
+        for name, row in after[group].items():
+            previous = before[group].get(name)
+            if previous is None:
+                continue
+            print(f"  {name:<32} p50 {previous['p50_seconds'] * 1000:9.1f} -> {row['p50_seconds'] * 1000:9.1f} ms  "
+                  f"p95 {previous['p95_seconds'] * 1000:9.1f} -> {row['p95_seconds'] * 1000:9.1f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Dash callbacks with concurrent simulated sessions.")
+    parser.add_argument('--sessions', type=int, default=8, help="Concurrent sessions")
+    parser.add_argument('--iterations', type=int, default=1, help="Scenarios run by each session, one after the other")
+    parser.add_argument('--server', choices=['dev', 'gunicorn'], default='dev', help="How to serve the stub app")
+    parser.add_argument('--workers', type=int, help="Gunicorn workers (default: the gunicorn config's)")
+    parser.add_argument('--threads', type=int, help="Gunicorn threads per worker")
+    parser.add_argument('--url', help="Test an app that is already running instead (its FIDs come from --fids)")
+    parser.add_argument('--fids', nargs='+', help="Comma-separated core FIDs, one graph each (with --url)")
+    parser.add_argument('--graphs', type=int, help="Distinct synthetic FID sets (default: one per session)")
+    parser.add_argument('--fids-per-graph', type=int, default=2)
+    parser.add_argument('--core-users', type=int, default=DEFAULT_CORE_USERS, help="Synthetic core users")
+    parser.add_argument('--edges-per-user', type=int, default=DEFAULT_EDGES_PER_USER)
+    parser.add_argument('--lod', action='store_true', help="Build graphs in large graph mode")
+    parser.add_argument('--node-taps', type=int, default=3, help="Nodes tapped per session")
+    parser.add_argument('--think-time', type=float, default=0, help="Mean pause between actions, in seconds")
+    parser.add_argument('--ramp-up', type=float, default=0, help="Seconds over which sessions start")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Results file (default: data/benchmarks/load_test_<commit>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.url and not args.fids:
+        parser.error("--url needs --fids")
+
+    os.makedirs(DEFAULT_OUTPUT_DIR, exist_ok=True)
+    process = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        fid_sets = [[fid.strip() for fid in fids.split(',') if fid.strip()] for fids in args.fids]
+    else:
+        core_fids = list(synthetic_corpus(args.core_users, args.edges_per_user, args.seed))
+        fid_sets = synthetic_fid_sets(core_fids, args.graphs or args.sessions, args.fids_per_graph, args.seed)
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(DEFAULT_OUTPUT_DIR, 'load_test_server.log')
+        print(f"Starting the {args.server} server on {base_url} (log: {log_path})...")
+        with open(log_path, 'w') as log_file:
+            process = start_server(args.server, port, (args.core_users, args.edges_per_user, args.seed), log_file,
+                                   workers=args.workers, threads=args.threads)
+
+    try:
+        print(f"Running {args.sessions} sessions x {args.iterations} iterations over {len(fid_sets)} FID sets...")
+        results = run_load_test(
+            base_url, fid_sets, sessions=args.sessions, iterations=args.iterations, lod=args.lod,
+            node_taps=args.node_taps, think_time=args.think_time, ramp_up=args.ramp_up, seed=args.seed
+        )
+    finally:
+        if process is not None:
+            stop_server(process)
+    print_results(results)
+
+    commit = git_commit()
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"load_test_{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'fid_sets': fid_sets,
+            'results': results
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), {'results': results})
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import networkx as nx
+import numpy as np
+
+from src.benchmarks.synthetic_data import generate_users_data
+from src.data_ingestion.rollups import build_rollup
+from src.graph_processing.build_graph import get_graph_builder
+from src.graph_processing.snapshot import GraphSnapshot, snapshot_bytes
+from src.graph_viz.callbacks import slider_to_timestamp
+from src.graph_viz.config import TOP_N_NODES
+from src.graph_viz.network_analysis import filter_graph, get_elements, get_adjacency_matrix, get_shortest_path_matrix
+from src.graph_viz.temporal_index import TemporalIndex
+
+logger = logging.getLogger(__name__)
+
+SLIDER_POSITIONS = [0, 10, 30, 50, 70, 100]
+DEFAULT_OUTPUT_DIR = "data/benchmarks"
+
+
+def measure(fn, repeat=3):
+    """
+    Time `fn` over `repeat` runs and measure its peak traced memory on one extra run.
+
+    Timing and memory tracing are kept apart because tracemalloc slows allocations down.
+
+    Returns:
+        Tuple[dict, Any]: The measurements and the result of the last call.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'min_seconds': min(timings),
+        'median_seconds': float(np.median(timings)),
+        'max_seconds': max(timings),
+        'peak_memory_bytes': peak
+    }, result
+
+def matrices_graph(G, timestamp):
+    """Undirected graph of the interactions up to `timestamp`, built as in `update_matrices`."""
+    G_filtered = nx.Graph((u, v, d) for (u, v, d) in G.edges(data=True) if d['timestamp'] <= timestamp)
+    for node, data in G.nodes(data=True):
+        if node in G_filtered:
+            G_filtered.nodes[node].update(data)
+    return G_filtered
+
+def run_scenario(num_core_users, edges_per_user, power_law_exponent, timestamp_span_days, top_n=TOP_N_NODES, repeat=3, seed=0):
+    """Run every pipeline stage on one synthetic dataset and return the measurements per stage."""
+    all_user_data = generate_users_data(
+        num_core_users=num_core_users,
+        edges_per_user=edges_per_user,
+        power_law_exponent=power_law_exponent,
+        timestamp_span_days=timestamp_span_days,
+        seed=seed
+    )
+    core_nodes = list(all_user_data)
+    builder = get_graph_builder()
+    stages = {}
+
+    # Synthetic FIDs must not pick up postings from a locally built inbound index
+    stages['build_graph_from_data'], G = measure(lambda: builder.build_graph_from_data(all_user_data, include_inbound=False), repeat)
+    all_rollups = {fid: build_rollup(user_data) for fid, user_data in all_user_data.items()}
+    stages['build_graph_from_rollups'], _ = measure(lambda: builder.build_graph_from_rollups(all_rollups, include_inbound=False), repeat)
+    stages['filter_graph'], filtered_G = measure(lambda: filter_graph(G, core_nodes, top_n=top_n), repeat)
+    stages['temporal_index'], index = measure(lambda: TemporalIndex(filtered_G), repeat)
+
+    # The two ways callbacks get the graph back: from the browser's node-link data or a cached snapshot
+    graph_data = nx.readwrite.json_graph.node_link_data(filtered_G)
+    snapshot = snapshot_bytes(filtered_G, compression='none')
+    stages['node_link_graph'], _ = measure(lambda: nx.readwrite.json_graph.node_link_graph(graph_data, multigraph=True), repeat)
+    stages['snapshot_to_networkx'], _ = measure(lambda: GraphSnapshot(snapshot).to_networkx(), repeat)
+
+    for value in SLIDER_POSITIONS:
+        timestamp = slider_to_timestamp(value, index.min_timestamp, index.max_timestamp)
+        stages[f"get_elements@{value}"], _ = measure(
+            lambda: get_elements(filtered_G, timestamp, core_nodes, index=index), repeat
+        )
+
+    G_matrices = matrices_graph(filtered_G, index.max_timestamp)
+    # The matrix helpers print their labels; keep them out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        stages['get_adjacency_matrix'], _ = measure(lambda: get_adjacency_matrix(G_matrices), repeat)
+        stages['get_shortest_path_matrix'], _ = measure(lambda: get_shortest_path_matrix(G_matrices), repeat)
+
+    return {
+        'params': {
+            'num_core_users': num_core_users,
+            'edges_per_user': edges_per_user,
+            'power_law_exponent': power_law_exponent,
+            'timestamp_span_days': timestamp_span_days,
+            'top_n': top_n,
+            'seed': seed
+        },
+        'graph': {
+            'nodes': G.number_of_nodes(),
+            'edges': G.number_of_edges(),
+            'filtered_nodes': filtered_G.number_of_nodes(),
+            'filtered_edges': filtered_G.number_of_edges()
+        },
+        'stages': stages
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(baseline, current):
+    """Print the median time ratio per scenario and stage between two result files."""
+    baseline_scenarios = {json.dumps(s['params'], sort_keys=True): s for s in baseline['scenarios']}
+    for scenario in current['scenarios']:
+        previous = baseline_scenarios.get(json.dumps(scenario['params'], sort_keys=True))
+        if previous is None:
+            continue
+        print(f"Scenario {scenario['params']}")
+        for stage, result in scenario['stages'].items():
+            if stage not in previous['stages']:
+                continue
+            before = previous['stages'][stage]['median_seconds']
+            after = result['median_seconds']
+            ratio = after / before if before else float('inf')
+            print(f"  {stage:<28} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms  ({ratio:.2f}x)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the graph pipeline on synthetic Farcaster data.")
+    parser.add_argument('--core-users', type=int, nargs='+', default=[2, 3, 5], help="Core user counts, one scenario each")
+    parser.add_argument('--edges-per-user', type=int, nargs='+', default=[1000, 10000], help="Interactions per core user")
+    parser.add_argument('--power-law-exponent', type=float, default=1.2)
+    parser.add_argument('--timestamp-span-days', type=float, default=365)
+    parser.add_argument('--top-n', type=int, default=TOP_N_NODES, help="Nodes kept by filter_graph")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Results file (default: data/benchmarks/benchmark_<commit>.json)")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    # The pipeline logs every edge batch; only warnings are useful here
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('src').setLevel(logging.WARNING)
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'scenarios': []
+    }
+    for num_core_users in args.core_users:
+        for edges_per_user in args.edges_per_user:
+            print(f"Running {num_core_users} core users x {edges_per_user} edges...")
+            scenario = run_scenario(
+                num_core_users, edges_per_user, args.power_law_exponent, args.timestamp_span_days,
+                top_n=args.top_n, repeat=args.repeat, seed=args.seed
+            )
+            for stage, result in scenario['stages'].items():
+                print(f"  {stage:<28} {result['median_seconds'] * 1000:10.2f} ms  {result['peak_memory_bytes'] / 1e6:8.2f} MB")
+            results['scenarios'].append(scenario)
+
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark_{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare_results(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
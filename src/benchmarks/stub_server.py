@@ -0,0 +1,100 @@
+"""
+The app serving synthetic users instead of S3 and the hub, for load tests.
+
+Development server: `python -m src.benchmarks.stub_server --port 8060`. Production mode:
+`gunicorn -c src/graph_viz/gunicorn_config.py 'src.benchmarks.stub_server:create_server()'`.
+The synthetic corpus is configured with the `CLOUD_CARTOGRAPHY_LOAD_TEST_*` environment
+variables, so the load-test client can generate the same one and know its core FIDs.
+"""
+import argparse
+import logging
+import os
+
+# A locally built inbound index would add real fans to the synthetic FIDs; an empty path means
+# no index. Set before the index module reads it
+os.environ.setdefault('CLOUD_CARTOGRAPHY_INBOUND_INDEX', '')
+
+from src.benchmarks.synthetic_data import generate_users_data
+from src.data_ingestion import fetch_data
+from src.data_ingestion.fetch_data import DataFetcher
+from src.data_ingestion.rollups import build_rollup
+
+CORE_USERS_ENV_VAR = 'CLOUD_CARTOGRAPHY_LOAD_TEST_CORE_USERS'
+EDGES_PER_USER_ENV_VAR = 'CLOUD_CARTOGRAPHY_LOAD_TEST_EDGES_PER_USER'
+SEED_ENV_VAR = 'CLOUD_CARTOGRAPHY_LOAD_TEST_SEED'
+DEFAULT_CORE_USERS = 8
+DEFAULT_EDGES_PER_USER = 2000
+
+
+def corpus_params():
+    """(core users, edges per user, seed) of the synthetic corpus, from the environment."""
+    return (
+        int(os.getenv(CORE_USERS_ENV_VAR, DEFAULT_CORE_USERS)),
+        int(os.getenv(EDGES_PER_USER_ENV_VAR, DEFAULT_EDGES_PER_USER)),
+        int(os.getenv(SEED_ENV_VAR, 0))
+    )
+
+def synthetic_corpus(num_core_users=DEFAULT_CORE_USERS, edges_per_user=DEFAULT_EDGES_PER_USER, seed=0):
+    return generate_users_data(num_core_users=num_core_users, edges_per_user=edges_per_user, seed=seed)
+
+
+class StubDataFetcher(DataFetcher):
+    """
+    `DataFetcher` serving a fixed set of users from memory.
+
+    Records still go through the user data, rollup and profile caches, so cache behaviour
+    (and the shared cache in production mode) is measured as in production; only S3 and
+    the hub are left out. Users outside the corpus don't exist.
+    """
+
+    def __init__(self, all_user_data, **kwargs):
+        super().__init__(**kwargs)
+        self.all_user_data = all_user_data
+        self.profiles = {
+            profile['fid']: profile
+            for user_data in all_user_data.values() for profile in user_data['connections_metadata']
+        }
+
+    def locate_user_data(self, fid):
+        return None
+
+    def load_user_data(self, fid):
+        user_data = self.user_data_cache.get(fid)
+        if user_data is None:
+            user_data = self.all_user_data.get(fid)
+            if user_data is not None:
+                self.user_data_cache.set(fid, user_data)
+        return user_data
+
+    def load_rollup(self, fid):
+        rollup = self.rollup_cache.get(fid)
+        if rollup is None and fid in self.all_user_data:
+            rollup = build_rollup(self.all_user_data[fid])
+            self.rollup_cache.set(fid, rollup)
+        return rollup
+
+    def get_user_profiles(self, fids):
+        return [self.profiles[fid] for fid in fids if fid in self.profiles]
+
+
+def create_server():
+    """The app's Flask server, with the process-wide fetcher replaced by a `StubDataFetcher`."""
+    num_core_users, edges_per_user, seed = corpus_params()
+    fetch_data._data_fetcher = StubDataFetcher(synthetic_corpus(num_core_users, edges_per_user, seed))
+
+    from src.graph_viz.app import app
+    # Every prefetch and graph build logs at INFO; at load that drowns the server's log
+    logging.getLogger('src').setLevel(logging.WARNING)
+    return app.server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the app on synthetic users with the development server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8060)
+    args = parser.parse_args(argv)
+
+    server = create_server()
+    server.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+
+import numpy as np
+
+# Share of each interaction list in the generated data, roughly what the cached users look like
+EDGE_TYPE_SHARES = {
+    'likes': 0.5,
+    'following': 0.25,
+    'casts': 0.15,
+    'recasts': 0.1
+}
+EDGE_TYPE_NAMES = {
+    'likes': 'LIKED',
+    'recasts': 'RECASTED',
+    'casts': 'REPLIED',
+    'following': 'FOLLOWS'
+}
+
+# Seconds since the Farcaster epoch; the cached users start around here
+DEFAULT_START_TIMESTAMP = 88_000_000
+SECONDS_PER_DAY = 86400
+# Casts per account that likes, recasts and replies point at, so core users engage with the same casts
+CASTS_PER_ACCOUNT = 20
+
+
+def _cast_hash(author, number):
+    return '0x' + hashlib.blake2b(f"{author}:{number}".encode('utf-8'), digest_size=20).hexdigest()
+
+def generate_users_data(
+    num_core_users=3,
+    edges_per_user=1000,
+    power_law_exponent=1.2,
+    timestamp_span_days=365,
+    population_size=None,
+    start_timestamp=DEFAULT_START_TIMESTAMP,
+    seed=0
+):
+    """
+    Generate synthetic Farcaster data for `num_core_users` users.
+
+    The result has the shape returned by `DataFetcher.get_all_users_data`: one
+    `get_user_data` dict per core FID, with `connections_metadata` attached. Interaction
+    targets are drawn from a shared population whose popularity follows a power law, so a
+    few accounts receive most interactions (and are shared between core users) while the
+    long tail is touched once or twice, as in the real graph.
+
+    Args:
+        num_core_users (int): Number of core FIDs to generate.
+        edges_per_user (int): Interactions generated per core user, across all edge types.
+        power_law_exponent (float): Exponent of the target popularity distribution.
+        timestamp_span_days (float): Span of the interaction timestamps in days.
+        population_size (int): Number of distinct accounts that can be interacted with;
+            defaults to `edges_per_user` so the tail stays long.
+        start_timestamp (int): First timestamp, in seconds since the Farcaster epoch.
+        seed (int): Seed for the random generator; equal arguments give equal data.
+
+    Returns:
+        Dict[str, Dict]: Mapping of core FID to its user data.
+    """
+    rng = np.random.default_rng(seed)
+    population_size = population_size or max(edges_per_user, num_core_users + 1)
+
+    # Core users live in the same population, so they can interact with each other
+    population = [str(fid) for fid in rng.choice(np.arange(1, 50 * population_size + 1), population_size, replace=False)]
+    core_fids = population[:num_core_users]
+    popularity = np.arange(1, population_size + 1, dtype=float) ** -power_law_exponent
+    popularity = popularity[rng.permutation(population_size)]
+    popularity /= popularity.sum()
+
+    metadata = {
+        fid: {
+            'fid': fid,
+            'username': f"user{fid}",
+            'display_name': f"User {fid}",
+            'pfp_url': f"https://example.com/pfp/{fid}.png",
+            'follower_count': int(rng.pareto(1.5) * 100),
+            'following_count': int(rng.pareto(2.0) * 100)
+        } for fid in population
+    }
+
+    span = int(timestamp_span_days * SECONDS_PER_DAY)
+    all_user_data = {}
+    for fid in core_fids:
+        user_data = {
+            'core_node_metadata': {
+                'bio': f"Synthetic user {fid}",
+                'username': metadata[fid]['username'],
+                'fid': fid
+            }
+        }
+        connections = {fid}
+        for key, share in EDGE_TYPE_SHARES.items():
+            count = int(round(edges_per_user * share))
+            if key == 'following':
+                # Follows are unique per target
+                count = min(count, population_size)
+                targets = rng.choice(population_size, count, replace=False, p=popularity)
+            else:
+                targets = rng.choice(population_size, count, p=popularity)
+            timestamps = np.sort(rng.integers(start_timestamp, start_timestamp + span + 1, count))
+
+            casts = rng.integers(CASTS_PER_ACCOUNT, size=count)
+
+            edges = []
+            for target, timestamp, cast in zip(targets.tolist(), timestamps.tolist(), casts.tolist()):
+                edge = {'source': fid, 'target': population[target]}
+                if key != 'following':
+                    edge['target_hash'] = _cast_hash(population[target], cast)
+                edge['timestamp'] = timestamp
+                edge['edge_type'] = EDGE_TYPE_NAMES[key]
+                edges.append(edge)
+                connections.add(population[target])
+            user_data[key] = edges
+
+        user_data['connections_metadata'] = [metadata[connection] for connection in sorted(connections)]
+        all_user_data[fid] = user_data
+
+    return all_user_data
@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from src.monitoring.metrics import record_cache
+
+# Path of the SQLite file shared by all workers; unset means per-process caches
+SHARED_CACHE_ENV_VAR = 'CLOUD_CARTOGRAPHY_SHARED_CACHE'
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded in-process cache that evicts the least recently used entry.
+
+    Caches given a `name` report their hits and misses to the metrics endpoint. Entries
+    older than `ttl_seconds` (if set) are treated as missing.
+    """
+
+    def __init__(self, max_entries=128, name=None, ttl_seconds=None):
+        self.max_entries = max_entries
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            hit = entry is not None and not (self.ttl_seconds and time.time() - entry[0] > self.ttl_seconds)
+            if hit:
+                self._entries.move_to_end(key)
+        if self.name:
+            record_cache(self.name, hit)
+        return entry[1] if hit else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not (self.ttl_seconds and time.time() - entry[0] > self.ttl_seconds)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def make_cache(name, max_entries=128, ttl_seconds=None):
+    """
+    Cache for `name`: shared between processes when `CLOUD_CARTOGRAPHY_SHARED_CACHE` points
+    to a SQLite file (as in the production server), in-process otherwise.
+    """
+    path = os.getenv(SHARED_CACHE_ENV_VAR)
+    if path:
+        from src.data_caching.shared_cache import SQLiteCache
+        return SQLiteCache(path, name, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    return LRUCache(max_entries=max_entries, name=name, ttl_seconds=ttl_seconds)
@@ -0,0 +1,283 @@
+import argparse
+import logging
+import os
+import threading
+
+import numpy as np
+
+from src.data_caching.inbound_index import EDGE_TYPES, corpus_records
+
+logger = logging.getLogger(__name__)
+
+CAST_INDEX_PATH = os.getenv('CLOUD_CARTOGRAPHY_CAST_INDEX', 'data/index/cast_index.npz')
+# Interaction lists whose records point at a cast (`target_hash`): likes and recasts of it, replies to it
+CAST_EDGE_TYPES = ('likes', 'recasts', 'casts')
+HASH_BYTES = 20
+HASH_DTYPE = f'S{HASH_BYTES}'
+
+_cast_index = None
+_cast_index_mtime = None
+_cast_index_lock = threading.Lock()
+
+
+def get_cast_index(path=CAST_INDEX_PATH):
+    """The cast index at `path`, or None if it hasn't been built; reloaded when the crawler rewrites it."""
+    global _cast_index, _cast_index_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if _cast_index is None or mtime != _cast_index_mtime:
+        with _cast_index_lock:
+            if _cast_index is None or mtime != _cast_index_mtime:
+                _cast_index = CastIndex.load(path)
+                _cast_index_mtime = mtime
+                logger.info(f"Loaded cast index with {len(_cast_index)} engagements with {len(_cast_index.hashes)} casts from {path}")
+    return _cast_index
+
+def parse_cast_hash(value):
+    """The raw bytes of a cast hash given in hex ('0x...'), or None if it isn't one."""
+    if not isinstance(value, str):
+        return None
+    try:
+        raw = bytes.fromhex(value[2:] if value.startswith('0x') else value)
+    except ValueError:
+        return None
+    return raw if len(raw) == HASH_BYTES else None
+
+def format_cast_hash(raw):
+    # Fixed-width byte strings drop their trailing zero bytes when read back
+    return '0x' + bytes(raw).ljust(HASH_BYTES, b'\0').hex()
+
+def user_engagements(fid, user_data):
+    """(cast hash, author, engager, edge type, timestamp) arrays of the casts a user liked, recast or replied to."""
+    hashes, authors, engagers, edge_types, timestamps = [], [], [], [], []
+    for edge_type in CAST_EDGE_TYPES:
+        type_id = EDGE_TYPES.index(edge_type)
+        for record in user_data.get(edge_type) or []:
+            raw = parse_cast_hash(record.get('target_hash'))
+            if raw is None:
+                continue  # Records crawled before replies kept their parent's hash
+            try:
+                author, engager = int(record['target']), int(record['source'])
+                timestamp = int(record['timestamp'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            hashes.append(raw)
+            authors.append(author)
+            engagers.append(engager)
+            edge_types.append(type_id)
+            timestamps.append(timestamp)
+    return (
+        np.array(hashes, dtype=HASH_DTYPE),
+        np.array(authors, dtype=np.uint32),
+        np.array(engagers, dtype=np.uint32),
+        np.array(edge_types, dtype=np.uint8),
+        np.array(timestamps, dtype=np.uint32)
+    )
+
+
+class CastIndex:
+    """
+    Engagement index of the cached corpus: cast hash -> its author and who liked, recast or replied to it.
+
+    Casts are stored in CSR form: `hashes` (sorted, 20-byte binary) with their `authors`
+    and `offsets` into the `engagers`, `edge_types` and `timestamps` columns, each cast's
+    engagements sorted by timestamp. A cast takes 32 bytes and an engagement 9 bytes.
+    Lookups by engager (which casts did this account engage with) go through an ordering
+    of the engagements by engager, built on first use.
+
+    Users are added with `add_user` (re-adding one replaces their engagements); additions
+    are buffered and merged in bulk by `merge` or `save`, as in `InboundIndex`.
+    """
+
+    def __init__(self, hashes=None, authors=None, offsets=None, engagers=None, edge_types=None, timestamps=None,
+                 indexed_fids=None):
+        self.hashes = hashes if hashes is not None else np.empty(0, dtype=HASH_DTYPE)
+        self.authors = authors if authors is not None else np.empty(0, dtype=np.uint32)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.engagers = engagers if engagers is not None else np.empty(0, dtype=np.uint32)
+        self.edge_types = edge_types if edge_types is not None else np.empty(0, dtype=np.uint8)
+        self.timestamps = timestamps if timestamps is not None else np.empty(0, dtype=np.uint32)
+        # Users whose records are in the index
+        self.indexed_fids = indexed_fids if indexed_fids is not None else np.empty(0, dtype=np.uint32)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._by_engager = None
+
+    @classmethod
+    def load(cls, path=CAST_INDEX_PATH):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def save(self, path=CAST_INDEX_PATH):
+        """Merge pending users and write the index; readers never see a partial file."""
+        self.merge()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path, hashes=self.hashes, authors=self.authors, offsets=self.offsets, engagers=self.engagers,
+            edge_types=self.edge_types, timestamps=self.timestamps, indexed_fids=self.indexed_fids
+        )
+        os.replace(tmp_path, path)
+        logger.info(f"Saved cast index with {len(self)} engagements with {len(self.hashes)} casts to {path}")
+
+    def __len__(self):
+        return len(self.engagers)
+
+    def add_user(self, fid, user_data):
+        """Queue the casts a user engaged with, replacing any already indexed for them."""
+        with self._lock:
+            self._pending[int(fid)] = user_engagements(fid, user_data)
+
+    def merge(self):
+        """Fold the pending users into the CSR arrays in one sort."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+        replaced = np.fromiter(pending, dtype=np.uint32, count=len(pending))
+        counts = np.diff(self.offsets)
+        keep = ~np.isin(self.engagers, replaced)
+
+        hashes = np.concatenate([np.repeat(self.hashes, counts)[keep]] + [p[0] for p in pending.values()])
+        authors = np.concatenate([np.repeat(self.authors, counts)[keep]] + [p[1] for p in pending.values()])
+        engagers = np.concatenate([self.engagers[keep]] + [p[2] for p in pending.values()])
+        edge_types = np.concatenate([self.edge_types[keep]] + [p[3] for p in pending.values()])
+        timestamps = np.concatenate([self.timestamps[keep]] + [p[4] for p in pending.values()])
+
+        order = np.lexsort((timestamps, hashes))
+        self.engagers, self.edge_types, self.timestamps = engagers[order], edge_types[order], timestamps[order]
+        self.hashes, first, counts = np.unique(hashes[order], return_index=True, return_counts=True)
+        self.authors = authors[order][first]
+        self.offsets = np.zeros(len(self.hashes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.indexed_fids = np.union1d(self.indexed_fids, replaced).astype(np.uint32)
+        self._by_engager = None
+
+    def engagements(self, cast_hash):
+        """
+        Who engaged with a cast: (author, engagers, edge type ids, timestamps), oldest first.
+
+        The author is None (and the arrays empty) for casts no indexed user engaged with.
+        """
+        raw = parse_cast_hash(cast_hash)
+        position = np.searchsorted(self.hashes, np.array(raw, dtype=HASH_DTYPE)) if raw is not None else 0
+        # Read back, a stored hash has lost its trailing zero bytes
+        if raw is None or position == len(self.hashes) or self.hashes[position] != raw.rstrip(b'\0'):
+            return None, self.engagers[:0], self.edge_types[:0], self.timestamps[:0]
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return str(self.authors[position]), self.engagers[start:end], self.edge_types[start:end], self.timestamps[start:end]
+
+    def _engager_order(self):
+        """(engagement positions sorted by engager, the engagers in that order, the cast of every engagement)."""
+        by_engager = self._by_engager
+        if by_engager is None:
+            order = np.argsort(self.engagers, kind='stable')
+            casts = np.repeat(np.arange(len(self.hashes)), np.diff(self.offsets))
+            by_engager = self._by_engager = (order, self.engagers[order], casts)
+        return by_engager
+
+    def engaged(self, fid):
+        """Positions of the engagements of `fid`, and the cast of each."""
+        order, sorted_engagers, casts = self._engager_order()
+        if not str(fid).isdigit():
+            return order[:0], casts[:0]
+        start, end = np.searchsorted(sorted_engagers, int(fid)), np.searchsorted(sorted_engagers, int(fid), side='right')
+        return order[start:end], casts[order[start:end]]
+
+    def _describe(self, cast, positions):
+        return {
+            'hash': format_cast_hash(self.hashes[cast]),
+            'author': str(self.authors[cast]),
+            'engagements': [
+                {'fid': str(engager), 'edge_type': EDGE_TYPES[edge_type].upper(), 'timestamp': timestamp}
+                for engager, edge_type, timestamp in zip(
+                    self.engagers[positions].tolist(), self.edge_types[positions].tolist(), self.timestamps[positions].tolist()
+                )
+            ],
+            'last_timestamp': int(self.timestamps[positions].max())
+        }
+
+    def _ranked(self, positions, casts, limit, num_engagers=None):
+        """
+        Describe the casts of some engagements, those with the most engagements (then the latest) first.
+
+        `num_engagers`, per cast in `np.unique(casts)` order, ranks ahead of the engagement count.
+        """
+        order = np.argsort(casts, kind='stable')
+        positions, casts = positions[order], casts[order]
+        unique_casts, starts, counts = np.unique(casts, return_index=True, return_counts=True)
+        last = np.maximum.reduceat(self.timestamps[positions], starts) if len(starts) else starts
+        keys = (last, counts) if num_engagers is None else (last, counts, num_engagers)
+        ranking = np.lexsort(keys)[::-1][:limit]
+        return [
+            self._describe(unique_casts[i], positions[starts[i]:starts[i] + counts[i]])
+            for i in ranking.tolist()
+        ]
+
+    def casts_between(self, engager, author, limit=None):
+        """
+        The casts by `author` that `engager` liked, recast or replied to, most engaged with first.
+
+        Returns:
+            List[dict]: `hash`, `author`, `engagements` (`fid`, `edge_type`, `timestamp`) and
+            `last_timestamp` of each cast.
+        """
+        if not str(author).isdigit():
+            return []
+        positions, casts = self.engaged(engager)
+        keep = self.authors[casts] == int(author)
+        return self._ranked(positions[keep], casts[keep], limit)
+
+    def co_engaged_casts(self, fids, limit=10, min_engagers=2):
+        """
+        The casts that several of `fids` engaged with, from the index alone.
+
+        Casts are ranked by how many of `fids` engaged with them, then by their number of
+        engagements from `fids` and how recent the last one is.
+
+        Returns:
+            List[dict]: As `casts_between`, plus the `engagers` among `fids`.
+        """
+        engaged = [self.engaged(fid) for fid in dict.fromkeys(str(fid) for fid in fids)]
+        if not engaged:
+            return []
+        positions = np.concatenate([p for p, _ in engaged])
+        casts = np.concatenate([c for _, c in engaged])
+
+        # Distinct engagers per cast, from the unique (cast, engager) pairs
+        pairs = np.unique(np.stack([casts, self.engagers[positions].astype(np.int64)]), axis=1)
+        candidates, num_engagers = np.unique(pairs[0], return_counts=True)
+        enough = num_engagers >= min_engagers
+        keep = np.isin(casts, candidates[enough])
+        results = self._ranked(positions[keep], casts[keep], limit, num_engagers=num_engagers[enough])
+        for result in results:
+            result['engagers'] = sorted({engagement['fid'] for engagement in result['engagements']}, key=int)
+        return results
+
+def build_index(fetcher, source='s3', data_dir='data/raw'):
+    """Index every cached user record, see `corpus_records`."""
+    index = CastIndex()
+    for fid, user_data in corpus_records(fetcher, source=source, data_dir=data_dir):
+        index.add_user(fid, user_data)
+    index.merge()
+    return index
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the cast engagement index over the cached users.")
+    parser.add_argument('--source', choices=['s3', 'local'], default='s3')
+    parser.add_argument('--data-dir', default='data/raw', help="Directory of user_<fid>_data.json files for --source local")
+    parser.add_argument('--output', default=CAST_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from src.data_ingestion.fetch_data import get_data_fetcher
+
+    index = build_index(get_data_fetcher(), source=args.source, data_dir=args.data_dir)
+    index.save(args.output)
+    print(f"Indexed {len(index.indexed_fids)} users: {len(index)} engagements with {len(index.hashes)} casts, written to {args.output}")
+
+if __name__ == "__main__":
+    main()
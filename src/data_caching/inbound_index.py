@@ -0,0 +1,218 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INBOUND_INDEX_PATH = os.getenv('CLOUD_CARTOGRAPHY_INBOUND_INDEX', 'data/index/inbound_index.npz')
+# Edge lists of a user's record, as named by `GraphBuilder.create_edges`
+EDGE_TYPES = ('likes', 'recasts', 'casts', 'following')
+# Postings pulled into a graph per core node, most recent first; keeps celebrities' graphs bounded
+INBOUND_MAX_EDGES_PER_NODE = 20000
+# The crawler writes the index out after this many new users
+INDEX_SAVE_EVERY = 100
+
+_inbound_index = None
+_inbound_index_mtime = None
+_inbound_index_lock = threading.Lock()
+
+
+def get_inbound_index(path=INBOUND_INDEX_PATH):
+    """
+    The inbound index at `path`, or None if it hasn't been built.
+
+    Reloaded when the crawler rewrites the file, so a running app picks up new postings.
+    """
+    global _inbound_index, _inbound_index_mtime
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    if _inbound_index is None or mtime != _inbound_index_mtime:
+        with _inbound_index_lock:
+            if _inbound_index is None or mtime != _inbound_index_mtime:
+                _inbound_index = InboundIndex.load(path)
+                _inbound_index_mtime = mtime
+                logger.info(f"Loaded inbound index with {len(_inbound_index)} postings from {path}")
+    return _inbound_index
+
+def user_postings(fid, user_data):
+    """(source, target, edge type, timestamp) arrays of the outgoing interactions in a user's record."""
+    sources, targets, edge_types, timestamps = [], [], [], []
+    for type_id, edge_type in enumerate(EDGE_TYPES):
+        for record in user_data.get(edge_type) or []:
+            try:
+                source, target = int(record['source']), int(record['target'])
+                timestamp = int(record['timestamp'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            sources.append(source)
+            targets.append(target)
+            edge_types.append(type_id)
+            timestamps.append(timestamp)
+    return (
+        np.array(sources, dtype=np.uint32),
+        np.array(targets, dtype=np.uint32),
+        np.array(edge_types, dtype=np.uint8),
+        np.array(timestamps, dtype=np.uint32)
+    )
+
+
+class InboundIndex:
+    """
+    Inverted index of the cached corpus: target FID -> who interacted with it.
+
+    Postings are stored in CSR form: `targets` (sorted) with `offsets` into the `sources`,
+    `edge_types` and `timestamps` columns, each target's postings sorted by timestamp.
+    FIDs and timestamps (Farcaster epoch seconds) fit in 32 bits, so a posting takes 9 bytes.
+
+    Users are added with `add_user` (re-adding one replaces its postings); additions are
+    buffered and merged in bulk by `merge` or `save`.
+    """
+
+    def __init__(self, targets=None, offsets=None, sources=None, edge_types=None, timestamps=None, indexed_fids=None):
+        self.targets = targets if targets is not None else np.empty(0, dtype=np.uint32)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.sources = sources if sources is not None else np.empty(0, dtype=np.uint32)
+        self.edge_types = edge_types if edge_types is not None else np.empty(0, dtype=np.uint8)
+        self.timestamps = timestamps if timestamps is not None else np.empty(0, dtype=np.uint32)
+        # Users whose records are in the index
+        self.indexed_fids = indexed_fids if indexed_fids is not None else np.empty(0, dtype=np.uint32)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=INBOUND_INDEX_PATH):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in data.files})
+
+    def save(self, path=INBOUND_INDEX_PATH):
+        """Merge pending users and write the index; readers never see a partial file."""
+        self.merge()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path, targets=self.targets, offsets=self.offsets, sources=self.sources,
+            edge_types=self.edge_types, timestamps=self.timestamps, indexed_fids=self.indexed_fids
+        )
+        os.replace(tmp_path, path)
+        logger.info(f"Saved inbound index with {len(self)} postings for {len(self.targets)} FIDs to {path}")
+
+    def __len__(self):
+        return len(self.sources)
+
+    def add_user(self, fid, user_data):
+        """Queue a user's outgoing interactions, replacing any already indexed for them."""
+        with self._lock:
+            self._pending[int(fid)] = user_postings(fid, user_data)
+
+    def merge(self):
+        """Fold the pending users into the CSR arrays in one sort."""
+        with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+
+        replaced = np.fromiter(pending, dtype=np.uint32, count=len(pending))
+        old_targets = np.repeat(self.targets, np.diff(self.offsets))
+        keep = ~np.isin(self.sources, replaced)
+
+        sources = np.concatenate([self.sources[keep]] + [p[0] for p in pending.values()])
+        targets = np.concatenate([old_targets[keep]] + [p[1] for p in pending.values()])
+        edge_types = np.concatenate([self.edge_types[keep]] + [p[2] for p in pending.values()])
+        timestamps = np.concatenate([self.timestamps[keep]] + [p[3] for p in pending.values()])
+
+        order = np.lexsort((timestamps, targets))
+        self.sources, self.edge_types, self.timestamps = sources[order], edge_types[order], timestamps[order]
+        self.targets, counts = np.unique(targets[order], return_counts=True)
+        self.offsets = np.zeros(len(self.targets) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.indexed_fids = np.union1d(self.indexed_fids, replaced).astype(np.uint32)
+
+    def postings(self, fid, limit=None):
+        """
+        Who interacted with `fid`: (sources, edge type ids, timestamps), oldest first.
+
+        Args:
+            fid (str): Target FID.
+            limit (int): Keep only the most recent `limit` postings.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: Views into the index; index
+            `EDGE_TYPES` with the edge type ids.
+        """
+        fid = int(fid) if str(fid).isdigit() else None
+        position = np.searchsorted(self.targets, fid) if fid is not None else 0
+        if fid is None or position == len(self.targets) or self.targets[position] != fid:
+            return self.sources[:0], self.edge_types[:0], self.timestamps[:0]
+        start, end = self.offsets[position], self.offsets[position + 1]
+        if limit is not None:
+            start = max(start, end - limit)
+        return self.sources[start:end], self.edge_types[start:end], self.timestamps[start:end]
+
+    def inbound_edges(self, fid, exclude_sources=(), limit=INBOUND_MAX_EDGES_PER_NODE):
+        """
+        Inbound interactions of `fid` as (source, target, attributes) triples for a graph.
+
+        Sources in `exclude_sources` are skipped; their own records already hold these edges.
+        """
+        sources, edge_types, timestamps = self.postings(fid, limit=limit)
+        excluded = {int(source) for source in exclude_sources if str(source).isdigit()}
+        return [
+            (str(source), fid, {'edge_type': EDGE_TYPES[edge_type].upper(), 'timestamp': timestamp})
+            for source, edge_type, timestamp in zip(sources.tolist(), edge_types.tolist(), timestamps.tolist())
+            if source not in excluded
+        ]
+
+def _local_records(data_dir):
+    for path in sorted(glob.glob(os.path.join(data_dir, 'user_*_data.json'))):
+        match = re.search(r'user_(\d+)_data\.json$', path)
+        if match:
+            yield match.group(1), path
+
+def corpus_records(fetcher, source='s3', data_dir='data/raw'):
+    """(FID, user data) of every cached user record, from S3 (as listed in the manifest) or from the local data directory."""
+    if source == 'local':
+        for fid, path in _local_records(data_dir):
+            with open(path) as f:
+                yield fid, json.load(f)
+    else:
+        from src.data_caching.manifest import list_corpus
+
+        # The manifest knows every cached user; without one, list the bucket's shards
+        entries = fetcher.manifest.entries if fetcher.manifest.available else list_corpus(fetcher)
+        for fid, entry in sorted(entries.items()):
+            user_data = fetcher.load_data_from_s3(fid, key=entry['key'])
+            if user_data:
+                yield fid, user_data
+
+def build_index(fetcher, source='s3', data_dir='data/raw'):
+    """Index every cached user record, see `corpus_records`."""
+    index = InboundIndex()
+    for fid, user_data in corpus_records(fetcher, source=source, data_dir=data_dir):
+        index.add_user(fid, user_data)
+    index.merge()
+    return index
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the inbound (follower/engagement) index over the cached users.")
+    parser.add_argument('--source', choices=['s3', 'local'], default='s3')
+    parser.add_argument('--data-dir', default='data/raw', help="Directory of user_<fid>_data.json files for --source local")
+    parser.add_argument('--output', default=INBOUND_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from src.data_ingestion.fetch_data import get_data_fetcher
+
+    index = build_index(get_data_fetcher(), source=args.source, data_dir=args.data_dir)
+    index.save(args.output)
+    print(f"Indexed {len(index.indexed_fids)} users: {len(index)} postings for {len(index.targets)} FIDs, written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, NoCredentialsError
+
+from src.data_caching.inbound_index import EDGE_TYPES
+from src.data_caching.payloads import encode_json, decompress_text
+from src.monitoring.metrics import observe_stage, record_fetch
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_KEY = 'manifest/users.json'
+MANIFEST_VERSION = 1
+# Version of the user records written by the crawler; bump when their format changes
+# (2: replies keep their parent cast's `target_hash`)
+USER_DATA_VERSION = 2
+# Records are spread over 256 prefixes (`users/00/` ... `users/ff/`), so listings and
+# parallel loads aren't limited by a single prefix's request rate
+SHARD_COUNT = 256
+SHARD_ROOT = 'users/'
+# Users crawled before sharding live at the bucket root
+LEGACY_PREFIX = 'user_'
+# A FID missing from the manifest reloads it at most this often, to see users crawled since
+MANIFEST_REFRESH_SECONDS = 60
+MANIFEST_SAVE_RETRIES = 5
+LISTING_WORKERS = 16
+
+_KEY_PATTERN = re.compile(r'(?:users/[0-9a-f]{2}/)?user_(\d+)_(data\.json|rollup\.npz)')
+
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def shard_prefix(fid):
+    return f"{SHARD_ROOT}{int(fid) % SHARD_COUNT:02x}/"
+
+def user_data_key(fid):
+    return f"{shard_prefix(fid)}user_{fid}_data.json"
+
+def rollup_key(fid):
+    return f"{shard_prefix(fid)}user_{fid}_rollup.npz"
+
+def edge_counts(user_data):
+    return {edge_type: len(user_data.get(edge_type) or []) for edge_type in EDGE_TYPES}
+
+def get_manifest(fetcher):
+    """The process-wide manifest, loaded from S3 on first use."""
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = CorpusManifest.load(fetcher)
+    return _manifest
+
+def save_manifest(fetcher):
+    """Save the entries recorded since the last save, without loading the manifest if nothing was recorded."""
+    if _manifest is None:
+        return True
+    return _manifest.save(fetcher)
+
+
+class CorpusManifest:
+    """
+    Index of the cached user corpus in S3: FID -> where the user's records are and what they hold.
+
+    Each entry has the record's `key`, its format `version`, when the user was crawled
+    (`crawled_at`, Unix time), its `size` in bytes and its `edge_counts` per interaction
+    type, plus `rollup_key` once the user has a rollup. The uploader keeps it up to date,
+    so readers know which FIDs are cached, and where, without a HEAD request per FID.
+
+    A manifest that doesn't exist in S3 yet is `available == False`; callers then fall back
+    to probing S3. Build it for an existing bucket with `python -m src.data_caching.manifest`.
+    """
+
+    def __init__(self, entries=None, etag=None, available=True):
+        self.entries = entries or {}
+        self.etag = etag
+        self.available = available
+        self.loaded_at = time.time()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, fetcher):
+        try:
+            with observe_stage('s3_get'):
+                response = fetcher.s3_client.get_object(Bucket=fetcher.bucket_name, Key=MANIFEST_KEY)
+                text, num_bytes = decompress_text(response['Body'], response.get('ContentEncoding'))
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                logger.error(f"Error loading the corpus manifest: {e}")
+            return cls(available=False)
+        except NoCredentialsError as e:
+            logger.error(f"Error loading the corpus manifest: {e}")
+            return cls(available=False)
+        record_fetch('s3', 'get_object', num_bytes)
+        with observe_stage('json_parse'):
+            manifest = json.loads(text)
+        if manifest.get('version', 0) > MANIFEST_VERSION:
+            raise ValueError(f"Manifest version {manifest['version']} is newer than supported version {MANIFEST_VERSION}")
+        logger.info(f"Loaded corpus manifest with {len(manifest['users'])} users")
+        return cls(manifest['users'], etag=response.get('ETag'))
+
+    def __contains__(self, fid):
+        return str(fid) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, fid):
+        return self.entries.get(str(fid))
+
+    def lookup(self, fetcher, fid):
+        """The entry of `fid`, reloading the manifest first if it's missing and the manifest is a while old."""
+        entry = self.get(fid)
+        if entry is None and time.time() - self.loaded_at > MANIFEST_REFRESH_SECONDS:
+            self.refresh(fetcher)
+            entry = self.get(fid)
+        return entry
+
+    def refresh(self, fetcher):
+        latest = CorpusManifest.load(fetcher)
+        with self._lock:
+            self.loaded_at = time.time()
+            if latest.available:
+                self.entries = {**latest.entries, **self._pending}
+                self.etag = latest.etag
+                self.available = True
+
+    def record(self, fid, **fields):
+        """Add or update the entry of `fid`; it's written out on the next `save`."""
+        fid = str(fid)
+        with self._lock:
+            entry = {**self.entries.get(fid, {}), **self._pending.get(fid, {}), **fields}
+            self.entries[fid] = entry
+            self._pending[fid] = entry
+
+    def save(self, fetcher, create=False):
+        """
+        Merge the recorded entries into the manifest in S3.
+
+        Several workers and crawlers update the manifest, so it is written conditionally on
+        the version last read; when another writer got there first, its entries are reloaded
+        and the merge retried. A manifest that doesn't exist yet is only written with
+        `create`: one holding just the users uploaded since would hide all the others.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        if not pending or not (self.available or create):
+            return True
+
+        for _ in range(MANIFEST_SAVE_RETRIES):
+            entries = {**self.entries, **pending}
+            body, content_encoding = encode_json({'version': MANIFEST_VERSION, 'users': entries})
+            put_args = {'IfMatch': self.etag} if self.etag else {'IfNoneMatch': '*'}
+            if content_encoding:
+                put_args['ContentEncoding'] = content_encoding
+            try:
+                with observe_stage('s3_put'):
+                    response = fetcher.s3_client.put_object(
+                        Bucket=fetcher.bucket_name, Key=MANIFEST_KEY, Body=body,
+                        ContentType='application/json', **put_args
+                    )
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+                    logger.error(f"Failed to save the corpus manifest: {e}")
+                    return False
+                self.refresh(fetcher)
+                continue
+            except NoCredentialsError as e:
+                logger.error(f"Failed to save the corpus manifest: {e}")
+                return False
+
+            with self._lock:
+                self.entries = {**entries, **self._pending}
+                self.etag = response.get('ETag')
+                self.available = True
+                for fid, entry in pending.items():
+                    if self._pending.get(fid) is entry:
+                        del self._pending[fid]
+            logger.info(f"Saved corpus manifest with {len(entries)} users ({len(pending)} updated)")
+            return True
+        logger.error(f"Gave up saving the corpus manifest after {MANIFEST_SAVE_RETRIES} conflicting writes")
+        return False
+
+
+def list_corpus(fetcher, workers=LISTING_WORKERS):
+    """
+    Every user record and rollup in the bucket, listed one shard prefix per request stream.
+
+    Returns:
+        Dict[str, dict]: Manifest entries per FID, without versions or edge counts. Sharded records win
+        over legacy ones at the bucket root.
+    """
+    def list_prefix(prefix):
+        objects = []
+        paginator = fetcher.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=fetcher.bucket_name, Prefix=prefix):
+            objects.extend(page.get('Contents', []))
+        return prefix, objects
+
+    prefixes = [LEGACY_PREFIX] + [f"{SHARD_ROOT}{shard:02x}/" for shard in range(SHARD_COUNT)]
+    entries = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # The legacy prefix comes first, so sharded records overwrite its entries
+        for prefix, objects in pool.map(list_prefix, prefixes):
+            for obj in objects:
+                match = _KEY_PATTERN.fullmatch(obj['Key'])
+                if not match:
+                    continue
+                entry = entries.setdefault(match.group(1), {})
+                if match.group(2) == 'rollup.npz':
+                    entry['rollup_key'] = obj['Key']
+                else:
+                    # A listing can't tell a record's version; entries already in the manifest keep theirs
+                    entry.update({'key': obj['Key'], 'crawled_at': obj['LastModified'].timestamp(), 'size': obj['Size']})
+    # Rollups without a user record aren't usable
+    return {fid: entry for fid, entry in entries.items() if 'key' in entry}
+
+def build_manifest(fetcher, counts=False, workers=LISTING_WORKERS):
+    """Manifest of everything in the bucket; with `counts`, every record is loaded (in parallel) for its edge counts."""
+    manifest = get_manifest(fetcher)
+    listed = list_corpus(fetcher, workers=workers)
+    if counts:
+        def count(fid):
+            user_data = fetcher.load_data_from_s3(fid, key=listed[fid]['key'])
+            return fid, edge_counts(user_data) if user_data else None
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for fid, user_edge_counts in pool.map(count, list(listed)):
+                if user_edge_counts is not None:
+                    listed[fid]['edge_counts'] = user_edge_counts
+    for fid, entry in listed.items():
+        manifest.record(fid, **entry)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the manifest of the cached user corpus from a bucket listing.")
+    parser.add_argument('--counts', action='store_true', help="Load every record to add its edge counts")
+    parser.add_argument('--workers', type=int, default=LISTING_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from src.data_ingestion.fetch_data import get_data_fetcher
+
+    fetcher = get_data_fetcher()
+    manifest = build_manifest(fetcher, counts=args.counts, workers=args.workers)
+    if manifest.save(fetcher, create=True):
+        print(f"Manifest of {len(manifest)} users written to s3://{fetcher.bucket_name}/{MANIFEST_KEY}")
+
+if __name__ == "__main__":
+    main()
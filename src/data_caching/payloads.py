@@ -0,0 +1,86 @@
+import codecs
+import gzip
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd payloads need the zstandard package; gzip is always available
+    zstandard = None
+
+# Content-Encoding of JSON objects written to S3: 'gzip', 'zstd' or 'none'
+S3_COMPRESSION = os.getenv('CLOUD_CARTOGRAPHY_S3_COMPRESSION', 'gzip')
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def encode_json(data, compression=S3_COMPRESSION):
+    """
+    Serialize `data` as (optionally compressed) JSON for S3.
+
+    Returns:
+        Tuple[bytes, Optional[str]]: The body, and its Content-Encoding (None if uncompressed).
+    """
+    raw = json.dumps(data).encode('utf-8')
+    if compression == 'zstd' and zstandard is None:
+        compression = 'gzip'
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), 'zstd'
+    if compression == 'gzip':
+        # mtime=0 keeps the bytes (and so the object's ETag) the same for the same data
+        return gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    return raw, None
+
+def _decompressor(content_encoding):
+    if content_encoding in (None, '', 'identity'):
+        return None
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if content_encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("Object is zstd-compressed; install the zstandard package to read it")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Unsupported Content-Encoding '{content_encoding}'")
+
+def iter_decoded(stream, content_encoding=None, chunk_size=READ_CHUNK_SIZE):
+    """Decompress and UTF-8 decode a (streaming) body chunk by chunk."""
+    decompressor = _decompressor(content_encoding)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        yield decoder.decode(chunk)
+    tail = decompressor.flush() if decompressor is not None and hasattr(decompressor, 'flush') else b''
+    yield decoder.decode(tail, final=True)
+
+def decompress_text(stream, content_encoding=None):
+    """
+    Decompress and decode a body from a file-like `stream` (e.g. a boto3 `StreamingBody`) into text.
+
+    Only the decompression streams: chunks are decompressed and decoded as they arrive, so the
+    compressed body is never read in full, but the whole text is returned and callers parse it
+    in one go. Peak memory is the text plus the parsed object, as with an uncompressed read.
+    Objects written before compression (no Content-Encoding) are read as they are.
+
+    Returns:
+        Tuple[str, int]: The text and the number of bytes read from `stream`.
+    """
+    counted = _CountingReader(stream)
+    text = ''.join(iter_decoded(counted, content_encoding))
+    return text, counted.bytes_read
+
+
+class _CountingReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
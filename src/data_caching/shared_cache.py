@@ -0,0 +1,142 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from src.monitoring.metrics import record_cache
+
+
+class SQLiteCache:
+    """
+    Size-bounded cache stored in a SQLite file, shared by every process that opens it.
+
+    Has the same interface as `LRUCache`, so a cache filled by one server worker serves all
+    of them. Values are pickled; each cache is a namespace in the same table and evicts its
+    least recently used entries beyond `max_entries`. Connections are opened lazily per
+    process and thread, so instances can be created before the server forks its workers.
+    """
+
+    def __init__(self, path, namespace, max_entries=128, ttl_seconds=None):
+        self.path = path
+        self.name = namespace
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_entries ('
+                ' namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,'
+                ' stored_at REAL NOT NULL, accessed_at REAL NOT NULL,'
+                ' PRIMARY KEY (namespace, key))'
+            )
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS cache_entries_lru ON cache_entries (namespace, accessed_at)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, str) else repr(key)
+
+    def get(self, key, default=None):
+        connection = self._connection()
+        key = self._key(key)
+        row = connection.execute(
+            'SELECT value, stored_at FROM cache_entries WHERE namespace = ? AND key = ?', (self.name, key)
+        ).fetchone()
+        hit = row is not None and not (self.ttl_seconds and time.time() - row[1] > self.ttl_seconds)
+        record_cache(self.name, hit)
+        if not hit:
+            return default
+        connection.execute(
+            'UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?', (time.time(), self.name, key)
+        )
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (self.name, self._key(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), now, now)
+            )
+            connection.execute(
+                'DELETE FROM cache_entries WHERE namespace = ? AND key IN ('
+                ' SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                (self.name, self.name, self.max_entries)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def __contains__(self, key):
+        row = self._connection().execute(
+            'SELECT stored_at FROM cache_entries WHERE namespace = ? AND key = ?', (self.name, self._key(key))
+        ).fetchone()
+        return row is not None and not (self.ttl_seconds and time.time() - row[0] > self.ttl_seconds)
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.name,)
+        ).fetchone()[0]
+
+
+class SQLiteLock:
+    """
+    Named, expiring locks in the shared SQLite file, for mutual exclusion across processes.
+
+    A lock that isn't released within `ttl_seconds` (e.g. because its holder died) is taken
+    over by the next caller.
+    """
+
+    def __init__(self, path, ttl_seconds=600):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache_locks ('
+                ' key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def acquire(self, key, owner):
+        """Try to take `key` for `owner` without blocking; returns whether it was taken."""
+        connection = self._connection()
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM cache_locks WHERE key = ? AND expires_at < ?', (key, now))
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO cache_locks (key, owner, expires_at) VALUES (?, ?, ?)',
+                (key, owner, now + self.ttl_seconds)
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def release(self, key, owner):
+        self._connection().execute('DELETE FROM cache_locks WHERE key = ? AND owner = ?', (key, owner))
@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+
+from src.data_caching.cache import SHARED_CACHE_ENV_VAR
+from src.monitoring.metrics import record_coalesced
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key so the work runs once.
+
+    Within a process, the first caller for a key runs the function and concurrent callers
+    wait for (and share) its result. When the shared SQLite cache is configured, the
+    running caller also holds a lock on the key there, so callers in other worker processes
+    wait until it's done and then run the function themselves. That function should check
+    the shared cache first: the follow-up run is then a cache hit instead of a second fetch.
+    """
+
+    def __init__(self, name, lock_ttl_seconds=600, poll_interval=0.25):
+        self.name = name
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+
+        path = os.getenv(SHARED_CACHE_ENV_VAR)
+        if path:
+            from src.data_caching.shared_cache import SQLiteLock
+            self._shared_lock = SQLiteLock(path, ttl_seconds=lock_ttl_seconds)
+        else:
+            self._shared_lock = None
+
+    def do(self, key, fn):
+        """Run `fn()` for `key`, unless a call for `key` is already in flight; return its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            record_coalesced(self.name, 'thread')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_exclusive(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_exclusive(self, key, fn):
+        if self._shared_lock is None:
+            return fn()
+
+        lock_key = f"{self.name}:{key}"
+        owner = f"{os.getpid()}:{threading.get_ident()}"
+        acquired = self._shared_lock.acquire(lock_key, owner)
+        if not acquired:
+            record_coalesced(self.name, 'process')
+        while not acquired:
+            time.sleep(self.poll_interval)
+            acquired = self._shared_lock.acquire(lock_key, owner)
+        try:
+            return fn()
+        finally:
+            self._shared_lock.release(lock_key, owner)
@@ -1,17 +1,61 @@
 import os
 import time
 import json
-import boto3 
+import threading
 from dotenv import load_dotenv
-import requests as r
-from requests import RequestException
 from botocore.exceptions import NoCredentialsError, ClientError
 import logging
-from datetime import datetime, timezone
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from src.monitoring.metrics import observe_stage, timed_stage, record_fetch, record_cache
+from src.monitoring.profiling import profiled
+from src.utils.lazy_import import lazy_import
+from src.data_caching.cache import make_cache
+from src.data_caching.cast_index import CastIndex, get_cast_index
+from src.data_caching.inbound_index import InboundIndex, get_inbound_index, INDEX_SAVE_EVERY
+from src.data_caching.manifest import get_manifest, save_manifest, user_data_key, rollup_key, edge_counts, USER_DATA_VERSION
+from src.data_caching.payloads import encode_json, decompress_text
+from src.data_caching.single_flight import SingleFlight
+from src.data_ingestion.rollups import build_rollup, rollup_bytes, parse_rollup, rollup_filename
+
+# boto3 and requests take ~250ms to import; defer them until the first fetch
+boto3 = lazy_import('boto3')
+botocore_config = lazy_import('botocore.config')
+r = lazy_import('requests')
 
 load_dotenv()
 
+# Connection pool sizes; the shared fetcher is used from every request thread
+S3_MAX_POOL_CONNECTIONS = 32
+HTTP_POOL_MAXSIZE = 16
+USER_DATA_CACHE_SIZE = 64
+# Rollups are a fraction of the size of the raw records, so many more of them are kept
+USER_ROLLUP_CACHE_SIZE = 1024
+PROFILE_CACHE_SIZE = 100000
+
+_data_fetcher = None
+_data_fetcher_lock = threading.Lock()
+
+
+def get_data_fetcher():
+    """Process-wide `DataFetcher`, created on first use."""
+    global _data_fetcher
+    if _data_fetcher is None:
+        with _data_fetcher_lock:
+            if _data_fetcher is None:
+                _data_fetcher = DataFetcher()
+    return _data_fetcher
+
 class DataFetcher:
+    """
+    Fetches user data from S3 and the Farcaster hub.
+
+    Safe to share between threads: the boto3 client is thread-safe and pooled, and every
+    thread gets its own pooled `requests.Session`. Use `get_data_fetcher()` rather than
+    constructing one per request.
+    """
+
     def __init__(self, data_dir="data/raw", max_age_seconds=86400):
         self.data_dir = data_dir
         self.max_age_seconds = max_age_seconds
@@ -20,13 +64,19 @@ class DataFetcher:
         self.AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY')
         self.AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
         os.makedirs(self.data_dir, exist_ok=True)
-        
-        self.s3_client = boto3.client(
-            's3',
-            region_name='us-east-1',
-            aws_access_key_id=self.AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=self.AWS_SECRET_ACCESS_KEY
-        )
+
+        # Created on first use, see `s3_client` and `http_session`
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+        self._local = threading.local()
+
+        # Parsed user data and profiles; shared between server workers in production
+        self.user_data_cache = make_cache('user_data', max_entries=USER_DATA_CACHE_SIZE, ttl_seconds=max_age_seconds)
+        self.profile_cache = make_cache('user_profiles', max_entries=PROFILE_CACHE_SIZE, ttl_seconds=max_age_seconds)
+        self.rollup_cache = make_cache('user_rollups', max_entries=USER_ROLLUP_CACHE_SIZE, ttl_seconds=max_age_seconds)
+        self._user_data_flight = SingleFlight('user_data')
+        self._rollup_flight = SingleFlight('user_rollups')
+        self._profiles_flight = SingleFlight('user_profiles')
         
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
@@ -34,14 +84,58 @@ class DataFetcher:
         # Farcaster Epoch (Jan 1, 2021 00:00:00 UTC)
         self.FARCASTER_EPOCH = datetime(2021, 1, 1, tzinfo=timezone.utc)
 
+    @property
+    def s3_client(self):
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    self._s3_client = boto3.client(
+                        's3',
+                        region_name='us-east-1',
+                        aws_access_key_id=self.AWS_ACCESS_KEY_ID,
+                        aws_secret_access_key=self.AWS_SECRET_ACCESS_KEY,
+                        config=botocore_config.Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+                    )
+        return self._s3_client
+
+    def http_session(self):
+        """This thread's keep-alive session for the hub and the Neynar API."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = r.Session()
+            adapter = r.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    @contextmanager
+    def background(self, pause):
+        """Run this thread's fetches as background work, calling `pause()` between hub pages and profile batches."""
+        self._local.pause = pause
+        try:
+            yield
+        finally:
+            self._local.pause = None
+
+    def _pause_if_background(self):
+        # Only called outside the profile single-flights, so a paused fetch never holds up another caller
+        pause = getattr(self._local, 'pause', None)
+        if pause is not None:
+            pause()
+
     def convert_timestamp(self, timestamp):
         """Convert Farcaster timestamp to UTC datetime."""
         return self.FARCASTER_EPOCH + timedelta(seconds=int(timestamp))
 
-    def check_s3_exists(self, fid: str) -> bool:
-        s3_key = f'user_{fid}_data.json'
+    @property
+    def manifest(self):
+        """The corpus manifest (see `src.data_caching.manifest`), loaded once per process."""
+        return get_manifest(self)
+
+    def s3_key_exists(self, s3_key) -> bool:
         try:
-            self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+            with observe_stage('s3_head'):
+                self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
             return True
         except ClientError as e:
             if e.response['Error']['Code'] == '404':
@@ -50,33 +144,113 @@ class DataFetcher:
                 self.logger.error(f"Error checking existence of {s3_key} in S3: {e}")
                 return False
 
-    def load_data_from_s3(self, fid: str):
-        s3_key = f'user_{fid}_data.json'
+    def locate_user_data(self, fid: str):
+        """S3 key of a user's record, or None if the user isn't cached."""
+        if self.manifest.available:
+            entry = self.manifest.lookup(self, fid)
+            return entry['key'] if entry else None
+        # No manifest yet: probe the sharded layout, then the legacy flat one
+        for s3_key in (user_data_key(fid), f'user_{fid}_data.json'):
+            if self.s3_key_exists(s3_key):
+                return s3_key
+        return None
+
+    def check_s3_exists(self, fid: str) -> bool:
+        return self.locate_user_data(fid) is not None
+
+    @profiled('DataFetcher.load_data_from_s3', context=lambda self, fid, key=None: ([fid], None))
+    def load_data_from_s3(self, fid: str, key=None):
+        s3_key = key or self.locate_user_data(fid)
+        if s3_key is None:
+            return None
         try:
-            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
-            content = response['Body'].read().decode('utf-8')
-            return json.loads(content)
-        except ClientError as e:
+            with observe_stage('s3_get'):
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+                # Decompressed while streaming in (older objects are uncompressed), then parsed whole
+                text, num_bytes = decompress_text(response['Body'], response.get('ContentEncoding'))
+            record_fetch('s3', 'get_object', num_bytes)
+            with observe_stage('json_parse'):
+                return json.loads(text)
+        except (ClientError, ValueError) as e:
             self.logger.error(f"Error loading data from S3 for FID {fid}: {e}")
             return None
 
     def upload_json_to_s3(self, data, fid: str):
-        s3_key = f'user_{fid}_data.json'
+        """Upload a user's record to its shard and record it in the manifest (saved by the caller)."""
+        s3_key = user_data_key(fid)
         try:
-            json_data = json.dumps(data)
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Body=json_data,
-                ContentType='application/json',
-                ACL='public-read'
-            )
+            body, content_encoding = encode_json(data)
+            with observe_stage('s3_put'):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=s3_key,
+                    Body=body,
+                    ContentType='application/json',
+                    ACL='public-read',
+                    **({'ContentEncoding': content_encoding} if content_encoding else {})
+                )
             self.logger.info(f"Successfully uploaded {s3_key} to {self.bucket_name}")
+            self.manifest.record(
+                fid, key=s3_key, version=USER_DATA_VERSION, crawled_at=time.time(),
+                size=len(body), encoding=content_encoding or 'identity', edge_counts=edge_counts(data)
+            )
             return True
         except (NoCredentialsError, ClientError) as e:
             self.logger.error(f"Failed to upload {s3_key} to {self.bucket_name}. Error: {e}")
             return False
 
+    def load_rollup_from_s3(self, fid: str):
+        if self.manifest.available:
+            entry = self.manifest.lookup(self, fid)
+            s3_keys = [entry['rollup_key']] if entry and 'rollup_key' in entry else []
+        else:
+            s3_keys = [rollup_key(fid), rollup_filename(fid)]
+        for s3_key in s3_keys:
+            try:
+                with observe_stage('s3_get'):
+                    response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+                    body = response['Body'].read()
+                record_fetch('s3', 'get_object', len(body))
+                return parse_rollup(body)
+            except ClientError as e:
+                # Users crawled before rollups existed simply don't have one yet
+                if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                    self.logger.error(f"Error loading rollup from S3 for FID {fid}: {e}")
+                    return None
+            except NoCredentialsError as e:
+                self.logger.error(f"Error loading rollup from S3 for FID {fid}: {e}")
+                return None
+        return None
+
+    def save_rollup(self, rollup, fid: str, upload=True):
+        """
+        Write a user's rollup next to the raw data: in the data directory and (if `upload`) in
+        its S3 shard, recorded in the manifest (saved by the caller).
+        """
+        body = rollup_bytes(rollup)
+        path = os.path.join(self.data_dir, rollup_filename(fid))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        if not upload:
+            return True
+        try:
+            with observe_stage('s3_put'):
+                self.s3_client.put_object(
+                    Bucket=self.bucket_name,
+                    Key=rollup_key(fid),
+                    Body=body,
+                    ContentType='application/octet-stream',
+                    ACL='public-read'
+                )
+            self.manifest.record(fid, rollup_key=rollup_key(fid))
+            return True
+        except (NoCredentialsError, ClientError) as e:
+            self.logger.error(f"Failed to upload {rollup_key(fid)} to {self.bucket_name}. Error: {e}")
+            return False
+
+    @timed_stage('hub_query')
     def query_neynar_hub(self, endpoint, params=None):
         base_url = "https://hub-api.neynar.com/v1/"
         headers = {
@@ -92,17 +266,18 @@ class DataFetcher:
         retry_delay = 1
 
         while True:
+            self._pause_if_background()
             for attempt in range(max_retries):
                 try:
                     time.sleep(0.1)
-                    response = r.get(url, headers=headers, params=params)
+                    with observe_stage('hub_page'):
+                        response = self.http_session().get(url, headers=headers, params=params)
                     response.raise_for_status()
+                    record_fetch('hub', endpoint, len(response.content))
                     data = response.json()
                     
                     if 'messages' in data:
-                        for message in data['messages']:
-                            if 'timestamp' in message.get('data', {}):
-                                message['data']['timestamp'] = self.convert_timestamp(message['data']['timestamp']).isoformat()
+                        # Timestamps stay Farcaster-epoch seconds, as in the cached corpus; see `convert_timestamp`
                         all_messages.extend(data['messages'])
                         self.logger.info(f"Retrieved {len(all_messages)} messages total...")
                     
@@ -112,7 +287,7 @@ class DataFetcher:
                     else:
                         return all_messages
                     
-                except RequestException as e:
+                except r.RequestException as e:
                     if attempt == max_retries - 1:
                         self.logger.error(f"Failed after {max_retries} attempts. Error: {e}")
                         return all_messages
@@ -133,13 +308,15 @@ class DataFetcher:
 
         try:
             time.sleep(0.1)
-            response = r.get(base_url, headers=headers, params=params)
+            with observe_stage('neynar_user_bulk'):
+                response = self.http_session().get(base_url, headers=headers, params=params)
             response.raise_for_status()
+            record_fetch('neynar_api', 'user/bulk', len(response.content))
             data = response.json()
             if 'users' not in data:
                 self.logger.warning(f"Unexpected response format. Response: {data}")
             return data
-        except RequestException as e:
+        except r.RequestException as e:
             self.logger.error(f"Error querying Neynar API: {e}")
             if hasattr(e, 'response') and e.response is not None:
                 self.logger.error(f"Response status code: {e.response.status_code}")
@@ -238,6 +415,7 @@ class DataFetcher:
         cast_data_list = [{
             'source': str(fid),
             'target': str(message['data']['castAddBody']['parentCastId']['fid']),
+            'target_hash': message['data']['castAddBody']['parentCastId'].get('hash'),
             'timestamp': message['data']['timestamp'],
             'edge_type': 'REPLIED'
         } for message in messages 
@@ -248,6 +426,8 @@ class DataFetcher:
         self.logger.info(f"Retrieved {len(cast_data_list)} replies for user: {fid}...")
         return cast_data_list
 
+    @timed_stage('fetch_user_data')
+    @profiled('DataFetcher.get_user_data', context=lambda self, fid: ([fid], None))
     def get_user_data(self, fid):
         return {
             'core_node_metadata': self.get_user_metadata(fid),
@@ -271,46 +451,130 @@ class DataFetcher:
         return unique_fids
 
     def get_user_metadata_for_connections(self, user_object):
-        all_fids = list(self.collect_connections_ids(user_object))
+        # Sorted, so equal connection sets split into equal batches that can be coalesced
+        all_fids = sorted(self.collect_connections_ids(user_object))
         user_metadata_list = []
 
         for i in range(0, len(all_fids), 100):
             batch = all_fids[i:i+100]
-            response = self.query_neynar_api_for_users(batch)
-            
-            if response and 'users' in response:
-                user_metadata_list.extend([{
-                    'fid': str(user['fid']),
-                    'username': user.get('username'),
-                    'display_name': user.get('display_name'),
-                    'pfp_url': user.get('pfp_url'),
-                    'follower_count': user.get('follower_count'),
-                    'following_count': user.get('following_count')
-                } for user in response['users']])
+            self._pause_if_background()
+            user_metadata_list.extend(self._profiles_flight.do(','.join(batch), lambda: self.get_user_profiles(batch)))
 
         return user_metadata_list
 
+    def get_user_profiles(self, fids):
+        """Profile metadata for `fids`: cached profiles plus one bulk Neynar query for the rest."""
+        profiles = {}
+        missing = []
+        for fid in fids:
+            profile = self.profile_cache.get(fid)
+            if profile is None:
+                missing.append(fid)
+            else:
+                profiles[fid] = profile
+
+        if missing:
+            response = self.query_neynar_api_for_users(missing)
+            if response and 'users' in response:
+                for user in response['users']:
+                    profile = {
+                        'fid': str(user['fid']),
+                        'username': user.get('username'),
+                        'display_name': user.get('display_name'),
+                        'pfp_url': user.get('pfp_url'),
+                        'follower_count': user.get('follower_count'),
+                        'following_count': user.get('following_count')
+                    }
+                    self.profile_cache.set(profile['fid'], profile)
+                    profiles[profile['fid']] = profile
+
+        return [profiles[fid] for fid in fids if fid in profiles]
+
+    def load_user_data(self, fid):
+        """User data from the cache, S3 or (uploading it to S3 afterwards) the hub."""
+        user_data = self.user_data_cache.get(fid)
+        if user_data is not None:
+            self.logger.info(f"Data for FID {fid} found in the user data cache.")
+            return user_data
+
+        s3_key = self.locate_user_data(fid)
+        record_cache('s3_user_data', s3_key is not None)
+        if s3_key is not None:
+            self.logger.info(f"Data for FID {fid} exists in S3. Loading from S3.")
+            user_data = self.load_data_from_s3(fid, key=s3_key)
+        else:
+            self.logger.info(f"Data for FID {fid} not found in S3. Fetching from API.")
+            user_data = self.get_user_data(fid)
+            if user_data:
+                self.logger.info(f"Collecting connections metadata for FID: {fid}")
+                connections_metadata = self.get_user_metadata_for_connections(user_data)
+                user_data['connections_metadata'] = connections_metadata
+                self.upload_json_to_s3(user_data, fid)
+                self.save_rollup(build_rollup(user_data), fid)
+        if user_data:
+            self.user_data_cache.set(fid, user_data)
+        return user_data
+
+    def load_rollup(self, fid):
+        """
+        A user's interaction rollup from the cache, the data directory or S3.
+
+        Users crawled before rollups existed have theirs derived from the raw data once
+        and saved for next time.
+        """
+        rollup = self.rollup_cache.get(fid)
+        if rollup is not None:
+            return rollup
+
+        path = os.path.join(self.data_dir, rollup_filename(fid))
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                rollup = parse_rollup(f.read())
+        else:
+            rollup = self.load_rollup_from_s3(fid)
+            record_cache('s3_user_rollup', rollup is not None)
+            if rollup is not None:
+                self.save_rollup(rollup, fid, upload=False)
+            else:
+                self.logger.info(f"No rollup for FID {fid}; deriving it from the raw data.")
+                user_data = self._user_data_flight.do(fid, lambda: self.load_user_data(fid))
+                if user_data:
+                    rollup = build_rollup(user_data)
+                    self.save_rollup(rollup, fid)
+        if rollup is not None:
+            self.rollup_cache.set(fid, rollup)
+        return rollup
+
+    @timed_stage('get_all_users_rollups')
+    def get_all_users_rollups(self, fids):
+        """Interaction rollups for `fids`, the compact counterpart of `get_all_users_data`."""
+        all_rollups = {}
+        for fid in fids:
+            rollup = self._rollup_flight.do(fid, lambda: self.load_rollup(fid))
+            if rollup is not None:
+                all_rollups[fid] = rollup
+            else:
+                self.logger.warning(f"Failed to retrieve rollup for FID {fid}")
+        # Users uploaded above are recorded in the manifest; written out once for the whole load
+        save_manifest(self)
+        return all_rollups
+
+    @timed_stage('get_all_users_data')
+    @profiled('DataFetcher.get_all_users_data', context=lambda self, fids: (fids, None))
     def get_all_users_data(self, fids):
         all_user_data = {}
         for fid in fids:
             self.logger.info(f"Processing FID: {fid}")
-            if self.check_s3_exists(fid):
-                self.logger.info(f"Data for FID {fid} exists in S3. Loading from S3.")
-                user_data = self.load_data_from_s3(fid)
-            else:
-                self.logger.info(f"Data for FID {fid} not found in S3. Fetching from API.")
-                user_data = self.get_user_data(fid)
-                if user_data:
-                    self.logger.info(f"Collecting connections metadata for FID: {fid}")
-                    connections_metadata = self.get_user_metadata_for_connections(user_data)
-                    user_data['connections_metadata'] = connections_metadata
-                    self.upload_json_to_s3(user_data, fid)
+            # Concurrent builds for the same FID (in any worker) share one fetch
+            user_data = self._user_data_flight.do(fid, lambda: self.load_user_data(fid))
 
             if user_data:
                 all_user_data[fid] = user_data
             else:
                 self.logger.warning(f"Failed to retrieve data for FID {fid}")
 
+        # Users uploaded above are recorded in the manifest; written out once for the whole load
+        save_manifest(self)
         return all_user_data
 
     def get_all_users_data_s3(self, fids):
@@ -324,6 +588,9 @@ class DataFetcher:
         """
         total_users = len(fids)
         processed_users = 0
+        # Keep the inbound and cast indexes in step with the corpus as users are crawled
+        inbound_index = get_inbound_index() or InboundIndex()
+        cast_index = get_cast_index() or CastIndex()
 
         for fid in fids:
             try:
@@ -344,14 +611,20 @@ class DataFetcher:
                 print(f"Added connections metadata to user data for FID: {fid}")
 
                 # Upload user data to S3
-                s3_key = f'user_{fid}_data.json'
-                upload_success = self.upload_json_to_s3(user_data, s3_key)
+                upload_success = self.upload_json_to_s3(user_data, fid)
                 if upload_success:
                     print(f"Successfully uploaded data for FID: {fid} to S3.")
+                    self.save_rollup(build_rollup(user_data), fid)
+                    inbound_index.add_user(fid, user_data)
+                    cast_index.add_user(fid, user_data)
                 else:
                     print(f"Failed to upload data for FID: {fid} to S3.")
 
                 processed_users += 1
+                if processed_users % INDEX_SAVE_EVERY == 0:
+                    inbound_index.save()
+                    cast_index.save()
+                    self.manifest.save(self)
 
             except Exception as e:
                 print(f"An error occurred while processing FID {fid}: {str(e)}")
@@ -359,6 +632,9 @@ class DataFetcher:
 
             print(f"Completed processing for FID: {fid}\n")
 
+        inbound_index.save()
+        cast_index.save()
+        self.manifest.save(self)
         print(f"Finished processing {processed_users} out of {total_users} users.")
         if processed_users < total_users:
             print(f"Warning: {total_users - processed_users} users were not processed successfully.")        
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from src.data_ingestion.fetch_data import get_data_fetcher
+from src.monitoring.metrics import record_prefetch
+
+logger = logging.getLogger(__name__)
+
+# Background fetches run on a small pool and are capped per hour (per process)
+PREFETCH_MAX_WORKERS = 2
+PREFETCH_QUOTA_PER_HOUR = 200
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Process-wide `Prefetcher`, created on first use."""
+    global _prefetcher
+    if _prefetcher is None:
+        with _prefetcher_lock:
+            if _prefetcher is None:
+                _prefetcher = Prefetcher(get_data_fetcher())
+    return _prefetcher
+
+class Prefetcher:
+    """
+    Warms the user data (or rollup) cache for FIDs a user is likely to add to their query next.
+
+    Prefetches run in the background, at most `max_workers` at a time and `quota_per_hour`
+    per hour. They yield to foreground work: a prefetch only starts while no request is
+    inside `foreground()`, and one already running pauses between hub pages and profile
+    batches until none is, so they never compete with a user's own build for the hub.
+    A prefetch of a FID a foreground request is building keeps going: that request is
+    waiting for it.
+    """
+
+    def __init__(self, fetcher, max_workers=PREFETCH_MAX_WORKERS, quota_per_hour=PREFETCH_QUOTA_PER_HOUR):
+        self.fetcher = fetcher
+        self.quota_per_hour = quota_per_hour
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._started = deque()  # Start times of prefetches in the last hour
+        self._foreground = 0
+        self._foreground_fids = Counter()
+        self._idle = threading.Condition(self._lock)
+
+    @contextmanager
+    def foreground(self, fids=()):
+        """Mark a user-facing request for `fids` as running; prefetches of other FIDs wait until none are."""
+        fids = [str(fid) for fid in fids]
+        with self._lock:
+            self._foreground += 1
+            self._foreground_fids.update(fids)
+            # A paused prefetch of one of `fids` now has a request waiting on it
+            self._idle.notify_all()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._foreground -= 1
+                self._foreground_fids.subtract(fids)
+                self._foreground_fids = +self._foreground_fids
+                self._idle.notify_all()
+
+    def _yield_to_foreground(self, fid):
+        with self._lock:
+            while self._foreground and not self._foreground_fids[fid]:
+                self._idle.wait()
+
+    def schedule(self, fids, rollups=False):
+        """Queue background fetches for `fids` that aren't cached or already queued; `rollups` fetches their rollups instead."""
+        cache = self.fetcher.rollup_cache if rollups else self.fetcher.user_data_cache
+        scheduled = []
+        for fid in fids:
+            fid = str(fid)
+            if fid in cache:
+                record_prefetch('cached')
+                continue
+            with self._lock:
+                if fid in self._pending:
+                    continue
+                self._pending.add(fid)
+            self._executor.submit(self._prefetch, fid, rollups)
+            scheduled.append(fid)
+        if scheduled:
+            logger.info(f"Scheduled prefetch for FIDs: {scheduled}")
+        return scheduled
+
+    def _take_quota(self):
+        with self._lock:
+            now = time.time()
+            while self._started and now - self._started[0] > 3600:
+                self._started.popleft()
+            if len(self._started) >= self.quota_per_hour:
+                return False
+            self._started.append(now)
+            return True
+
+    def _prefetch(self, fid, rollups=False):
+        try:
+            self._yield_to_foreground(fid)
+            if not self._take_quota():
+                record_prefetch('over_quota')
+                return
+            # Goes through the same single-flight path as a foreground build of this FID
+            with self.fetcher.background(lambda: self._yield_to_foreground(fid)):
+                if rollups:
+                    self.fetcher.get_all_users_rollups([fid])
+                else:
+                    self.fetcher.get_all_users_data([fid])
+            record_prefetch('fetched')
+        except Exception as e:
+            record_prefetch('failed')
+            logger.warning(f"Prefetch for FID {fid} failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(fid)
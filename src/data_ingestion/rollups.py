@@ -0,0 +1,93 @@
+import io
+import json
+import logging
+from collections import Counter
+
+import numpy as np
+
+from src.data_caching.inbound_index import EDGE_TYPES
+
+# One day; far finer than the time slider's steps on any real timeline
+ROLLUP_BUCKET_SECONDS = 86400
+ROLLUP_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def rollup_filename(fid):
+    return f'user_{fid}_rollup.npz'
+
+def build_rollup(user_data, bucket_seconds=ROLLUP_BUCKET_SECONDS):
+    """
+    Roll a user's raw interactions up into counts per (source, target, edge type, time bucket).
+
+    Rows keep the order in which each combination first appears in the raw record, and
+    the node metadata is carried over, so a graph can be built from the rollup alone.
+
+    Returns:
+        dict: `source`, `target`, `edge_type` (index into `EDGE_TYPES`), `bucket` and
+        `count` arrays, plus `bucket_seconds`, `core_node_metadata` and `connections_metadata`.
+    """
+    rows = Counter()
+    skipped = 0
+    for type_id, edge_type in enumerate(EDGE_TYPES):
+        for record in user_data.get(edge_type) or []:
+            try:
+                key = (int(record['source']), int(record['target']), type_id, int(record['timestamp']) // bucket_seconds)
+            except (KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+            rows[key] += 1
+    if skipped:
+        fid = user_data.get('core_node_metadata', {}).get('fid')
+        logger.warning(f"Skipped {skipped} records of FID {fid} without an integer source, target and timestamp")
+
+    columns = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+    return {
+        'source': columns[:, 0].astype(np.uint32),
+        'target': columns[:, 1].astype(np.uint32),
+        'edge_type': columns[:, 2].astype(np.uint8),
+        'bucket': columns[:, 3].astype(np.int32),
+        'count': np.fromiter(rows.values(), dtype=np.uint32, count=len(rows)),
+        'bucket_seconds': bucket_seconds,
+        'core_node_metadata': user_data.get('core_node_metadata', {}),
+        'connections_metadata': user_data.get('connections_metadata', [])
+    }
+
+def rollup_bytes(rollup):
+    """Serialize a rollup as a compressed npz; the metadata travels as a JSON blob."""
+    metadata = json.dumps({
+        'version': ROLLUP_VERSION,
+        'bucket_seconds': rollup['bucket_seconds'],
+        'core_node_metadata': rollup['core_node_metadata'],
+        'connections_metadata': rollup['connections_metadata']
+    }).encode('utf-8')
+    buffer = io.BytesIO()
+    np.savez_compressed(
+        buffer, source=rollup['source'], target=rollup['target'], edge_type=rollup['edge_type'],
+        bucket=rollup['bucket'], count=rollup['count'], metadata=np.frombuffer(metadata, dtype=np.uint8)
+    )
+    return buffer.getvalue()
+
+def parse_rollup(data):
+    with np.load(io.BytesIO(data)) as npz:
+        metadata = json.loads(npz['metadata'].tobytes().decode('utf-8'))
+        if metadata.get('version', 0) > ROLLUP_VERSION:
+            raise ValueError(f"Rollup version {metadata['version']} is newer than supported version {ROLLUP_VERSION}")
+        rollup = {name: npz[name] for name in ('source', 'target', 'edge_type', 'bucket', 'count')}
+    rollup['bucket_seconds'] = metadata['bucket_seconds']
+    rollup['core_node_metadata'] = metadata['core_node_metadata']
+    rollup['connections_metadata'] = metadata['connections_metadata']
+    return rollup
+
+def rollup_edges(rollup):
+    """Graph edges of a rollup: one per row, stamped with its bucket's start and carrying its `count`."""
+    bucket_seconds = rollup['bucket_seconds']
+    edge_types = [edge_type.upper() for edge_type in EDGE_TYPES]
+    return (
+        (str(source), str(target), {'edge_type': edge_types[edge_type], 'timestamp': bucket * bucket_seconds, 'count': count})
+        for source, target, edge_type, bucket, count in zip(
+            rollup['source'].tolist(), rollup['target'].tolist(), rollup['edge_type'].tolist(),
+            rollup['bucket'].tolist(), rollup['count'].tolist()
+        )
+    )
@@ -0,0 +1,204 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.data_caching.cache import SHARED_CACHE_ENV_VAR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARED_CACHE_PATH = "data/cache/shared_cache.db"
+DEFAULT_OUTPUT_DIR = "data/processed"
+FETCH_THREADS = 8
+
+# User data loaded once by the parent; forked workers read it through copy-on-write pages
+_shared_user_data = {}
+
+
+def read_fid_sets(path, pairs=False):
+    """
+    Read FID sets from `path`, dropping duplicates while keeping the file order.
+
+    The file is either a JSON list of lists or one set per line, comma or whitespace
+    separated, with `#` comments. With `pairs`, the file lists single FIDs and every
+    pair of them becomes a set.
+
+    Returns:
+        List[Tuple[str, ...]]: The FID sets.
+    """
+    with open(path) as f:
+        content = f.read()
+
+    if content.lstrip().startswith('['):
+        entries = json.loads(content)
+        if pairs:
+            entries = [[fid] for fid in entries]
+        fid_sets = [[str(fid) for fid in entry] for entry in entries]
+    else:
+        fid_sets = []
+        for line in content.splitlines():
+            line = line.split('#', 1)[0].replace(',', ' ').split()
+            if line:
+                fid_sets.append(line)
+
+    if pairs:
+        fids = list(dict.fromkeys(fid for fid_set in fid_sets for fid in fid_set))
+        fid_sets = [list(pair) for pair in itertools.combinations(fids, 2)]
+
+    return list(dict.fromkeys(tuple(fid_set) for fid_set in fid_sets if fid_set))
+
+def load_users(fids, threads=FETCH_THREADS):
+    """Load every user (their rollup with `USE_ROLLUPS`) once, from the local/S3 cache or the API, a few at a time."""
+    from src.data_ingestion.fetch_data import get_data_fetcher
+    from src.graph_viz.config import USE_ROLLUPS
+
+    fetcher = get_data_fetcher()
+    load = fetcher.get_all_users_rollups if USE_ROLLUPS else fetcher.get_all_users_data
+    all_user_data = {}
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for result in executor.map(lambda fid: load([fid]), fids):
+            all_user_data.update(result)
+    return all_user_data
+
+def _init_worker(user_data):
+    # With fork the argument is inherited rather than pickled, so this is only a reference
+    global _shared_user_data
+    _shared_user_data = user_data
+    # Keep the workers' per-edge-type logs out of the batch output
+    logging.getLogger('src').setLevel(logging.WARNING)
+
+def build_fid_set(fid_set, output, top_n=None, lod=False, layout=True, output_dir=DEFAULT_OUTPUT_DIR, file_format='snapshot'):
+    """
+    Build the subgraph of one FID set from the shared user data and write it out.
+
+    Args:
+        fid_set (Tuple[str, ...]): Core FIDs.
+        output (str): 'cache' to store the subgraph where the app and API look it up,
+            'processed' to save the filtered graph under `output_dir`.
+        file_format (str): 'snapshot' or 'json', for the 'processed' output.
+
+    Returns:
+        dict: Summary of the build, with an `error` on failure.
+    """
+    from src.graph_processing.build_graph import get_graph_builder
+    from src.graph_viz.config import TOP_N_NODES, USE_ROLLUPS
+    from src.graph_viz.network_analysis import filter_graph
+    from src.graph_viz.subgraphs import build_subgraph, store_subgraph
+
+    core_nodes = list(fid_set)
+    summary = {'fids': core_nodes}
+    start = time.perf_counter()
+    try:
+        missing = [fid for fid in core_nodes if fid not in _shared_user_data]
+        if missing:
+            raise ValueError(f"No data for FIDs {missing}")
+
+        gb = get_graph_builder()
+        build = gb.build_graph_from_rollups if USE_ROLLUPS else gb.build_graph_from_data
+        G = build({fid: _shared_user_data[fid] for fid in core_nodes})
+        if output == 'cache':
+            subgraph, _ = build_subgraph(G, core_nodes, lod=lod, top_n=top_n, layout=layout)
+            store_subgraph(core_nodes, subgraph, lod=lod, top_n=top_n, layout=layout)
+            summary['nodes'] = subgraph['node_count']
+            summary['edges'] = subgraph['edge_count']
+        else:
+            filtered_G = filter_graph(G, core_nodes, top_n=top_n or TOP_N_NODES)
+            if file_format == 'json':
+                gb.save_graph_as_json(filtered_G, core_nodes, output_dir=output_dir)
+            else:
+                gb.save_graph_snapshot(filtered_G, core_nodes, output_dir=output_dir)
+            summary['nodes'] = filtered_G.number_of_nodes()
+            summary['edges'] = filtered_G.number_of_edges()
+    except Exception as e:
+        # One bad set (e.g. no interactions between the users) must not stop the batch
+        summary['error'] = f"{type(e).__name__}: {e}"
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+def _build_task(task):
+    fid_set, options = task
+    return build_fid_set(fid_set, **options)
+
+def run_batch(fid_sets, output='cache', workers=None, top_n=None, lod=False, layout=True, output_dir=DEFAULT_OUTPUT_DIR,
+              file_format='snapshot'):
+    """
+    Precompute the subgraphs of many FID sets.
+
+    Each distinct user is loaded once by this process before the pool starts, so the
+    workers share it instead of fetching or parsing it again per set.
+
+    Yields:
+        dict: One summary per FID set, in completion order.
+    """
+    distinct_fids = list(dict.fromkeys(fid for fid_set in fid_sets for fid in fid_set))
+    logger.warning(f"Loading {len(distinct_fids)} distinct users for {len(fid_sets)} FID sets")
+    user_data = load_users(distinct_fids)
+
+    options = {
+        'output': output, 'top_n': top_n, 'lod': lod, 'layout': layout, 'output_dir': output_dir, 'file_format': file_format
+    }
+    tasks = [(fid_set, options) for fid_set in fid_sets]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(user_data)
+        yield from map(_build_task, tasks)
+        return
+
+    methods = multiprocessing.get_all_start_methods()
+    # Fork shares the loaded data for free; elsewhere each worker receives one pickled copy
+    context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+    with context.Pool(processes=workers, initializer=_init_worker, initargs=(user_data,)) as pool:
+        yield from pool.imap_unordered(_build_task, tasks)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute subgraphs for many FID sets in parallel.")
+    parser.add_argument('fid_sets', help="File with one FID set per line (or a JSON list of lists)")
+    parser.add_argument('--pairs', action='store_true', help="The file lists single FIDs; build every pair of them")
+    parser.add_argument('--output', choices=['cache', 'processed'], default='cache',
+                        help="Write to the shared subgraph cache or to graph files in --output-dir")
+    parser.add_argument('--cache-path', help=f"Shared cache database (default: ${SHARED_CACHE_ENV_VAR} or {DEFAULT_SHARED_CACHE_PATH})")
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--format', choices=['snapshot', 'json'], default='snapshot', help="File format of --output processed")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument('--top-n', type=int, help="Non-core nodes kept per subgraph (default: the app's)")
+    parser.add_argument('--lod', action='store_true', help="Build level-of-detail views, as the app's large graph mode does")
+    parser.add_argument('--no-layout', action='store_true', help="Skip preset positions (enough for API clients)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('src').setLevel(logging.WARNING)
+
+    if args.output == 'cache':
+        # The caches are created on import, so the path must be set before the app modules load
+        os.environ[SHARED_CACHE_ENV_VAR] = args.cache_path or os.getenv(SHARED_CACHE_ENV_VAR) or DEFAULT_SHARED_CACHE_PATH
+        os.makedirs(os.path.dirname(os.environ[SHARED_CACHE_ENV_VAR]) or '.', exist_ok=True)
+
+    fid_sets = read_fid_sets(args.fid_sets, pairs=args.pairs)
+    if not fid_sets:
+        parser.error(f"No FID sets in {args.fid_sets}")
+
+    start = time.perf_counter()
+    failed = 0
+    results = run_batch(
+        fid_sets, output=args.output, workers=args.workers, top_n=args.top_n,
+        lod=args.lod, layout=not args.no_layout, output_dir=args.output_dir, file_format=args.format
+    )
+    for i, summary in enumerate(results, 1):
+        fids = ','.join(summary['fids'])
+        if 'error' in summary:
+            failed += 1
+            print(f"[{i}/{len(fid_sets)}] {fids}: failed after {summary['seconds']:.2f}s ({summary['error']})")
+        else:
+            print(f"[{i}/{len(fid_sets)}] {fids}: {summary['nodes']} nodes, {summary['edges']} edges in {summary['seconds']:.2f}s")
+
+    print(f"Built {len(fid_sets) - failed}/{len(fid_sets)} FID sets in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
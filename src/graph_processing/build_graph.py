@@ -3,16 +3,37 @@ import json
 import logging
 from typing import List, Dict, Optional
 
-import networkx as nx
-import pandas as pd
+import threading
 
-from src.data_ingestion.fetch_data import DataFetcher
+from src.data_caching.inbound_index import get_inbound_index
+from src.data_ingestion.fetch_data import get_data_fetcher
+from src.data_ingestion.rollups import rollup_edges
+from src.graph_processing.path_search import connecting_paths, path_edges, PATH_SEARCH_K, PATH_SEARCH_MAX_HOPS
+from src.graph_processing.snapshot import SNAPSHOT_EXTENSION, write_snapshot, load_graph
+from src.monitoring.metrics import timed_stage, record_graph_size
+from src.utils.lazy_import import lazy_import
+
+nx = lazy_import('networkx')
+pd = lazy_import('pandas')
+
+_graph_builder = None
+_graph_builder_lock = threading.Lock()
+
+
+def get_graph_builder():
+    """Process-wide `GraphBuilder`, created on first use."""
+    global _graph_builder
+    if _graph_builder is None:
+        with _graph_builder_lock:
+            if _graph_builder is None:
+                _graph_builder = GraphBuilder()
+    return _graph_builder
 
 class GraphBuilder:
     def __init__(self):
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
-        self.data_fetcher = DataFetcher()
+        self.data_fetcher = get_data_fetcher()
 
     def create_edges(self, G, fid, node_data, edge_type):
         if edge_type not in node_data:
@@ -40,12 +61,11 @@ class GraphBuilder:
 
         self.logger.info(f"Added {len(df)} {edge_type.upper()} edges for FID {fid}")
 
-    def build_graph_from_data(self, all_user_data: Dict[str, Dict]) -> nx.MultiDiGraph:
-        G = nx.MultiDiGraph()
+    def add_nodes(self, G, all_user_data):
+        """Add the core nodes and their connections, with profile attributes, from user data or rollups."""
         total_nodes_created = 0
         node_pfp_urls = {}
 
-        # First, add nodes and their attributes
         for fid, user_data in all_user_data.items():
             # Add core node
             core_metadata = user_data['core_node_metadata']
@@ -70,6 +90,11 @@ class GraphBuilder:
 
         self.logger.info(f"Created {total_nodes_created} unique nodes.")
 
+    @timed_stage('build_graph')
+    def build_graph_from_data(self, all_user_data: Dict[str, Dict], include_inbound: bool = True) -> 'nx.MultiDiGraph':
+        G = nx.MultiDiGraph()
+        self.add_nodes(G, all_user_data)
+
         # Then, add edges
         for fid, user_data in all_user_data.items():
             self.create_edges(G, fid, user_data, 'likes')
@@ -77,9 +102,94 @@ class GraphBuilder:
             self.create_edges(G, fid, user_data, 'casts')
             self.create_edges(G, fid, user_data, 'following')
 
+        if include_inbound:
+            self.add_inbound_edges(G, list(all_user_data))
+
         self.logger.info(f"Graph has {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
+        record_graph_size('full', G)
         return G
 
+    @timed_stage('build_graph_from_rollups')
+    def build_graph_from_rollups(self, all_rollups: Dict[str, Dict], include_inbound: bool = True) -> 'nx.MultiDiGraph':
+        """
+        Build the graph from per-user rollups (see `src.data_ingestion.rollups`) instead of raw records.
+
+        Each edge stands for all interactions of one type between two accounts in one time
+        bucket: it is stamped with the bucket's start and carries their number as `count`.
+        """
+        G = nx.MultiDiGraph()
+        self.add_nodes(G, all_rollups)
+
+        for fid, rollup in all_rollups.items():
+            G.add_edges_from(rollup_edges(rollup))
+            self.logger.info(f"Added {len(rollup['count'])} rolled-up edges ({int(rollup['count'].sum())} interactions) for FID {fid}")
+
+        if include_inbound:
+            self.add_inbound_edges(G, list(all_rollups))
+
+        self.logger.info(f"Graph has {G.number_of_nodes()} nodes and {G.number_of_edges()} edges")
+        record_graph_size('full', G)
+        return G
+
+    def add_inbound_edges(self, G, core_nodes):
+        """
+        Add who follows and engages with the core nodes, from the inbound index of the cached corpus.
+
+        User records only hold outgoing interactions, so without this a core user's audience
+        only shows up when it is another core user.
+        """
+        index = get_inbound_index()
+        if index is None:
+            return
+
+        inbound_edges = []
+        for fid in core_nodes:
+            inbound_edges.extend(index.inbound_edges(fid, exclude_sources=core_nodes))
+
+        for source, _, _ in inbound_edges:
+            if source not in G:
+                # Only cached profiles; looking up every fan would defeat the point of the index
+                profile = self.data_fetcher.profile_cache.get(source)
+                G.add_node(source, **(profile or {'fid': source}))
+        G.add_edges_from(inbound_edges)
+        self.logger.info(f"Added {len(inbound_edges)} inbound edges from the inbound index")
+
+    def add_connecting_paths(self, G, core_nodes, full_G=None, k=PATH_SEARCH_K, max_hops=PATH_SEARCH_MAX_HOPS):
+        """
+        Add the shortest paths between the core nodes over the whole cached corpus to `G`.
+
+        Hops touching a core node are copied from `full_G`, which already holds the core
+        users' own and inbound interactions; hops between other accounts come from the
+        inbound index. Intermediate accounts take their attributes from `full_G` when it
+        has them, and otherwise from one bulk profile lookup.
+
+        Returns:
+            List[List[str]]: The paths added.
+        """
+        paths = connecting_paths(core_nodes, k=k, max_hops=max_hops)
+        if not paths:
+            return []
+
+        present = set(G)
+        missing = [fid for fid in dict.fromkeys(fid for path in paths for fid in path) if fid not in present]
+        known = {fid: full_G.nodes[fid] for fid in missing if full_G is not None and fid in full_G}
+        profiles = {profile['fid']: profile for profile in self.data_fetcher.get_user_profiles([fid for fid in missing if fid not in known])}
+        for fid in missing:
+            G.add_node(fid, **(known.get(fid) or profiles.get(fid) or {'fid': fid}))
+
+        core = set(core_nodes)
+        hops = {tuple(sorted(hop)) for path in paths for hop in zip(path, path[1:])}
+        # A core user's interactions are all in G once filter_graph kept both ends; those
+        # between two other accounts never are, since G is built from the core users' records
+        hops = [(u, v) for u, v in hops if not ((u in core or v in core) and (G.has_edge(u, v) or G.has_edge(v, u)))]
+        from_full_G = [(u, v) for u, v in hops if full_G is not None and (u in core or v in core)]
+        edges = path_edges([hop for hop in hops if hop not in from_full_G])
+        for u, v in from_full_G:
+            edges.extend((a, b, d) for a, b in ((u, v), (v, u)) if full_G.has_edge(a, b) for d in full_G[a][b].values())
+        G.add_edges_from(edges)
+        self.logger.info(f"Added {len(paths)} connecting paths with {len(missing)} intermediate nodes and {len(edges)} edges")
+        return paths
+
     def calculate_connection_strength(self, G, core_nodes):
         connection_strength = {}
         for node in G.nodes():
@@ -87,20 +197,21 @@ class GraphBuilder:
                 strengths = []
                 for core_node in core_nodes:
                     edge_count = (
-                        len(G.get_edge_data(node, core_node, default={}))
-                        + len(G.get_edge_data(core_node, node, default={}))
+                        sum(d.get('count', 1) for d in G.get_edge_data(node, core_node, default={}).values())
+                        + sum(d.get('count', 1) for d in G.get_edge_data(core_node, node, default={}).values())
                     )
                     strengths.append(edge_count)
                 connection_strength[node] = min(strengths) if strengths else 0
         return connection_strength
 
+    @timed_stage('filter_graph')
     def filter_graph(self, G, core_nodes, top_n=25):
         connection_strength = self.calculate_connection_strength(G, core_nodes)
         top_nodes = sorted(connection_strength, key=connection_strength.get, reverse=True)[:top_n]
         filtered_nodes = set(top_nodes + core_nodes)
         return G.subgraph(filtered_nodes).copy()
 
-    def build_and_filter_graph(self, fids: List[str]) -> nx.MultiDiGraph:
+    def build_and_filter_graph(self, fids: List[str]) -> 'nx.MultiDiGraph':
         all_user_data = self.data_fetcher.get_all_users_data(fids)
         G = self.build_graph_from_data(all_user_data)
         filtered_G = self.filter_graph(G, fids)
@@ -117,11 +228,22 @@ class GraphBuilder:
         
         self.logger.info(f"Graph saved as JSON to {filepath}")
 
+    def save_graph_snapshot(self, G, fids, output_dir="data/processed", compression='zlib'):
+        """Save `G` as a binary snapshot; much smaller and faster to load than `save_graph_as_json`."""
+        os.makedirs(output_dir, exist_ok=True)
+        filepath = os.path.join(output_dir, f"graph_{'_'.join(fids)}{SNAPSHOT_EXTENSION}")
+        write_snapshot(G, filepath, compression=compression)
+        self.logger.info(f"Graph snapshot saved to {filepath}")
+        return filepath
+
+    def load_graph_snapshot(self, fids, output_dir="data/processed") -> 'nx.MultiDiGraph':
+        return load_graph(os.path.join(output_dir, f"graph_{'_'.join(fids)}{SNAPSHOT_EXTENSION}"))
+
 if __name__ == "__main__":
     # Example usage
     gb = GraphBuilder()
     test_fids = ['190000', '190001']  # Example FIDs
     filtered_graph = gb.build_and_filter_graph(test_fids)
-    gb.save_graph_as_json(filtered_graph, test_fids)
+    gb.save_graph_snapshot(filtered_graph, test_fids)
     print(f"Built and saved graph for FIDs: {test_fids}")
     print(f"Graph has {filtered_graph.number_of_nodes()} nodes and {filtered_graph.number_of_edges()} edges")
\ No newline at end of file
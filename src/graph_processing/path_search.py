@@ -0,0 +1,263 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.data_caching.inbound_index import EDGE_TYPES, get_inbound_index
+from src.monitoring.metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+# Path search defaults: paths per pair of core FIDs and the longest path searched for
+PATH_SEARCH_K = 3
+PATH_SEARCH_MAX_HOPS = 6
+
+# Distance of nodes a search may not pass through; never -1 (unreached) nor a real distance
+_BLOCKED = np.iinfo(np.int16).max
+
+_corpus_graphs = {}
+_corpus_graphs_lock = threading.Lock()
+
+
+class CorpusGraph:
+    """
+    Undirected integer adjacency (CSR) of every interaction in the inbound index.
+
+    Node ids are positions in the sorted `fids` array; `neighbors[offsets[i]:offsets[i + 1]]`
+    are node i's neighbours, sorted and without duplicates.
+    """
+
+    def __init__(self, index, edge_types=None):
+        start = time.perf_counter()
+        sources = index.sources.astype(np.int64)
+        targets = np.repeat(index.targets, np.diff(index.offsets)).astype(np.int64)
+        if edge_types:
+            keep = np.isin(index.edge_types, [EDGE_TYPES.index(edge_type) for edge_type in edge_types])
+            sources, targets = sources[keep], targets[keep]
+        not_loop = sources != targets
+        sources, targets = sources[not_loop], targets[not_loop]
+
+        self.fids, ids = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+        num_nodes = len(self.fids)
+        u = np.concatenate([ids[:len(sources)], ids[len(sources):]])
+        v = np.concatenate([ids[len(sources):], ids[:len(sources)]])
+        pairs = np.unique(u * num_nodes + v)
+
+        self.neighbors = (pairs % num_nodes).astype(np.int32) if num_nodes else np.empty(0, dtype=np.int32)
+        self.offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+        if num_nodes:
+            np.cumsum(np.bincount(pairs // num_nodes, minlength=num_nodes), out=self.offsets[1:])
+        self.num_nodes = num_nodes
+        logger.info(
+            f"Built corpus adjacency with {num_nodes} nodes and {len(pairs) // 2} edges "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+
+    def node_id(self, fid):
+        fid = int(fid) if str(fid).isdigit() else -1
+        position = np.searchsorted(self.fids, fid)
+        if fid < 0 or position == self.num_nodes or self.fids[position] != fid:
+            return None
+        return int(position)
+
+    def _expand(self, frontier):
+        """All neighbours of the `frontier` nodes (with repeats), gathered in one pass."""
+        starts = self.offsets[frontier]
+        counts = self.offsets[frontier + 1] - starts
+        positions = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        return self.neighbors[positions]
+
+    def _distances(self, source, target, max_hops, blocked=(), first_hops=None):
+        """
+        Bidirectional BFS, growing the cheaper frontier each round.
+
+        `blocked` nodes are never passed through. With `first_hops`, the search leaves
+        `source` only through those neighbours, as if its other edges were removed.
+
+        Returns:
+            Tuple[int, np.ndarray, np.ndarray, np.ndarray]: Shortest distance (None if it's
+            longer than `max_hops`), distances from each end (-1 if unreached) and the nodes
+            where the searches met.
+        """
+        dist_source = np.full(self.num_nodes, -1, dtype=np.int16)
+        dist_target = np.full(self.num_nodes, -1, dtype=np.int16)
+        blocked = np.asarray(blocked, dtype=np.int64)
+        dist_source[blocked] = dist_target[blocked] = _BLOCKED
+        dist_source[source] = dist_target[target] = 0
+        frontiers = [np.array([source]), np.array([target])]
+        dists = [dist_source, dist_target]
+        depths = [0, 0]
+
+        if first_hops is not None:
+            # Start one step out, and keep the other side from coming back in over a removed edge
+            first_hops = np.asarray(first_hops, dtype=np.int64)
+            first_hops = first_hops[dist_source[first_hops] < 0]
+            dist_source[first_hops] = 1
+            dist_target[source] = _BLOCKED
+            frontiers[0], depths[0] = first_hops, 1
+            if max_hops >= 1 and target in first_hops:
+                return 1, dist_source, dist_target, np.array([target])
+
+        while depths[0] + depths[1] < max_hops and len(frontiers[0]) and len(frontiers[1]):
+            costs = [np.sum(self.offsets[f + 1] - self.offsets[f]) for f in frontiers]
+            side = 0 if costs[0] <= costs[1] else 1
+            dist, other = dists[side], dists[1 - side]
+
+            reached = np.unique(self._expand(frontiers[side]))
+            new = reached[dist[reached] < 0]
+            depths[side] += 1
+            dist[new] = depths[side]
+            frontiers[side] = new
+
+            meeting = new[other[new] >= 0]
+            if len(meeting):
+                totals = dist_source[meeting] + dist_target[meeting]
+                distance = int(totals.min())
+                return distance, dist_source, dist_target, meeting[totals == distance]
+        return None, dist_source, dist_target, np.empty(0, dtype=np.int64)
+
+    def _walks(self, node, dist):
+        """Shortest walks from `node` back to the BFS root of `dist`, node first."""
+        if dist[node] == 0:
+            yield [node]
+            return
+        neighbors = self.neighbors[self.offsets[node]:self.offsets[node + 1]]
+        for previous in neighbors[dist[neighbors] == dist[node] - 1].tolist():
+            for walk in self._walks(previous, dist):
+                yield [node] + walk
+
+    def _shortest_path(self, source, target, max_hops, blocked=(), first_hops=None):
+        """One shortest path (node ids) under the constraints of `_distances`, or None."""
+        distance, dist_source, dist_target, meeting = self._distances(source, target, max_hops, blocked, first_hops)
+        if distance is None:
+            return None
+        middle = int(meeting[0])
+        head, tail = next(self._walks(middle, dist_source)), next(self._walks(middle, dist_target))
+        return head[::-1] + tail[1:]
+
+    def _longer_paths(self, source, target, paths, k, max_hops):
+        """
+        Extend `paths` (every shortest path) with the next shortest loopless paths, Yen-style.
+
+        Each path found so far is branched off at every node: the prefix up to it is kept, the
+        edges other known paths take from there are removed, and the rest is searched for again.
+        """
+        paths = [list(path) for path in paths]
+        known = {tuple(path) for path in paths}
+        candidates = []
+        branched = 0
+        while len(paths) < k:
+            for path in paths[branched:]:
+                for i, spur in enumerate(path[:-1]):
+                    root = path[:i + 1]
+                    taken = {other[i + 1] for other in paths if other[:i + 1] == root}
+                    neighbors = self.neighbors[self.offsets[spur]:self.offsets[spur + 1]]
+                    first_hops = [node for node in neighbors.tolist() if node not in taken]
+                    spur_path = self._shortest_path(spur, target, max_hops - i, blocked=root[:-1], first_hops=first_hops)
+                    if spur_path is None:
+                        continue
+                    candidate = tuple(root[:-1] + spur_path)
+                    if candidate not in known:
+                        known.add(candidate)
+                        heapq.heappush(candidates, (len(candidate), candidate))
+            branched = len(paths)
+            if not candidates:
+                break
+            paths.append(list(heapq.heappop(candidates)[1]))
+        return paths
+
+    def shortest_paths(self, source_fid, target_fid, k=PATH_SEARCH_K, max_hops=PATH_SEARCH_MAX_HOPS):
+        """
+        Up to `k` shortest loopless paths between two FIDs, as lists of FIDs, shortest first.
+
+        Social graphs usually have many paths of the minimal length, through different
+        intermediaries; only when there are fewer than `k` of them are longer ones (up to
+        `max_hops`) searched for. Empty if either FID is unknown or the accounts are more
+        than `max_hops` apart.
+        """
+        source, target = self.node_id(source_fid), self.node_id(target_fid)
+        if source is None or target is None:
+            return []
+        if source == target:
+            return [[str(source_fid)]]
+
+        distance, dist_source, dist_target, meeting = self._distances(source, target, max_hops)
+        if distance is None:
+            return []
+
+        paths = []
+        for middle in meeting.tolist():
+            for head, tail in itertools.product(self._walks(middle, dist_source), self._walks(middle, dist_target)):
+                paths.append(head[::-1] + tail[1:])
+                if len(paths) == k:
+                    break
+            if len(paths) == k:
+                break
+        if len(paths) < k:
+            paths = self._longer_paths(source, target, paths, k, max_hops)
+        return [[str(fid) for fid in self.fids[path].tolist()] for path in paths]
+
+def get_corpus_graph(edge_types=None):
+    """
+    Adjacency of the current inbound index, or None if it hasn't been built.
+
+    Rebuilt whenever the index is reloaded; `edge_types` (e.g. ('following',)) restricts
+    the interactions considered.
+    """
+    index = get_inbound_index()
+    if index is None:
+        return None
+    key = tuple(edge_types or ())
+    cached = _corpus_graphs.get(key)
+    if cached is None or cached[0] is not index:
+        with _corpus_graphs_lock:
+            cached = _corpus_graphs.get(key)
+            if cached is None or cached[0] is not index:
+                with observe_stage('corpus_graph'):
+                    cached = _corpus_graphs[key] = (index, CorpusGraph(index, edge_types))
+    return cached[1]
+
+def connecting_paths(core_nodes, k=PATH_SEARCH_K, max_hops=PATH_SEARCH_MAX_HOPS, edge_types=None):
+    """
+    Shortest paths between every pair of core FIDs over the cached corpus.
+
+    Returns:
+        List[List[str]]: Up to `k` paths per pair (fewer only if no more exist within
+        `max_hops`), each from one core FID to another, shortest first.
+    """
+    corpus = get_corpus_graph(edge_types)
+    if corpus is None:
+        return []
+    paths = []
+    with observe_stage('path_search'):
+        for source, target in itertools.combinations(core_nodes, 2):
+            paths.extend(corpus.shortest_paths(source, target, k=k, max_hops=max_hops))
+    return paths
+
+def path_edges(hops, edge_types=None):
+    """
+    The interactions between each pair of accounts in `hops`, in both directions, from the inbound index.
+
+    Returns:
+        List[tuple]: (source, target, attributes) triples.
+    """
+    index = get_inbound_index()
+    if index is None:
+        return []
+    type_ids = [EDGE_TYPES.index(edge_type) for edge_type in edge_types] if edge_types else None
+    directed_hops = sorted({(u, v) for u, v in hops} | {(v, u) for u, v in hops})
+
+    edges = []
+    for u, v in directed_hops:
+        sources, types, timestamps = index.postings(v)
+        keep = sources == int(u)
+        if type_ids is not None:
+            keep &= np.isin(types, type_ids)
+        edges.extend(
+            (u, v, {'edge_type': EDGE_TYPES[edge_type].upper(), 'timestamp': timestamp})
+            for edge_type, timestamp in zip(types[keep].tolist(), timestamps[keep].tolist())
+        )
+    return edges
@@ -0,0 +1,328 @@
+import json
+import mmap
+import numbers
+import struct
+import zlib
+
+import numpy as np
+
+from src.utils.lazy_import import lazy_import
+
+nx = lazy_import('networkx')
+
+# File layout: MAGIC, version (u32), header length (u32), JSON header, then the sections,
+# each starting on an ALIGNMENT boundary. The header lists every section's offset, length,
+# dtype and compression, and how each node/edge attribute is stored.
+MAGIC = b'FCCGRAPH'
+VERSION = 1
+ALIGNMENT = 64
+SNAPSHOT_EXTENSION = '.fccg'
+COMPRESSIONS = ('zlib', 'none')
+
+_PREAMBLE = struct.Struct('<8sII')
+_MISSING = object()
+
+
+class SnapshotError(ValueError):
+    """Raised for files that are not graph snapshots or were written by a newer version."""
+
+
+class _StringTable:
+    def __init__(self):
+        self.index = {}
+
+    def add(self, value):
+        position = self.index.get(value)
+        if position is None:
+            position = self.index[value] = len(self.index)
+        return position
+
+    def sections(self):
+        # Character (not byte) offsets, so reading back is a single decode plus slicing
+        strings = list(self.index)
+        offsets = np.zeros(len(strings) + 1, dtype='<i8')
+        np.cumsum([len(s) for s in strings], out=offsets[1:])
+        return {'strings': np.frombuffer(''.join(strings).encode('utf-8'), dtype='u1'), 'string_offsets': offsets}
+
+def _is_int(value):
+    return isinstance(value, (numbers.Integral, np.integer)) and not isinstance(value, (bool, np.bool_))
+
+def _is_float(value):
+    return isinstance(value, (numbers.Real, np.floating)) and not isinstance(value, (bool, np.bool_))
+
+def _encode_column(values, strings):
+    """
+    Store one attribute as a typed array: ints, floats or string-table indices.
+
+    Values of any other type (or a mix of types) are JSON-encoded into the string table.
+    Absent values are -1 indices, or a separate presence mask for numbers.
+
+    Returns:
+        Tuple[str, dict]: The column kind and its arrays.
+    """
+    present = [value for value in values if value is not _MISSING]
+    mask = None
+    if len(present) < len(values):
+        mask = np.fromiter((value is not _MISSING for value in values), dtype='u1', count=len(values))
+
+    if present and all(isinstance(value, str) for value in present):
+        kind = 'str'
+        data = np.fromiter((-1 if value is _MISSING else strings.add(value) for value in values), dtype='<i4', count=len(values))
+        return kind, {'values': data}
+    if present and all(_is_int(value) for value in present) and all(-2**63 <= int(value) < 2**63 for value in present):
+        kind, dtype, fill = 'int', '<i8', 0
+    elif present and all(_is_float(value) for value in present):
+        kind, dtype, fill = 'float', '<f8', 0.0
+    else:
+        kind = 'json'
+        data = np.fromiter(
+            (-1 if value is _MISSING else strings.add(json.dumps(value)) for value in values), dtype='<i4', count=len(values)
+        )
+        return kind, {'values': data}
+
+    data = np.array([fill if value is _MISSING else value for value in values], dtype=dtype)
+    arrays = {'values': data}
+    if mask is not None:
+        arrays['mask'] = mask
+    return kind, arrays
+
+def _attribute_columns(prefix, attr_dicts, strings, sections):
+    names = list(dict.fromkeys(name for attrs in attr_dicts for name in attrs))
+    columns = {}
+    for name in names:
+        kind, arrays = _encode_column([attrs.get(name, _MISSING) for attrs in attr_dicts], strings)
+        columns[name] = {'kind': kind, 'sections': {}}
+        for part, array in arrays.items():
+            section = f"{prefix}{len(columns) - 1}.{part}"
+            sections[section] = array
+            columns[name]['sections'][part] = section
+    return columns
+
+def _align(length):
+    return (length + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def snapshot_bytes(G, compression='zlib'):
+    """
+    Encode `G` as a binary snapshot.
+
+    Nodes become integer ids into a shared string table, edges columnar arrays of source
+    and target ids plus one typed array per attribute.
+
+    Args:
+        G (nx.Graph): Any networkx graph with string or integer nodes and JSON-serializable attributes.
+        compression (str): 'zlib' for the smallest files, 'none' for zero-copy reads.
+
+    Returns:
+        bytes: The snapshot.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {COMPRESSIONS}")
+
+    strings = _StringTable()
+    sections = {}
+    nodes = list(G.nodes)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    node_id_kind, node_id_arrays = _encode_column(nodes, strings)
+    sections['node_ids'] = node_id_arrays['values']
+    node_columns = _attribute_columns('node_attr', [attrs for _, attrs in G.nodes(data=True)], strings, sections)
+
+    if G.is_multigraph():
+        edges = list(G.edges(keys=True, data=True))
+        edge_keys = [key for _, _, key, _ in edges]
+    else:
+        edges = [(u, v, None, d) for u, v, d in G.edges(data=True)]
+        edge_keys = None
+    sections['edge_src'] = np.fromiter((node_index[edge[0]] for edge in edges), dtype='<i4', count=len(edges))
+    sections['edge_dst'] = np.fromiter((node_index[edge[1]] for edge in edges), dtype='<i4', count=len(edges))
+    edge_key_kind = None
+    if edge_keys is not None:
+        edge_key_kind, edge_key_arrays = _encode_column(edge_keys, strings)
+        sections['edge_keys'] = edge_key_arrays['values']
+    edge_columns = _attribute_columns('edge_attr', [edge[3] for edge in edges], strings, sections)
+
+    sections.update(strings.sections())
+
+    # The header needs the section offsets, which depend on the header length; lay the
+    # payloads out relative to the data start first
+    payloads = []
+    section_specs = {}
+    position = 0
+    for name, array in sections.items():
+        raw = np.ascontiguousarray(array).tobytes()
+        payload = zlib.compress(raw, 6) if compression == 'zlib' else raw
+        section_specs[name] = {
+            'offset': position,
+            'length': len(payload),
+            'dtype': array.dtype.str,
+            'count': len(array)
+        }
+        payloads.append((position, payload))
+        position = _align(position + len(payload))
+
+    header = json.dumps({
+        'directed': G.is_directed(),
+        'multigraph': G.is_multigraph(),
+        'graph': G.graph,
+        'num_nodes': len(nodes),
+        'num_edges': len(edges),
+        'compression': compression,
+        'node_id_kind': node_id_kind,
+        'edge_key_kind': edge_key_kind,
+        'node_attrs': node_columns,
+        'edge_attrs': edge_columns,
+        'sections': section_specs
+    }).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    buffer = bytearray(data_start + position)
+    _PREAMBLE.pack_into(buffer, 0, MAGIC, VERSION, len(header))
+    buffer[_PREAMBLE.size:_PREAMBLE.size + len(header)] = header
+    for offset, payload in payloads:
+        buffer[data_start + offset:data_start + offset + len(payload)] = payload
+    return bytes(buffer)
+
+def write_snapshot(G, path, compression='zlib'):
+    """Write `G` to `path` as a binary snapshot (see `snapshot_bytes`)."""
+    data = snapshot_bytes(G, compression=compression)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def read_snapshot(path, use_mmap=True):
+    """
+    Open a snapshot file.
+
+    Uncompressed snapshots are memory-mapped, so their arrays are views of the page
+    cache and only the sections actually used are read from disk.
+
+    Returns:
+        GraphSnapshot: The snapshot.
+    """
+    with open(path, 'rb') as f:
+        if use_mmap:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+    return GraphSnapshot(buffer)
+
+def load_graph(path):
+    """Read a snapshot file back into a networkx graph."""
+    return read_snapshot(path).to_networkx()
+
+
+class GraphSnapshot:
+    """
+    Read access to a snapshot held in a bytes-like buffer (bytes, memoryview or mmap).
+
+    Arrays are decoded lazily: uncompressed sections are zero-copy views of the buffer,
+    compressed ones are inflated on first access.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < _PREAMBLE.size:
+            raise SnapshotError("Truncated graph snapshot")
+        magic, version, header_length = _PREAMBLE.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise SnapshotError("Not a graph snapshot")
+        if version > VERSION:
+            raise SnapshotError(f"Snapshot version {version} is newer than supported version {VERSION}")
+        self.version = version
+        self.header = json.loads(bytes(view[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+        self.data_start = _align(_PREAMBLE.size + header_length)
+        self.num_nodes = self.header['num_nodes']
+        self.num_edges = self.header['num_edges']
+        self._arrays = {}
+        self._strings = None
+
+    def array(self, name):
+        """The raw array of section `name`, e.g. 'edge_src', 'edge_dst' or 'node_ids'."""
+        if name not in self._arrays:
+            spec = self.header['sections'][name]
+            start = self.data_start + spec['offset']
+            payload = memoryview(self.buffer)[start:start + spec['length']]
+            if self.header['compression'] == 'zlib':
+                payload = zlib.decompress(payload)
+            self._arrays[name] = np.frombuffer(payload, dtype=spec['dtype'], count=spec['count'])
+        return self._arrays[name]
+
+    def strings(self):
+        if self._strings is None:
+            text = self.array('strings').tobytes().decode('utf-8')
+            offsets = self.array('string_offsets').tolist()
+            self._strings = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def _decode(self, kind, indices_or_values, mask=None):
+        if kind == 'str':
+            strings = self.strings()
+            return [strings[i] if i >= 0 else _MISSING for i in indices_or_values.tolist()]
+        if kind == 'json':
+            strings = self.strings()
+            return [json.loads(strings[i]) if i >= 0 else _MISSING for i in indices_or_values.tolist()]
+        values = indices_or_values.tolist()
+        if mask is not None:
+            values = [value if present else _MISSING for value, present in zip(values, mask.tolist())]
+        return values
+
+    def _column(self, spec):
+        sections = spec['sections']
+        mask = self.array(sections['mask']) if 'mask' in sections else None
+        return self._decode(spec['kind'], self.array(sections['values']), mask)
+
+    def node_ids(self):
+        return self._decode(self.header['node_id_kind'], self.array('node_ids'))
+
+    def node_attribute(self, name, default=None):
+        """Values of node attribute `name`, in node order; `default` where a node lacks it."""
+        return [default if value is _MISSING else value for value in self._column(self.header['node_attrs'][name])]
+
+    def edge_attribute(self, name, default=None):
+        """Values of edge attribute `name`, in edge order; `default` where an edge lacks it."""
+        return [default if value is _MISSING else value for value in self._column(self.header['edge_attrs'][name])]
+
+    def _attr_dicts(self, columns, count):
+        dicts = [{} for _ in range(count)]
+        for name, spec in columns.items():
+            for attrs, value in zip(dicts, self._column(spec)):
+                if value is not _MISSING:
+                    attrs[name] = value
+        return dicts
+
+    def to_networkx(self):
+        """Rebuild the networkx graph, with the node, edge and adjacency order of the original."""
+        header = self.header
+        if header['multigraph']:
+            G = nx.MultiDiGraph() if header['directed'] else nx.MultiGraph()
+        else:
+            G = nx.DiGraph() if header['directed'] else nx.Graph()
+        G.graph.update(header['graph'])
+
+        nodes = self.node_ids()
+        G._node.update(zip(nodes, self._attr_dicts(header['node_attrs'], self.num_nodes)))
+
+        # Filling the adjacency dicts directly skips add_edges_from's per-edge checks,
+        # which cost more than decoding the whole snapshot
+        succ = {node: {} for node in nodes}
+        pred = {node: {} for node in nodes} if header['directed'] else succ
+        sources = self.array('edge_src').tolist()
+        targets = self.array('edge_dst').tolist()
+        edge_attrs = self._attr_dicts(header['edge_attrs'], self.num_edges)
+        if header['multigraph']:
+            keys = self._decode(header['edge_key_kind'], self.array('edge_keys'))
+            for u, v, key, attrs in zip(sources, targets, keys, edge_attrs):
+                u, v = nodes[u], nodes[v]
+                keydict = succ[u].get(v)
+                if keydict is None:
+                    keydict = succ[u][v] = pred[v][u] = {}
+                keydict[key] = attrs
+        else:
+            for u, v, attrs in zip(sources, targets, edge_attrs):
+                u, v = nodes[u], nodes[v]
+                succ[u][v] = pred[v][u] = attrs
+
+        G._adj.update(succ)
+        if header['directed']:
+            G._pred.update(pred)
+        return G
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import logging
+
+import numpy as np
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+
+from src.graph_viz.element_diff import element_delta
+from src.graph_viz.network_analysis import get_elements, get_adjacency_matrix, get_shortest_path_matrix, interaction_graph
+from src.data_caching.cast_index import get_cast_index
+from src.data_caching.inbound_index import EDGE_TYPES
+from src.graph_processing.path_search import connecting_paths, get_corpus_graph, PATH_SEARCH_K, PATH_SEARCH_MAX_HOPS
+from src.graph_viz.subgraphs import get_subgraph, graph_from_data
+from src.graph_viz.temporal_index import get_temporal_index
+from src.graph_viz.config import TOP_N_NODES
+from src.monitoring.metrics import timed_stage
+
+logger = logging.getLogger(__name__)
+
+# Bump when response formats change, so clients don't revalidate against stale ETags
+API_VERSION = 1
+MAX_API_TOP_N = 5000
+MAX_TIMELINE_STEPS = 100
+MAX_API_PATHS = 20
+MAX_API_PATH_HOPS = 8
+MAX_API_CASTS = 100
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+@api.errorhandler(ApiError)
+def handle_api_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+def _float_arg(name):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ApiError(f"'{name}' must be a number")
+
+def _int_arg(name, default, low, high):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(f"'{name}' must be an integer")
+    if not low <= value <= high:
+        raise ApiError(f"'{name}' must be between {low} and {high}")
+    return value
+
+def _edge_types_arg():
+    """Comma-separated `edge_types` (names from `EDGE_TYPES`, e.g. following,likes), or None for all."""
+    edge_types = [t.strip() for t in request.args.get('edge_types', '').split(',') if t.strip()] or None
+    unknown = set(edge_types or []) - set(EDGE_TYPES)
+    if unknown:
+        raise ApiError(f"Unknown edge types {sorted(unknown)}, expected some of {list(EDGE_TYPES)}")
+    return edge_types
+
+def _graph_edge_types():
+    """`edge_types` as the graph's `edge_type` values."""
+    edge_types = _edge_types_arg()
+    return [edge_type.upper() for edge_type in edge_types] if edge_types else None
+
+def _query():
+    """Parse the FID set, top N and time window shared by all endpoints."""
+    fids = [fid.strip() for fid in request.args.get('fids', '').split(',') if fid.strip()]
+    if not fids:
+        raise ApiError("'fids' is required, e.g. ?fids=746,190000")
+    top_n = _int_arg('top_n', TOP_N_NODES, 0, MAX_API_TOP_N)
+    return fids, top_n, _float_arg('start'), _float_arg('end')
+
+def _load_graph(fids, top_n, layout=False):
+    try:
+        subgraph = get_subgraph(fids, top_n=top_n, layout=layout)
+    except ValueError:
+        # Raised when the filtered graph has no interactions at all
+        raise ApiError("No interactions found between these FIDs", status=404)
+    graph_data = subgraph['graph_data']
+    G = graph_from_data(graph_data)
+    return graph_data, G
+
+def _etag(graph_data, endpoint):
+    """Responses only depend on the graph and the query, so neither needs to be rendered to tag them."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{API_VERSION}|{endpoint}|{graph_data['graph_key']}|".encode('utf-8'))
+    digest.update(json.dumps(sorted(request.args.items(multi=True))).encode('utf-8'))
+    return digest.hexdigest()
+
+def _wants_ndjson():
+    if request.args.get('format') in ('ndjson', 'json'):
+        return request.args['format'] == 'ndjson'
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def _respond(etag, payload=None, lines=None):
+    """JSON `payload` or streamed NDJSON `lines`, with an ETag; 304 when the client's copy is current."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif lines is not None:
+        response = Response(stream_with_context(json.dumps(line) + '\n' for line in lines), mimetype=NDJSON_MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _window(graph_data, start, end):
+    end = graph_data['max_timestamp'] if end is None else end
+    return start, end
+
+def _finite(matrix):
+    return [[value if np.isfinite(value) else None for value in row] for row in np.asarray(matrix).tolist()]
+
+@api.route('/subgraph')
+@timed_stage('api_subgraph')
+def subgraph():
+    """
+    Filtered subgraph for `fids`, restricted to the interactions in `[start, end]`.
+
+    Query: fids, top_n, start, end (timestamps), edge_types, positions=1 for preset layout
+    positions, format=json|ndjson. NDJSON streams a `graph` header, then one line per node and edge.
+    """
+    fids, top_n, start, end = _query()
+    edge_types = _graph_edge_types()
+    with_positions = request.args.get('positions') in ('1', 'true')
+    graph_data, G = _load_graph(fids, top_n, layout=with_positions)
+    etag = _etag(graph_data, 'subgraph')
+    if request.if_none_match.contains(etag):
+        return _respond(etag)
+
+    start, end = _window(graph_data, start, end)
+    window_start = -np.inf if start is None else start
+
+    edges = [
+        {'source': u, 'target': v, **d} for u, v, d in G.edges(data=True)
+        if window_start <= d['timestamp'] <= end and (edge_types is None or d.get('edge_type') in edge_types)
+    ]
+    visible = set(fids) | {edge['source'] for edge in edges} | {edge['target'] for edge in edges}
+    positions = graph_data.get('positions') or {}
+    nodes = [
+        {'id': node, **data, **({'position': positions[node]} if node in positions else {})}
+        for node, data in G.nodes(data=True) if node in visible
+    ]
+    header = {
+        'type': 'graph',
+        'graph_key': graph_data['graph_key'],
+        'core_nodes': graph_data['core_nodes'],
+        'min_timestamp': graph_data['min_timestamp'],
+        'max_timestamp': graph_data['max_timestamp'],
+        'start': start,
+        'end': end,
+        'node_count': len(nodes),
+        'edge_count': len(edges)
+    }
+
+    if _wants_ndjson():
+        def lines():
+            yield header
+            for node in nodes:
+                yield {'type': 'node', **node}
+            for edge in edges:
+                yield {'type': 'edge', **edge}
+        return _respond(etag, lines=lines())
+    return _respond(etag, {**header, 'nodes': nodes, 'edges': edges})
+
+@api.route('/timeline')
+@timed_stage('api_timeline')
+def timeline():
+    """
+    Cytoscape elements per time step, as the UI's slider would show them.
+
+    Query: fids, top_n, start, end, edge_types, steps (default 10). The first step carries every element,
+    later steps only the delta (`added`, `removed` ids and `changed` fields per id). With
+    `start` set every step shows the window from `start`, otherwise interactions are cumulative.
+    Streams one NDJSON line per step unless format=json.
+    """
+    fids, top_n, start, end = _query()
+    steps = _int_arg('steps', 10, 1, MAX_TIMELINE_STEPS)
+    edge_types = _graph_edge_types()
+
+    graph_data, G = _load_graph(fids, top_n, layout=True)
+    etag = _etag(graph_data, 'timeline')
+    if request.if_none_match.contains(etag):
+        return _respond(etag)
+
+    start, end = _window(graph_data, start, end)
+    first = graph_data['min_timestamp'] if start is None else start
+    index = get_temporal_index(G, graph_data['graph_key'])
+    core_nodes = graph_data['core_nodes']
+
+    def step_lines():
+        previous = None
+        for step in range(steps + 1):
+            timestamp = first + (step / steps) * (end - first)
+            elements = get_elements(
+                G, timestamp, core_nodes, positions=graph_data.get('positions'), start_timestamp=start, index=index,
+                edge_types=edge_types
+            )
+            line = {'step': step, 'timestamp': timestamp}
+            if previous is None:
+                line['elements'] = elements
+            else:
+                line.update(element_delta(previous, elements))
+            previous = elements
+            yield line
+
+    if request.args.get('format') == 'json':
+        return _respond(etag, {'graph_key': graph_data['graph_key'], 'steps': list(step_lines())})
+    return _respond(etag, lines=step_lines())
+
+@api.route('/matrices')
+@timed_stage('api_matrices')
+def matrices():
+    """
+    Adjacency and shortest-path matrices over the interactions in `[start, end]`.
+
+    Query: fids, top_n, start, end, edge_types. Unreachable pairs are `null` in `shortest_path`.
+    """
+    fids, top_n, start, end = _query()
+    edge_types = _graph_edge_types()
+    graph_data, G = _load_graph(fids, top_n)
+    etag = _etag(graph_data, 'matrices')
+    if request.if_none_match.contains(etag):
+        return _respond(etag)
+
+    start, end = _window(graph_data, start, end)
+
+    # Same view of the graph as the matrices modal
+    G_filtered = interaction_graph(G, start, end, edge_types)
+    adj_matrix, usernames = get_adjacency_matrix(G_filtered)
+    sp_matrix, _ = get_shortest_path_matrix(G_filtered)
+
+    return _respond(etag, {
+        'graph_key': graph_data['graph_key'],
+        'nodes': list(G_filtered.nodes()),
+        'usernames': usernames,
+        'adjacency': _finite(adj_matrix),
+        'shortest_path': _finite(sp_matrix)
+    })
+
+@api.route('/paths')
+@timed_stage('api_paths')
+def paths():
+    """
+    Shortest paths between every pair of `fids` over the whole cached corpus.
+
+    Query: fids, k (paths per pair), max_hops, edge_types (comma-separated, e.g. following).
+    Each pair gets its `k` shortest loopless paths, shortest first: longer ones when there
+    are fewer than `k` of the minimal length, and fewer only if no more fit in `max_hops`.
+    """
+    fids = [fid.strip() for fid in request.args.get('fids', '').split(',') if fid.strip()]
+    if len(fids) < 2:
+        raise ApiError("'fids' needs at least two FIDs, e.g. ?fids=746,190000")
+    k = _int_arg('k', PATH_SEARCH_K, 1, MAX_API_PATHS)
+    max_hops = _int_arg('max_hops', PATH_SEARCH_MAX_HOPS, 1, MAX_API_PATH_HOPS)
+    edge_types = _edge_types_arg()
+    if get_corpus_graph(edge_types) is None:
+        raise ApiError("Path search needs the inbound index, which hasn't been built", status=503)
+
+    return jsonify({
+        'fids': fids,
+        'k': k,
+        'max_hops': max_hops,
+        'paths': connecting_paths(fids, k=k, max_hops=max_hops, edge_types=edge_types)
+    })
+
+@api.route('/casts/co-engaged')
+@timed_stage('api_co_engaged_casts')
+def co_engaged_casts():
+    """
+    The casts that several of `fids` liked, recast or replied to, from the cast index.
+
+    Query: fids, limit, min_engagers (how many of `fids` must have engaged with a cast).
+    """
+    fids = [fid.strip() for fid in request.args.get('fids', '').split(',') if fid.strip()]
+    if len(fids) < 2:
+        raise ApiError("'fids' needs at least two FIDs, e.g. ?fids=746,190000")
+    limit = _int_arg('limit', 10, 1, MAX_API_CASTS)
+    min_engagers = _int_arg('min_engagers', 2, 1, len(fids))
+    index = get_cast_index()
+    if index is None:
+        raise ApiError("Co-engaged casts need the cast index, which hasn't been built", status=503)
+
+    return jsonify({
+        'fids': fids,
+        'min_engagers': min_engagers,
+        'casts': index.co_engaged_casts(fids, limit=limit, min_engagers=min_engagers)
+    })
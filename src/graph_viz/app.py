@@ -5,9 +5,13 @@ import dash_bootstrap_components as dbc
 
 from src.graph_viz.layout_and_styling import cyto_stylesheet
 from src.graph_viz.callbacks import register_callbacks
+from src.graph_viz.api import api
+from src.graph_viz.pfp_proxy import pfp_proxy
+from src.monitoring.metrics import register_metrics_endpoint
+from src.monitoring.profiling import register_profiling_endpoint
 from src.graph_viz.config import (
     DEBUG, PORT, DEFAULT_LAYOUT, CYTOSCAPE_STYLE, 
-    LAYOUT_OPTIONS, CYTOSCAPE_LAYOUT_SETTINGS
+    LAYOUT_OPTIONS, CYTOSCAPE_LAYOUT_SETTINGS, PRESET_LAYOUT_SETTINGS, ELEMENT_DIFF_MODE, EDGE_TYPE_OPTIONS
 )
 
 # Load extra layouts for Cytoscape
@@ -40,6 +44,17 @@ app.layout = html.Div([
             html.Div([
                 dcc.Input(id='user-ids-input', type='text', placeholder='Enter FIDs (comma-separated)', style={'width': '300px', 'margin-right': '12px'}),
                 html.Button('Build Graph', id='build-graph-button', n_clicks=0),
+                dcc.Checklist(
+                    id='lod-mode',
+                    options=[
+                        {'label': ' Large graph mode', 'value': 'lod'},
+                        {'label': ' Connecting paths', 'value': 'paths'}
+                    ],
+                    value=[],
+                    inline=True,
+                    labelStyle={'margin-right': '12px'},
+                    style={'display': 'inline-block', 'margin-left': '12px'}
+                ),
             ], style={'display': 'block', 'margin-left': '24px', 'margin-top': '6px'}),
             html.Div([
                 html.I("Click nodes for account details, click edges for relationship details."),
@@ -72,9 +87,43 @@ app.layout = html.Div([
         ], style={'display': 'inline-block', 'width': '20%', 'vertical-align': 'top', 'padding-top': '24px'}),
     ], style={'margin-bottom': '12px'}),
     
-    # Time Slider
+    # Time Slider (cumulative) and time window range slider
     html.Div([
-        dcc.Slider(id='time-slider', min=0, max=100, value=0, marks={}, step=10),
+        dcc.RadioItems(
+            id='time-mode',
+            options=[
+                {'label': ' Cumulative', 'value': 'cumulative'},
+                {'label': ' Time window', 'value': 'window'}
+            ],
+            value='cumulative',
+            inline=True,
+            inputStyle={'margin-left': '12px'}
+        ),
+        # Interaction types shown; changing them only re-counts the cached per-type indexes
+        dcc.Checklist(
+            id='edge-type-filter',
+            options=EDGE_TYPE_OPTIONS,
+            value=[option['value'] for option in EDGE_TYPE_OPTIONS],
+            inline=True,
+            inputStyle={'margin-left': '12px'}
+        ),
+        # Node colours: betweenness, or communities detected once per graph and timeline step
+        dcc.RadioItems(
+            id='node-color-mode',
+            options=[
+                {'label': ' Colour by betweenness', 'value': 'betweenness'},
+                {'label': ' Colour by community', 'value': 'community'}
+            ],
+            value='betweenness',
+            inline=True,
+            inputStyle={'margin-left': '12px'}
+        ),
+        html.Div([
+            dcc.Slider(id='time-slider', min=0, max=100, value=0, marks={}, step=10),
+        ], id='time-slider-container'),
+        html.Div([
+            dcc.RangeSlider(id='time-window-slider', min=0, max=100, value=[70, 100], marks={}, step=1, allowCross=False),
+        ], id='time-window-container', style={'display': 'none'}),
     ], style={'margin-bottom': '12px', 'padding-left': '24px'}),
     
     # Main content area
@@ -86,7 +135,7 @@ app.layout = html.Div([
             style=CYTOSCAPE_STYLE,
             layout={
                 'name': DEFAULT_LAYOUT,
-                **CYTOSCAPE_LAYOUT_SETTINGS
+                **(PRESET_LAYOUT_SETTINGS if DEFAULT_LAYOUT == 'preset' else CYTOSCAPE_LAYOUT_SETTINGS)
             },
             stylesheet=cyto_stylesheet,
             minZoom=0.2,
@@ -94,7 +143,9 @@ app.layout = html.Div([
             autoungrabify=False,
             userZoomingEnabled=True,
             userPanningEnabled=True,
-            boxSelectionEnabled=True
+            boxSelectionEnabled=True,
+            # In diff mode only added nodes are placed, existing positions are kept
+            autoRefreshLayout=not ELEMENT_DIFF_MODE
         ),
     ], style={'height': '85vh', 'width': '100%', 'padding': '12px'}),
     
@@ -136,6 +187,9 @@ app.layout = html.Div([
     # Store Components
     dcc.Store(id='graph-store'),
     dcc.Store(id='timestamp-store'),
+    dcc.Store(id='elements-index-store'),
+    dcc.Store(id='elements-added-store'),
+    dcc.Store(id='lod-expanded-store', data=[]),
     
     # Loading Overlay
     html.Div([
@@ -153,6 +207,18 @@ app.layout = html.Div([
 # Register callbacks
 register_callbacks(app)
 
+# JSON/NDJSON API for batch jobs, served from the same caches as the UI
+app.server.register_blueprint(api)
+
+# Profile pictures as resized thumbnails from a local disk cache, instead of straight from their hosts
+app.server.register_blueprint(pfp_proxy)
+
+# Prometheus metrics on the underlying Flask server
+register_metrics_endpoint(app.server)
+
+# Slowest profiled requests (profiling is opt-in, see src/monitoring/profiling.py)
+register_profiling_endpoint(app.server)
+
 # Run the Dash app
 if __name__ == '__main__':
     app.run_server(debug=DEBUG, port=PORT)
@@ -1,18 +1,51 @@
 import dash
 from dash import Input, Output, State, no_update, html
 from dash.exceptions import PreventUpdate
-import networkx as nx
-import plotly.graph_objs as go
-import numpy as np
 
 import sys 
 import os 
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.graph_viz.network_analysis import filter_graph, get_elements, get_adjacency_matrix, get_shortest_path_matrix
-from src.data_ingestion.fetch_data import DataFetcher
-from src.graph_processing.build_graph import GraphBuilder
+from src.data_ingestion.fetch_data import get_data_fetcher
+from src.graph_viz.network_analysis import get_elements, get_adjacency_matrix, get_shortest_path_matrix, interaction_graph
+from src.graph_viz.communities import graph_communities, lod_communities, color_by_community
+from src.graph_viz.element_diff import index_elements, diff_elements
+from src.graph_viz.level_of_detail import get_lod_view, is_cluster
+from src.graph_viz.temporal_index import get_temporal_index
+from src.graph_viz.subgraphs import get_subgraph, graph_from_data, interaction_events, interaction_casts
+from src.graph_viz.config import ELEMENT_DIFF_MODE, PRESET_LAYOUT_SETTINGS, EDGE_TYPE_OPTIONS
+from src.monitoring.metrics import observe_stage, timed_callback
+from src.monitoring.profiling import profiled
+from src.utils.lazy_import import lazy_import
+
+# networkx and plotly are only needed once a graph is built
+nx = lazy_import('networkx')
+go = lazy_import('plotly.graph_objs')
+
+
+def slider_to_timestamp(value, min_timestamp, max_timestamp):
+    return min_timestamp + (value / 100) * (max_timestamp - min_timestamp)
+
+def selected_time_window(time_mode, slider_value, window_value, min_timestamp, max_timestamp):
+    """Return `(start, end)` timestamps for the current controls; start is None in cumulative mode."""
+    if time_mode == 'window' and window_value:
+        return (
+            slider_to_timestamp(window_value[0], min_timestamp, max_timestamp),
+            slider_to_timestamp(window_value[1], min_timestamp, max_timestamp)
+        )
+    return None, slider_to_timestamp(slider_value, min_timestamp, max_timestamp)
+
+def selected_edge_types(value):
+    """Edge types ticked in the interaction filter, or None when all of them are (no filtering)."""
+    if value is None or set(value) >= {option['value'] for option in EDGE_TYPE_OPTIONS}:
+        return None
+    return list(value)
+
+def profile_context(graph_data, slider_value, window_value, time_mode):
+    """FID set and slider position of a callback, for naming its profile."""
+    fids = (graph_data or {}).get('core_nodes')
+    return fids, window_value if time_mode == 'window' else slider_value
 
 def register_callbacks(app):
     @app.callback(
@@ -21,32 +54,19 @@ def register_callbacks(app):
         Output('node-count', 'children'),
         Output('edge-count', 'children'),
         Input('build-graph-button', 'n_clicks'),
-        State('user-ids-input', 'value')
+        State('user-ids-input', 'value'),
+        State('lod-mode', 'value')
     )
-    def build_graph(n_clicks, user_ids_input):
+    @timed_callback
+    @profiled('build_graph', context=lambda n_clicks, user_ids_input, lod_mode: (user_ids_input, None))
+    def build_graph(n_clicks, user_ids_input, lod_mode):
         if n_clicks is None or not user_ids_input:
             raise PreventUpdate
 
         try:
             core_nodes = [uid.strip() for uid in user_ids_input.split(',') if uid.strip()]
-            fetcher = DataFetcher()
-            all_user_data = fetcher.get_all_users_data(core_nodes)
-            gb = GraphBuilder()
-            G = gb.build_graph_from_data(all_user_data)
-            filtered_G = filter_graph(G, core_nodes)
-
-            all_timestamps = sorted([edge[2]['timestamp'] for edge in filtered_G.edges(data=True)])
-            min_timestamp, max_timestamp = min(all_timestamps), max(all_timestamps)
-
-            graph_data = nx.readwrite.json_graph.node_link_data(filtered_G)
-            graph_data['min_timestamp'] = min_timestamp
-            graph_data['max_timestamp'] = max_timestamp
-            graph_data['core_nodes'] = core_nodes
-
-            node_count = filtered_G.number_of_nodes()
-            edge_count = filtered_G.number_of_edges()
-
-            return graph_data, '', f"Nodes: {node_count}", f"Edges: {edge_count}"
+            subgraph = get_subgraph(core_nodes, lod='lod' in (lod_mode or []), paths='paths' in (lod_mode or []))
+            return subgraph['graph_data'], '', f"Nodes: {subgraph['node_count']}", f"Edges: {subgraph['edge_count']}"
         except Exception as e:
             return no_update, str(e), no_update, no_update
 
@@ -55,6 +75,7 @@ def register_callbacks(app):
         Output('time-slider', 'marks'),
         Input('graph-store', 'data')
     )
+    @timed_callback
     def update_timestamp_data(graph_data):
         if not graph_data:
             return {}, {}
@@ -73,25 +94,65 @@ def register_callbacks(app):
         Output('cytoscape-graph', 'elements'),
         Output('node-count', 'children', allow_duplicate=True),
         Output('edge-count', 'children', allow_duplicate=True),
+        Output('elements-index-store', 'data'),
+        Output('elements-added-store', 'data'),
         Input('time-slider', 'value'),
+        Input('time-window-slider', 'value'),
+        Input('time-mode', 'value'),
         Input('graph-store', 'data'),
         Input('timestamp-store', 'data'),
+        Input('lod-expanded-store', 'data'),
+        Input('edge-type-filter', 'value'),
+        Input('node-color-mode', 'value'),
+        State('elements-index-store', 'data'),
         prevent_initial_call=True
     )
-    def update_elements_and_metrics(selected_timestamp, graph_data, timestamp_data):
+    @timed_callback
+    @profiled('update_elements_and_metrics', context=lambda slider, window, mode, graph_data, *args: profile_context(graph_data, slider, window, mode))
+    def update_elements_and_metrics(selected_timestamp, time_window, time_mode, graph_data, timestamp_data,
+                                    expanded_clusters, edge_type_filter, node_color_mode, elements_index):
         if not graph_data or not timestamp_data:
-            return [], "Nodes: 0", "Edges: 0"
+            return [], "Nodes: 0", "Edges: 0", None, None
 
-        G = nx.readwrite.json_graph.node_link_graph(graph_data, multigraph=True)
         core_nodes = graph_data['core_nodes']
 
         min_timestamp = timestamp_data['min_timestamp']
         max_timestamp = timestamp_data['max_timestamp']
-        actual_timestamp = min_timestamp + (selected_timestamp / 100) * (max_timestamp - min_timestamp)
+        start_timestamp, actual_timestamp = selected_time_window(
+            time_mode, selected_timestamp, time_window, min_timestamp, max_timestamp
+        )
+        edge_types = selected_edge_types(edge_type_filter)
 
-        new_elements = get_elements(G, actual_timestamp, core_nodes)
+        if graph_data.get('lod'):
+            lod_view = get_lod_view(graph_data['graph_key'])
+            if lod_view is None:
+                return [], "Graph expired, please rebuild", "", None, None
+            with observe_stage('get_elements'):
+                new_elements = lod_view.elements(actual_timestamp, expanded_clusters or [], start_timestamp, edge_types)
+            if node_color_mode == 'community':
+                with observe_stage('communities'):
+                    communities = lod_communities(lod_view, actual_timestamp, graph_data['graph_key'], edge_types)
+                color_by_community(new_elements, communities)
+        else:
+            with observe_stage('deserialize_graph'):
+                G = graph_from_data(graph_data)
+            index = get_temporal_index(G, graph_data.get('graph_key'))
+            with observe_stage('get_elements'):
+                new_elements = get_elements(
+                    G, actual_timestamp, core_nodes,
+                    positions=graph_data.get('positions'),
+                    start_timestamp=start_timestamp,
+                    index=index,
+                    edge_types=edge_types
+                )
+            if node_color_mode == 'community':
+                # Communities follow everything up to the slider's bucket, also in window mode
+                with observe_stage('communities'):
+                    communities = graph_communities(index, actual_timestamp, graph_data.get('graph_key'), edge_types)
+                color_by_community(new_elements, communities)
 
         visible_nodes = set()
+        represented_nodes = 0
         visible_edges = 0
         for element in new_elements:
             if 'source' in element['data']:  # It's an edge
@@ -100,14 +161,87 @@ def register_callbacks(app):
                 visible_nodes.add(element['data']['target'])
             else:  # It's a node
                 visible_nodes.add(element['data']['id'])
+                # Cluster members shown inside an expanded cluster are already in its member count
+                if 'parent' not in element['data']:
+                    represented_nodes += element['data'].get('member_count', 1)
 
-        return new_elements, f"Nodes: {len(visible_nodes)}", f"Edges: {visible_edges}"
+        node_count, edge_count = f"Nodes: {len(visible_nodes)}", f"Edges: {visible_edges}"
+        if graph_data.get('lod'):
+            node_count = f"Nodes: {represented_nodes} ({len(visible_nodes)} shown)"
+
+        # A new graph (or the first render) replaces everything; slider moves only send the changes
+        graph_changed = dash.callback_context.triggered_id not in (
+            'time-slider', 'time-window-slider', 'time-mode', 'lod-expanded-store', 'edge-type-filter', 'node-color-mode'
+        )
+        diff = None
+        if ELEMENT_DIFF_MODE and not graph_changed and elements_index:
+            with observe_stage('element_diff'):
+                diff = diff_elements(elements_index, new_elements)
+
+        if diff is None:
+            new_index = index_elements(new_elements)
+            return new_elements, node_count, edge_count, new_index, {'full': True, 'ids': new_index['ids']}
+
+        patch, new_index, added_ids = diff
+        return patch, node_count, edge_count, new_index, {'full': False, 'ids': added_ids}
+
+    # Place newly added nodes next to their already-placed neighbours instead of re-running
+    # the layout over the whole graph; a full element refresh still runs the selected layout.
+    app.clientside_callback(
+        """
+        function(added, layout) {
+            const cy = window.cy;
+            if (!added || !cy) {
+                return;
+            }
+            setTimeout(function() {
+                if (added.full) {
+                    cy.layout(layout).run();
+                    return;
+                }
+                if (layout.name === 'preset') {
+                    return;  // Added nodes already carry their precomputed positions
+                }
+                const addedIds = new Set(added.ids);
+                added.ids.forEach(function(id, i) {
+                    const node = cy.getElementById(id);
+                    if (!node.length || !node.isNode()) {
+                        return;
+                    }
+                    const placed = node.neighborhood('node').filter(function(n) { return !addedIds.has(n.id()); });
+                    const anchor = (placed.length ? placed : cy.nodes()).boundingBox();
+                    const angle = i * 2.39996;  // Golden angle spreads siblings around the anchor
+                    node.position({
+                        x: (anchor.x1 + anchor.x2) / 2 + 60 * Math.cos(angle),
+                        y: (anchor.y1 + anchor.y2) / 2 + 60 * Math.sin(angle)
+                    });
+                });
+            }, 0);
+        }
+        """,
+        Input('elements-added-store', 'data'),
+        State('cytoscape-graph', 'layout')
+    )
+
+    @app.callback(
+        Output('time-slider-container', 'style'),
+        Output('time-window-container', 'style'),
+        Input('time-mode', 'value')
+    )
+    @timed_callback
+    def toggle_time_mode(time_mode):
+        if time_mode == 'window':
+            return {'display': 'none'}, {'display': 'block'}
+        return {'display': 'block'}, {'display': 'none'}
 
     @app.callback(
         Output('cytoscape-graph', 'layout'),
         Input('layout-dropdown', 'value')
     )
+    @timed_callback
     def update_layout(layout):
+        if layout == 'preset':
+            return {'name': 'preset', **PRESET_LAYOUT_SETTINGS}
         return {
             'name': layout,
             'animate': True,
@@ -124,9 +258,11 @@ def register_callbacks(app):
         Input('cytoscape-graph', 'tapEdgeData'),
         Input('close-modal', 'n_clicks'),
         State('metadata-modal', 'is_open'),
+        State('graph-store', 'data'),
         prevent_initial_call=True
     )
-    def update_modal(node_data, edge_data, close_clicks, is_open):
+    @timed_callback
+    def update_modal(node_data, edge_data, close_clicks, is_open, graph_data):
         ctx = dash.callback_context
         if not ctx.triggered:
             raise PreventUpdate
@@ -137,15 +273,39 @@ def register_callbacks(app):
             return False, "", None  # Close modal
 
         elif prop_id == 'cytoscape-graph.tapNodeData':
+            if node_data and node_data.get('is_cluster') == 'true':
+                return is_open, dash.no_update, dash.no_update  # Taps on clusters expand them instead
             if node_data:
                 return True, "Node Information", create_node_info(node_data)
 
         elif prop_id == 'cytoscape-graph.tapEdgeData':
             if edge_data:
-                return True, "Edge Information", create_edge_info(edge_data)
+                core_nodes = (graph_data or {}).get('core_nodes', [])
+                return True, "Edge Information", create_edge_info(edge_data, core_nodes)
 
         return is_open, dash.no_update, dash.no_update
 
+    @app.callback(
+        Output('lod-expanded-store', 'data'),
+        Input('cytoscape-graph', 'tapNodeData'),
+        Input('graph-store', 'data'),
+        State('lod-expanded-store', 'data'),
+        prevent_initial_call=True
+    )
+    @timed_callback
+    def toggle_cluster(node_data, graph_data, expanded_clusters):
+        if dash.callback_context.triggered_id == 'graph-store':
+            return []
+        if not node_data or not is_cluster(node_data['id']):
+            raise PreventUpdate
+
+        expanded_clusters = list(expanded_clusters or [])
+        if node_data['id'] in expanded_clusters:
+            expanded_clusters.remove(node_data['id'])
+        else:
+            expanded_clusters.append(node_data['id'])
+        return expanded_clusters
+
     def create_node_info(node_data):
         username = node_data['label']
         profile_url = f"https://warpcast.com/{username}"
@@ -180,7 +340,7 @@ def register_callbacks(app):
         
         return node_info
 
-    def create_edge_info(edge_data):
+    def create_edge_info(edge_data, core_nodes=()):
         source_username = edge_data['source_username']
         target_username = edge_data['target_username']
         total_interactions = edge_data['weight']
@@ -201,16 +361,59 @@ def register_callbacks(app):
                 ])
             ])
 
+        # The graph may only hold daily rollups; list the actual interactions from the raw data
+        with observe_stage('edge_events'):
+            events = interaction_events(core_nodes, edge_data['source'], edge_data['target'])
+        if events:
+            usernames = {edge_data['source']: source_username, edge_data['target']: target_username}
+            fetcher = get_data_fetcher()
+            edge_info.extend([
+                html.H6("Latest interactions:"),
+                html.Ul([
+                    html.Li(
+                        f"{fetcher.convert_timestamp(event['timestamp']):%Y-%m-%d %H:%M} UTC: "
+                        f"{usernames.get(event['source'], event['source'])} {event['edge_type']}"
+                    )
+                    for event in events
+                ])
+            ])
+
+        # Which casts drove the relationship, from the cast index
+        with observe_stage('edge_casts'):
+            casts = interaction_casts(edge_data['source'], edge_data['target'])
+        if casts:
+            usernames = {edge_data['source']: source_username, edge_data['target']: target_username}
+            fetcher = get_data_fetcher()
+            edge_info.extend([
+                html.H6("Casts behind this relationship:"),
+                html.Ul([
+                    html.Li([
+                        # The author isn't always one of the two accounts, so link by the full hash
+                        html.A(
+                            f"{usernames[cast['author']]}'s cast {cast['hash'][:10]}" if cast['author'] in usernames else f"Cast {cast['hash'][:10]}",
+                            href=f"https://warpcast.com/~/conversations/{cast['hash']}",
+                            target="_blank"
+                        ),
+                        f": {', '.join(engagement['edge_type'] for engagement in cast['engagements'])} by "
+                        f"{usernames.get(cast['engagements'][0]['fid'], cast['engagements'][0]['fid'])}, last on "
+                        f"{fetcher.convert_timestamp(cast['last_timestamp']):%Y-%m-%d %H:%M} UTC"
+                    ])
+                    for cast in casts
+                ])
+            ])
+
         return edge_info
     
     @app.callback(
         Output('cytoscape-graph', 'zoom'),
         Output('cytoscape-graph', 'pan'),
-        Input('cytoscape-graph', 'elements'),
+        Input('elements-added-store', 'data'),
         prevent_initial_call=True
     )   
-    def adjust_zoom_on_render(elements):
-        if not elements:
+    @timed_callback
+    def adjust_zoom_on_render(added_elements):
+        # Only reset the viewport when the element list is replaced, not on every slider move
+        if not added_elements or not added_elements['full']:
             return dash.no_update, dash.no_update
         return None, {'x': 0, 'y': 0}  # Let Cytoscape handle the initial zoom
 
@@ -219,6 +422,7 @@ def register_callbacks(app):
         [Input("open-matrices-modal", "n_clicks"), Input("close-matrices-modal", "n_clicks")],
         [State("matrices-modal", "is_open")],
     )
+    @timed_callback
     def toggle_matrices_modal(n1, n2, is_open):
         if n1 or n2:
             return not is_open
@@ -228,24 +432,35 @@ def register_callbacks(app):
         Output('adjacency-matrix', 'figure'),
         Output('shortest-path-matrix', 'figure'),
         Input('graph-store', 'data'),
-        Input('time-slider', 'value')
+        Input('time-slider', 'value'),
+        Input('time-window-slider', 'value'),
+        Input('time-mode', 'value'),
+        Input('edge-type-filter', 'value')
     )
-    def update_matrices(graph_data, time_slider_value):
+    @timed_callback
+    @profiled('update_matrices', context=lambda graph_data, slider, window, mode, *args: profile_context(graph_data, slider, window, mode))
+    def update_matrices(graph_data, time_slider_value, time_window, time_mode, edge_type_filter):
         if not graph_data:
             return {}, {}
         
-        G = nx.readwrite.json_graph.node_link_graph(graph_data, multigraph=True)
         min_timestamp = graph_data['min_timestamp']
         max_timestamp = graph_data['max_timestamp']
-        current_timestamp = min_timestamp + (time_slider_value / 100) * (max_timestamp - min_timestamp)
-        
-        # Filter the graph based on the current timestamp
-        G_filtered = nx.Graph((u, v, d) for (u, v, d) in G.edges(data=True) if d['timestamp'] <= current_timestamp)
-        
-        # Ensure node attributes are copied to the filtered graph
-        for node, data in G.nodes(data=True):
-            if node in G_filtered:
-                G_filtered.nodes[node].update(data)
+        start_timestamp, current_timestamp = selected_time_window(
+            time_mode, time_slider_value, time_window, min_timestamp, max_timestamp
+        )
+        edge_types = selected_edge_types(edge_type_filter)
+
+        if graph_data.get('lod'):
+            # Matrices over the aggregated view; the full neighbourhood is far too large
+            lod_view = get_lod_view(graph_data['graph_key'])
+            if lod_view is None:
+                return {}, {}
+            G_filtered = lod_view.unit_graph(current_timestamp, start_timestamp=start_timestamp, edge_types=edge_types)
+        else:
+            G = graph_from_data(graph_data)
+
+            # Filter the graph based on the current timestamp (or time window) and the selected types
+            G_filtered = interaction_graph(G, start_timestamp, current_timestamp, edge_types)
         
         # Adjacency Matrix
         adj_matrix, usernames = get_adjacency_matrix(G_filtered)
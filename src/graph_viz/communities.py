@@ -0,0 +1,185 @@
+import numpy as np
+
+from src.data_caching.cache import make_cache
+from src.graph_viz.config import COMMUNITY_COLORS, COMMUNITY_TIMELINE_STEPS, COMMUNITY_MAX_ITERATIONS
+
+# Community timelines per (graph key, edge types), next to the graph's temporal index and layout
+_community_timelines = make_cache('communities', max_entries=32)
+
+
+def local_moving(num_nodes, edge_i, edge_j, edge_w, labels=None, resolution=1.0,
+                 max_iterations=COMMUNITY_MAX_ITERATIONS):
+    """
+    Modularity-based communities on a weighted graph: the local-moving phase of Louvain.
+
+    Each node moves to the neighbouring community with the largest modularity gain, until
+    no node moves. Unlike plain label propagation this does not let a few hubs (the core
+    nodes) pull everything into one community. Nodes are visited strongest first and ties
+    keep the current community (then the smallest label), so the result is deterministic.
+
+    Passing the previous partition as `labels` (-1 for new nodes) warm-starts the search:
+    after a few more interactions only the nodes they touch tend to move.
+
+    Returns:
+        np.ndarray: Community label per node; labels are node indices.
+    """
+    labels = np.arange(num_nodes) if labels is None else np.where(labels >= 0, labels, np.arange(num_nodes))
+    if not len(edge_i):
+        return labels
+
+    # Symmetric CSR adjacency; self-loops only add to a node's strength
+    src = np.concatenate([edge_i, edge_j])
+    dst = np.concatenate([edge_j, edge_i])
+    weights = np.concatenate([edge_w, edge_w]).astype(float)
+    order = np.argsort(src, kind='stable')
+    neighbors, neighbor_weights = dst[order], weights[order]
+    offsets = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=offsets[1:])
+
+    strength = np.bincount(src, weights=weights, minlength=num_nodes)
+    total_weight = strength.sum()
+    community_strength = np.bincount(labels, weights=strength, minlength=num_nodes)
+    visit_order = [node for node in np.argsort(-strength, kind='stable').tolist() if strength[node] > 0]
+    for _ in range(max_iterations):
+        moved = False
+        for node in visit_order:
+            start, end = offsets[node], offsets[node + 1]
+            current = labels[node]
+            community_strength[current] -= strength[node]
+            not_self = neighbors[start:end] != node
+            candidates, inverse = np.unique(labels[neighbors[start:end][not_self]], return_inverse=True)
+            links = np.bincount(inverse, weights=neighbor_weights[start:end][not_self])
+            gains = links - resolution * community_strength[candidates] * strength[node] / total_weight
+            best_gain = gains.max(initial=-np.inf)
+            if current in candidates:
+                current_gain = gains[candidates == current][0]
+            else:
+                current_gain = -resolution * community_strength[current] * strength[node] / total_weight
+            if current_gain < best_gain:
+                labels[node] = candidates[gains == best_gain][0]
+                moved = True
+            community_strength[labels[node]] += strength[node]
+        if not moved:
+            break
+    return labels
+
+
+class CommunityTimeline:
+    """
+    Communities of one graph at each of `steps` timeline buckets, computed on demand.
+
+    A bucket's communities cover every interaction up to the bucket's end and are
+    warm-started from the closest earlier bucket already computed, so moving the slider
+    forward updates the communities instead of detecting them from scratch. Colours stick
+    to labels across buckets.
+    """
+
+    def __init__(self, nodes, min_timestamp, max_timestamp, steps=COMMUNITY_TIMELINE_STEPS):
+        self.nodes = list(nodes)
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+        self.steps = steps
+        self._labels = {}
+        self._colors = {}
+
+    def bucket(self, timestamp):
+        if self.max_timestamp <= self.min_timestamp:
+            return self.steps
+        position = (timestamp - self.min_timestamp) / (self.max_timestamp - self.min_timestamp) * self.steps
+        return int(min(max(np.ceil(position - 1e-9), 0), self.steps))
+
+    def bucket_timestamp(self, bucket):
+        return self.min_timestamp + bucket / self.steps * (self.max_timestamp - self.min_timestamp)
+
+    def has_bucket(self, bucket):
+        return bucket in self._labels
+
+    def labels(self, bucket, pair_weights):
+        """
+        Labels per node at `bucket`.
+
+        Args:
+            pair_weights (Callable): `timestamp -> (i, j, weights)`, the interaction weight
+                of each node pair (indices into `nodes`) up to `timestamp`.
+        """
+        if bucket not in self._labels:
+            earlier = [b for b in self._labels if b < bucket]
+            seed = self._labels[max(earlier)].copy() if earlier else None
+            edge_i, edge_j, edge_w = pair_weights(self.bucket_timestamp(bucket))
+            self._labels[bucket] = local_moving(len(self.nodes), edge_i, edge_j, edge_w, labels=seed)
+            self._assign_colors(self._labels[bucket])
+        return self._labels[bucket]
+
+    def _assign_colors(self, labels):
+        # Largest communities pick first; a label keeps its colour for the life of the timeline
+        communities, sizes = np.unique(labels, return_counts=True)
+        used = {self._colors[label] for label in communities.tolist() if label in self._colors}
+        for label in communities[np.argsort(-sizes, kind='stable')].tolist():
+            if label in self._colors:
+                continue
+            free = [i for i in range(len(COMMUNITY_COLORS)) if i not in used]
+            self._colors[label] = free[0] if free else len(self._colors) % len(COMMUNITY_COLORS)
+            used.add(self._colors[label])
+
+    def color(self, label):
+        return COMMUNITY_COLORS[self._colors[label]]
+
+
+def get_communities(cache_key, nodes, min_timestamp, max_timestamp, timestamp, pair_weights):
+    """
+    Community and colour per node at the timeline bucket of `timestamp`, from the cached timeline.
+
+    Args:
+        cache_key (tuple): Identifies the graph and the interactions considered, e.g.
+            (graph key, edge types); None computes the bucket without caching it.
+        nodes (List[str]): Node ids, in the order `pair_weights` indexes them.
+        pair_weights (Callable): See `CommunityTimeline.labels`.
+
+    Returns:
+        Dict[str, Tuple[str, str]]: (community, colour) per node id; a community is named
+        after the node whose label it took.
+    """
+    timeline = _community_timelines.get(cache_key) if cache_key is not None else None
+    if timeline is None:
+        timeline = CommunityTimeline(nodes, min_timestamp, max_timestamp)
+    bucket = timeline.bucket(timestamp)
+    computed = timeline.has_bucket(bucket)
+    labels = timeline.labels(bucket, pair_weights)
+    if cache_key is not None and not computed:
+        _community_timelines.set(cache_key, timeline)
+    return {
+        node: (timeline.nodes[label], timeline.color(label))
+        for node, label in zip(timeline.nodes, labels.tolist())
+    }
+
+
+def graph_communities(index, timestamp, graph_key=None, edge_types=None):
+    """Communities of the graph behind a `TemporalIndex`, on the interactions (of `edge_types`) up to `timestamp`'s bucket."""
+    def pair_weights(bucket_timestamp):
+        counts = index.pair_counts(None, bucket_timestamp, edge_types=edge_types)
+        present = counts > 0
+        return index.pair_low[present], index.pair_high[present], counts[present]
+
+    cache_key = None if graph_key is None else (graph_key, tuple(sorted(edge_types or ())))
+    return get_communities(cache_key, index.nodes, index.min_timestamp, index.max_timestamp, timestamp, pair_weights)
+
+
+def lod_communities(view, timestamp, graph_key=None, edge_types=None):
+    """Communities of the units (core, detail and cluster nodes) of a `LevelOfDetailView`."""
+    def pair_weights(bucket_timestamp):
+        return view.unit_pair_weights(bucket_timestamp, edge_types)
+
+    cache_key = None if graph_key is None else (graph_key, 'lod', tuple(sorted(edge_types or ())))
+    return get_communities(cache_key, view.units, view.min_timestamp, view.max_timestamp, timestamp, pair_weights)
+
+
+def color_by_community(elements, communities):
+    """Set `community` and `community_color` on the node elements; expanded cluster members take their cluster's."""
+    for element in elements:
+        data = element['data']
+        if 'source' in data:
+            continue
+        community = communities.get(data['id']) or communities.get(data.get('parent'))
+        if community is not None:
+            data['community'], data['community_color'] = community
+    return elements
@@ -5,9 +5,41 @@ DEBUG = True
 PORT = 8050
 
 # Graph settings
-DEFAULT_LAYOUT = 'cose-bilkent'
+DEFAULT_LAYOUT = 'preset'
 TOP_N_NODES = 25
 
+# Level-of-detail mode for large neighbourhoods
+LOD_TOP_N_NODES = 5000  # Neighbourhood size kept by filter_graph
+LOD_DETAIL_NODES = 25  # Strongest non-core nodes shown individually
+LOD_MAX_CLUSTERS = 40  # Everything else is folded into at most this many cluster super-nodes
+LOD_MIN_EDGE_WEIGHT = 2  # Aggregated edges with fewer interactions are dropped
+LOD_EXPAND_LIMIT = 30  # Members shown when a cluster is expanded
+
+# Send only added/removed/restyled elements on slider moves instead of the full list
+ELEMENT_DIFF_MODE = True
+
+# Built subgraphs are reused across clicks (and server workers) for a day
+SUBGRAPH_CACHE_SIZE = 64
+SUBGRAPH_CACHE_TTL_SECONDS = 86400
+
+# Build graphs from per-user interaction rollups (counts per day) instead of raw events;
+# the raw events are only loaded for the edge details
+USE_ROLLUPS = True
+EDGE_DETAIL_EVENTS = 10  # Latest interactions listed in the edge details
+EDGE_DETAIL_CASTS = 5  # Casts behind a relationship listed in the edge details, from the cast index
+
+# Prefetch the data of the best connected non-core nodes after a build
+PREFETCH_ENABLED = True
+PREFETCH_TOP_K = 5
+
+# Interaction type filter; values are the graph's `edge_type`s (CASTS are replies; mentions aren't recorded)
+EDGE_TYPE_OPTIONS = [
+    {'label': ' Follows', 'value': 'FOLLOWING'},
+    {'label': ' Likes', 'value': 'LIKES'},
+    {'label': ' Recasts', 'value': 'RECASTS'},
+    {'label': ' Replies', 'value': 'CASTS'},
+]
+
 # Node sizes
 CORE_NODE_SIZE = 112.5
 NON_CORE_BASE_SIZE = 45
@@ -18,6 +50,7 @@ COLORS = {
     'NON_CORE_NODE': 'rgb(0, 0, 255)',  # Blue
     'HIGHLIGHTED_EDGE': 'rgb(255, 0, 0)',  # Red
     'DEFAULT_NODE': '#cccccc',
+    'CLUSTER_NODE': '#f0ad4e',  # Orange
     'DEFAULT_EDGE': '#999999'
 }
 
@@ -34,12 +67,34 @@ CYTOSCAPE_STYLE = {
 
 # Layout options for dropdown
 LAYOUT_OPTIONS = [
+    {'label': 'Precomputed [Default]', 'value': 'preset'},
     {'label': 'Circle', 'value': 'circle'},
     {'label': 'Grid', 'value': 'grid'},
     {'label': 'Breadthfirst', 'value': 'breadthfirst'},
-    {'label': 'Cose-Bilkent [Default]', 'value': 'cose-bilkent'},
+    {'label': 'Cose-Bilkent', 'value': 'cose-bilkent'},
 ]
 
+# Server-side layout settings (used by the 'preset' layout)
+LAYOUT_IDEAL_EDGE_LENGTH = 150  # In pixels
+LAYOUT_ITERATIONS = 150  # Force-directed iterations for the first timeline step
+LAYOUT_TIMELINE_STEPS = 10  # Matches the time slider's 0-100 range with step 10
+LAYOUT_GRAVITY = 0.1  # Pull towards the centre, relative to the distance from it
+
+# Community colouring: weighted label propagation on the interactions up to each timeline step
+COMMUNITY_TIMELINE_STEPS = LAYOUT_TIMELINE_STEPS
+COMMUNITY_MAX_ITERATIONS = 20
+# Avoids the core node purple and the cluster orange; larger communities get the first colours
+COMMUNITY_COLORS = [
+    '#1f77b4', '#2ca02c', '#d62728', '#17becf', '#e377c2', '#8c564b',
+    '#bcbd22', '#393b79', '#637939', '#9c9ede', '#e7969c', '#7f7f7f'
+]
+
+PRESET_LAYOUT_SETTINGS = {
+    'animate': False,
+    'fit': True,
+    'padding': 30
+}
+
 # Cytoscape layout settings
 CYTOSCAPE_LAYOUT_SETTINGS = {
     'animate': True,  # Enable animation for smoother transitions
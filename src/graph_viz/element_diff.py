@@ -0,0 +1,119 @@
+import uuid
+
+from dash import Patch
+
+from src.data_caching.cache import make_cache
+
+# Elements last sent to each client, keyed by the token kept in `elements-index-store`
+MAX_TRACKED_VIEWS = 256
+_sent_elements = make_cache('sent_elements', max_entries=MAX_TRACKED_VIEWS)
+
+
+def element_id(element):
+    return element['data']['id']
+
+def _remember(elements):
+    token = uuid.uuid4().hex
+    _sent_elements.set(token, {element_id(element): element for element in elements})
+    return token
+
+def _patch_changes(target, old, new):
+    """Record on `target` only the keys of `new` that differ from `old`, recursing into dicts."""
+    for key, value in new.items():
+        if key not in old:
+            target[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            _patch_changes(target[key], old[key], value)
+        elif old[key] != value:
+            target[key] = value
+    for key in old:
+        if key not in new:
+            del target[key]
+
+def index_elements(elements):
+    """
+    Build the compact index kept in the browser between slider moves.
+
+    The index only holds element ids (in the order the client has them) and a token
+    for the elements remembered server-side, so diffing never requires sending
+    the element list back up.
+    """
+    return {
+        'token': _remember(elements),
+        'ids': [element_id(element) for element in elements]
+    }
+
+def diff_elements(prev_index, elements):
+    """
+    Compute a Patch that turns the client's current elements into `elements`.
+
+    Restyled elements only carry the fields that changed (down to single interaction
+    counts), so e.g. `pfp_url` is sent once when a node appears and never again. Top-level
+    `classes` and `position` are diffed like the data.
+
+    Args:
+        prev_index (dict): Index produced by `index_elements` for the elements on the client.
+        elements (List[dict]): Full element list for the new slider position.
+
+    Returns:
+        Tuple[Patch, dict, List[str]] or None: The patch to apply to `cytoscape-graph.elements`,
+        the index for the patched list and the ids of newly added elements. None when the
+        previous elements are no longer remembered and a full refresh is needed.
+    """
+    prev_elements = _sent_elements.get(prev_index.get('token'))
+    if prev_elements is None:
+        return None
+
+    prev_ids = prev_index['ids']
+    positions = {element_key: i for i, element_key in enumerate(prev_ids)}
+    elements_by_id = {element_id(element): element for element in elements}
+
+    patch = Patch()
+
+    # Restyle in place first, while the client-side indices are still the original ones
+    for element_key, element in elements_by_id.items():
+        if element_key not in prev_elements:
+            continue
+        _patch_changes(patch[positions[element_key]], prev_elements[element_key], element)
+
+    # Remove from the back so earlier indices stay valid
+    removed = [positions[element_key] for element_key in prev_ids if element_key not in elements_by_id]
+    for i in sorted(removed, reverse=True):
+        del patch[i]
+
+    added = [element for element in elements if element_id(element) not in prev_elements]
+    if added:
+        patch.extend(added)
+
+    # Keep the index in the same order as the patched client-side list
+    added_ids = [element_id(element) for element in added]
+    new_index = {
+        'token': _remember(elements),
+        'ids': [element_key for element_key in prev_ids if element_key in elements_by_id] + added_ids
+    }
+
+    return patch, new_index, added_ids
+
+def element_delta(prev_elements, elements):
+    """
+    Plain-JSON counterpart of `diff_elements` for API clients.
+
+    Returns:
+        dict: `added` elements, `removed` element ids and, per restyled element id,
+        the top-level data fields whose value `changed`.
+    """
+    prev_by_id = {element_id(element): element['data'] for element in prev_elements}
+    elements_by_id = {element_id(element): element for element in elements}
+    changed = {}
+    for element_key, element in elements_by_id.items():
+        old = prev_by_id.get(element_key)
+        if old is None:
+            continue
+        fields = {key: value for key, value in element['data'].items() if old.get(key) != value}
+        if fields:
+            changed[element_key] = fields
+    return {
+        'added': [element for element_key, element in elements_by_id.items() if element_key not in prev_by_id],
+        'removed': [element_key for element_key in prev_by_id if element_key not in elements_by_id],
+        'changed': changed
+    }
@@ -0,0 +1,32 @@
+import multiprocessing
+import os
+import shutil
+
+from src.data_caching.cache import SHARED_CACHE_ENV_VAR
+from src.graph_viz.config import PORT
+
+# Caches and metrics shared by all workers; set before the app is (pre)loaded
+os.environ.setdefault(SHARED_CACHE_ENV_VAR, 'data/cache/shared_cache.db')
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', 'data/cache/prometheus')
+
+# Samples of workers from a previous run would otherwise be merged into /metrics
+shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+bind = f"0.0.0.0:{os.getenv('PORT', PORT)}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Import the app once in the master and fork it into the workers
+preload_app = True
+
+# Building a graph for uncached FIDs crawls the hub, which can take minutes
+timeout = 300
+graceful_timeout = 30
+accesslog = '-'
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
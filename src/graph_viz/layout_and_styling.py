@@ -62,6 +62,31 @@ cyto_stylesheet = [
             'shape': 'star',
         }
     },
+    # Cluster super-nodes (level-of-detail mode)
+    {
+        'selector': 'node[is_cluster = "true"]',
+        'style': {
+            'background-color': COLORS['CLUSTER_NODE'],
+            'shape': 'round-rectangle',
+        }
+    },
+    # Community colours, when colouring by community; core nodes keep their star
+    {
+        'selector': 'node[community_color][is_core = "false"]',
+        'style': {
+            'background-color': 'data(community_color)',
+        }
+    },
+    # Expanded clusters become compound nodes around their members
+    {
+        'selector': '.expanded',
+        'style': {
+            'background-opacity': 0.15,
+            'text-valign': 'top',
+            'border-width': '2px',
+            'border-color': COLORS['CLUSTER_NODE']
+        }
+    },
     # Default edge style (dimmed)
     {
         'selector': 'edge',
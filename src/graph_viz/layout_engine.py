@@ -0,0 +1,197 @@
+import hashlib
+import logging
+
+import numpy as np
+
+from src.data_caching.cache import make_cache
+from src.graph_viz.config import (
+    LAYOUT_IDEAL_EDGE_LENGTH, LAYOUT_ITERATIONS, LAYOUT_TIMELINE_STEPS, LAYOUT_GRAVITY
+)
+
+logger = logging.getLogger(__name__)
+
+# Node positions per graph, keyed by `graph_hash`
+_position_cache = make_cache('positions', max_entries=64)
+
+
+def graph_hash(G, core_nodes):
+    """
+    Digest of the graph structure and timeline.
+
+    Keys the layout, level-of-detail and element caches, so it covers everything those
+    depend on, edge types included.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(','.join(sorted(map(str, core_nodes))).encode('utf-8'))
+    digest.update(b'|')
+    digest.update(','.join(sorted(map(str, G.nodes()))).encode('utf-8'))
+    edges = sorted(
+        (str(u), str(v), d.get('edge_type', 'Unknown'), d['timestamp'], d.get('count', 1)) for u, v, d in G.edges(data=True)
+    )
+    for u, v, edge_type, ts, count in edges:
+        digest.update(f"|{u}-{v}:{edge_type}@{ts}".encode('utf-8'))
+        if count != 1:
+            digest.update(f"x{count}".encode('utf-8'))
+    return digest.hexdigest()
+
+def force_directed_layout(pos, movable, edge_i, edge_j, edge_w, iterations, k=LAYOUT_IDEAL_EDGE_LENGTH):
+    """
+    Vectorized Fruchterman-Reingold iterations over `pos` (n x 2, updated in place).
+
+    Only rows flagged in `movable` are moved, so already placed nodes act as fixed anchors.
+    """
+    n = len(pos)
+    if n < 2 or not movable.any():
+        return pos
+
+    temperature = 2.0 * k
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        dx = pos[:, 0, None] - pos[None, :, 0]
+        dy = pos[:, 1, None] - pos[None, :, 1]
+        squared_distance = np.maximum(dx * dx + dy * dy, 1e-4)
+        np.fill_diagonal(squared_distance, np.inf)
+
+        # Every pair repels, connected pairs attract proportionally to their interaction weight
+        repulsion = (k * k) / squared_distance
+        displacement = np.stack([(dx * repulsion).sum(axis=1), (dy * repulsion).sum(axis=1)], axis=1)
+        if len(edge_i):
+            edge_delta = pos[edge_i] - pos[edge_j]
+            edge_distance = np.maximum(np.linalg.norm(edge_delta, axis=-1), 0.01)
+            pull = edge_delta * (edge_distance * edge_w / k)[:, None]
+            np.add.at(displacement, edge_i, -pull)
+            np.add.at(displacement, edge_j, pull)
+
+        # Gentle pull towards the centre keeps disconnected parts from drifting away
+        displacement -= (pos - pos.mean(axis=0)) * LAYOUT_GRAVITY
+
+        length = np.maximum(np.linalg.norm(displacement, axis=-1), 0.01)
+        step = displacement * (np.minimum(length, temperature) / length)[:, None]
+        pos[movable] += step[movable]
+        temperature -= cooling
+    return pos
+
+def compute_positions(G, core_nodes, steps=LAYOUT_TIMELINE_STEPS, key=None):
+    """
+    Compute preset positions for every node of `G`, walking the timeline incrementally.
+
+    Results are cached by `graph_hash`, or by `key` when the caller already computed it;
+    see `positions_from_pairs` for the placement itself.
+
+    Returns:
+        Dict[str, dict]: Mapping of node id to a Cytoscape `{'x': ..., 'y': ...}` position.
+    """
+    key = key or graph_hash(G, core_nodes)
+    cached = _position_cache.get(key)
+    if cached is not None:
+        return cached
+
+    nodes = [str(node) for node in G.nodes()]
+    node_index = {node: i for i, node in enumerate(nodes)}
+
+    # One pass over the edges: interaction count and first interaction per pair
+    pair_weight = {}
+    pair_first_seen = {}
+    for u, v, d in G.edges(data=True):
+        i, j = node_index[str(u)], node_index[str(v)]
+        if i == j:
+            continue
+        pair = (min(i, j), max(i, j))
+        ts = d['timestamp']
+        pair_weight[pair] = pair_weight.get(pair, 0) + d.get('count', 1)
+        pair_first_seen[pair] = min(pair_first_seen.get(pair, ts), ts)
+
+    pairs = list(pair_weight)
+    positions = positions_from_pairs(
+        nodes,
+        np.array([p[0] for p in pairs], dtype=np.int64),
+        np.array([p[1] for p in pairs], dtype=np.int64),
+        np.array([pair_weight[p] for p in pairs], dtype=float),
+        np.array([pair_first_seen[p] for p in pairs], dtype=float),
+        [node_index[str(node)] for node in core_nodes if str(node) in node_index],
+        steps=steps
+    )
+    _position_cache.set(key, positions)
+    return positions
+
+def positions_from_pairs(nodes, edge_i, edge_j, edge_count, edge_first_seen, pinned_first, steps=LAYOUT_TIMELINE_STEPS):
+    """
+    Lay out `nodes` given their undirected pairs, walking the timeline incrementally.
+
+    The timeline is split at the time-slider positions. At each position only the nodes that
+    first become visible there are laid out; everything placed earlier stays fixed, so one
+    position map is valid for every slider position and nodes never jump around.
+
+    Args:
+        nodes (List[str]): Node ids; pairs refer to them by index.
+        edge_i, edge_j (np.ndarray): Endpoint indices of each pair.
+        edge_count (np.ndarray): Number of interactions per pair.
+        edge_first_seen (np.ndarray): Timestamp of the first interaction per pair.
+        pinned_first (List[int]): Indices of nodes visible from the start (the core nodes).
+
+    Returns:
+        Dict[str, dict]: Mapping of node id to a Cytoscape `{'x': ..., 'y': ...}` position.
+    """
+    n = len(nodes)
+    edge_w = np.log1p(np.asarray(edge_count, dtype=float))
+    if len(edge_w):
+        edge_w /= edge_w.max()
+
+    node_first_seen = np.full(n, np.inf)
+    np.minimum.at(node_first_seen, edge_i, edge_first_seen)
+    np.minimum.at(node_first_seen, edge_j, edge_first_seen)
+
+    finite = node_first_seen[np.isfinite(node_first_seen)]
+    min_timestamp = finite.min() if len(finite) else 0
+    max_timestamp = finite.max() if len(finite) else 0
+    boundaries = [min_timestamp + (s / steps) * (max_timestamp - min_timestamp) for s in range(steps + 1)]
+    boundaries[-1] = np.inf  # Nodes without edges are placed with the full graph
+
+    # Slider position at which each node first becomes visible
+    node_bucket = np.searchsorted(boundaries, node_first_seen, side='left')
+    node_bucket[list(pinned_first)] = 0
+
+    rng = np.random.default_rng(0)
+    k = LAYOUT_IDEAL_EDGE_LENGTH
+    pos = np.zeros((n, 2))
+    placed = np.zeros(n, dtype=bool)
+
+    for bucket, boundary in enumerate(boundaries):
+        new = node_bucket == bucket
+        if not new.any():
+            continue
+
+        edge_mask = edge_first_seen <= boundary
+        bucket_i, bucket_j, bucket_w = edge_i[edge_mask], edge_j[edge_mask], edge_w[edge_mask]
+
+        # Seed new nodes at the centroid of their already placed neighbours
+        neighbour_sum = np.zeros((n, 2))
+        neighbour_count = np.zeros(n)
+        for src, dst in ((bucket_i, bucket_j), (bucket_j, bucket_i)):
+            anchored = placed[dst]
+            np.add.at(neighbour_sum, src[anchored], pos[dst[anchored]])
+            np.add.at(neighbour_count, src[anchored], 1)
+        centre = pos[placed].mean(axis=0) if placed.any() else np.zeros(2)
+        for i in np.flatnonzero(new):
+            anchor = neighbour_sum[i] / neighbour_count[i] if neighbour_count[i] else centre
+            angle = rng.uniform(0, 2 * np.pi)
+            pos[i] = anchor + k * np.array([np.cos(angle), np.sin(angle)])
+
+        active = placed | new
+        active_index = np.flatnonzero(active)
+        remap = -np.ones(n, dtype=np.int64)
+        remap[active_index] = np.arange(len(active_index))
+        in_view = active[bucket_i] & active[bucket_j]
+
+        sub_pos = pos[active_index].copy()
+        iterations = LAYOUT_ITERATIONS if not placed.any() else max(LAYOUT_ITERATIONS // 3, 1)
+        force_directed_layout(
+            sub_pos, new[active_index],
+            remap[bucket_i[in_view]], remap[bucket_j[in_view]], bucket_w[in_view],
+            iterations=iterations, k=k
+        )
+        pos[active_index] = sub_pos
+        placed |= new
+
+    logger.info(f"Computed layout for {n} nodes and {len(edge_i)} node pairs")
+    return {node: {'x': round(float(pos[i, 0]), 1), 'y': round(float(pos[i, 1]), 1)} for i, node in enumerate(nodes)}
@@ -0,0 +1,385 @@
+import math
+import logging
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from src.data_caching.cache import make_cache
+from src.graph_viz.network_analysis import calculate_connection_strength, normalize_value
+from src.graph_viz.layout_engine import positions_from_pairs
+from src.graph_viz.pfp_proxy import thumbnail_url
+from src.monitoring.metrics import observe_stage
+from src.utils.lazy_import import lazy_import
+from src.graph_viz.config import (
+    LOD_DETAIL_NODES, LOD_MAX_CLUSTERS, LOD_MIN_EDGE_WEIGHT, LOD_EXPAND_LIMIT,
+    NON_CORE_BASE_SIZE, MIN_EDGE_WIDTH, MAX_EDGE_WIDTH, LAYOUT_IDEAL_EDGE_LENGTH
+)
+
+nx = lazy_import('networkx')
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_PREFIX = 'cluster:'
+
+# Precomputed views, keyed by the graph hash stored in `graph-store`
+_lod_views = make_cache('lod_views', max_entries=16)
+
+
+def get_lod_view(graph_key):
+    return _lod_views.get(graph_key)
+
+def store_lod_view(graph_key, view):
+    _lod_views.set(graph_key, view)
+
+def is_cluster(node_id):
+    return str(node_id).startswith(CLUSTER_PREFIX)
+
+def _timeline(events):
+    """
+    Sorted timestamps of `(timestamp, count)` events, and the running totals of their counts.
+
+    Edges built from rollups stand for `count` interactions at their bucket's start; the totals
+    (None when every event counts once) keep them one entry each, as in `TemporalIndex`.
+    """
+    timestamps = np.asarray([timestamp for timestamp, _ in events], dtype=float)
+    counts = np.asarray([count for _, count in events], dtype=np.int64)
+    order = np.argsort(timestamps, kind='stable')
+    if not np.any(counts != 1):
+        return timestamps[order], None
+    totals = np.zeros(len(events) + 1, dtype=np.int64)
+    np.cumsum(counts[order], out=totals[1:])
+    return timestamps[order], totals
+
+def _timeline_total(timeline):
+    timestamps, totals = timeline
+    return len(timestamps) if totals is None else int(totals[-1])
+
+def _count_between(timeline, start_timestamp, end_timestamp):
+    """Interactions of a `_timeline` in `[start_timestamp, end_timestamp]`; no lower bound when start is None."""
+    timestamps, totals = timeline
+    high = int(np.searchsorted(timestamps, end_timestamp, side='right'))
+    low = 0 if start_timestamp is None else int(np.searchsorted(timestamps, start_timestamp, side='left'))
+    if high <= low:
+        return 0
+    return high - low if totals is None else int(totals[high] - totals[low])
+
+def _count_types(timelines, start_timestamp, end_timestamp, edge_types=None):
+    """Interactions in the window across per-type `timelines` (edge type -> `_timeline`), for `edge_types` only if given."""
+    return sum(
+        _count_between(timeline, start_timestamp, end_timestamp)
+        for edge_type, timeline in timelines.items() if edge_types is None or edge_type in edge_types
+    )
+
+
+class LevelOfDetailView:
+    """
+    Aggregated view of a large neighbourhood graph.
+
+    The strongest non-core nodes are shown individually; every other node is folded into a
+    cluster super-node grouped by which core nodes it interacts with and how strongly. All
+    interaction timelines (per unit pair, per expandable cluster member) are precomputed as
+    sorted timestamp arrays (with running totals of rollup counts), so moving the slider or
+    expanding a cluster only needs binary searches instead of another pass over the full graph.
+    """
+
+    def __init__(self, G, core_nodes, detail_nodes=LOD_DETAIL_NODES, max_clusters=LOD_MAX_CLUSTERS,
+                 expand_limit=LOD_EXPAND_LIMIT):
+        self.core_nodes = [str(node) for node in core_nodes if str(node) in G]
+        self.represented_nodes = G.number_of_nodes()
+
+        connection_strength = calculate_connection_strength(G, self.core_nodes)
+        ranked = sorted(connection_strength, key=connection_strength.get, reverse=True)
+        self.detail_nodes = [str(node) for node in ranked[:detail_nodes]]
+
+        self.unit_of = {node: node for node in self.core_nodes + self.detail_nodes}
+        self.clusters = self._group_into_clusters(G, ranked[detail_nodes:], connection_strength, max_clusters)
+        self.expandable = {}
+        for cluster_id, cluster in self.clusters.items():
+            for member in cluster['members']:
+                self.unit_of[member] = cluster_id
+            for member in cluster['members'][:expand_limit]:
+                self.expandable[member] = cluster_id
+
+        self.labels = {node: G.nodes[node].get('username', node) for node in self.core_nodes + self.detail_nodes}
+        self.labels.update({member: G.nodes[member].get('username', member) for member in self.expandable})
+        self.labels.update({cluster_id: cluster['label'] for cluster_id, cluster in self.clusters.items()})
+        self.node_metadata = {
+            node: dict(G.nodes[node]) for node in list(self.core_nodes) + self.detail_nodes + list(self.expandable)
+        }
+
+        self._precompute_timelines(G)
+        self._precompute_positions()
+        logger.info(
+            f"Level-of-detail view: {G.number_of_nodes()} nodes folded into {len(self.detail_nodes)} detail nodes "
+            f"and {len(self.clusters)} clusters"
+        )
+
+    def _group_into_clusters(self, G, nodes, connection_strength, max_clusters):
+        groups = defaultdict(list)
+        for node in nodes:
+            connected_core = tuple(
+                core_node for core_node in self.core_nodes
+                if G.has_edge(node, core_node) or G.has_edge(core_node, node)
+            )
+            tier = int(math.log2(1 + connection_strength.get(node, 0)))
+            groups[(connected_core, tier)].append(str(node))
+
+        # Keep the largest groups, fold the long tail into one catch-all cluster
+        ordered = sorted(groups.items(), key=lambda item: len(item[1]), reverse=True)
+        kept, rest = ordered[:max_clusters - 1], ordered[max_clusters - 1:]
+        if len(rest) == 1:
+            kept, rest = ordered, []
+
+        clusters = {}
+        for i, ((connected_core, tier), members) in enumerate(kept):
+            usernames = [G.nodes[core_node].get('username', core_node) for core_node in connected_core]
+            label = f"{len(members)} accounts"
+            if usernames:
+                label += f" ({' + '.join(usernames)}, tier {tier})"
+            clusters[f"{CLUSTER_PREFIX}{i}"] = {'label': label, 'members': members}
+        if rest:
+            members = [member for _, group_members in rest for member in group_members]
+            clusters[f"{CLUSTER_PREFIX}other"] = {'label': f"{len(members)} other accounts", 'members': members}
+
+        for cluster in clusters.values():
+            cluster['members'].sort(key=lambda member: connection_strength.get(member, 0), reverse=True)
+        return clusters
+
+    def _precompute_timelines(self, G):
+        # (pair) -> (initiator, edge_type) -> (timestamp, count) events, at collapsed and at member level
+        unit_pairs = defaultdict(lambda: defaultdict(list))
+        member_pairs = defaultdict(lambda: defaultdict(list))
+        # (cluster, pair) -> (initiator, edge_type) -> events of a unit pair covered by expandable members
+        expanded_share = defaultdict(lambda: defaultdict(list))
+        # unit/member -> edge_type -> events
+        unit_events = defaultdict(lambda: defaultdict(list))
+        member_events = defaultdict(lambda: defaultdict(list))
+        all_timestamps = []
+
+        for u, v, d in G.edges(data=True):
+            u, v = str(u), str(v)
+            ts = d['timestamp']
+            # An edge built from a rollup stands for `count` interactions at its bucket's start
+            event = (ts, d.get('count', 1))
+            edge_type = d.get('edge_type', 'Unknown')
+            all_timestamps.append(ts)
+            unit_u, unit_v = self.unit_of.get(u), self.unit_of.get(v)
+            if unit_u is None or unit_v is None:
+                continue
+
+            unit_events[unit_u][edge_type].append(event)
+            unit_events[unit_v][edge_type].append(event)
+            for node in (u, v):
+                if node in self.expandable:
+                    member_events[node][edge_type].append(event)
+            if unit_u == unit_v:
+                continue
+
+            unit_pair = tuple(sorted((unit_u, unit_v)))
+            unit_pairs[unit_pair][(unit_u, edge_type)].append(event)
+            for member, other_unit in ((u, unit_v), (v, unit_u)):
+                if member in self.expandable:
+                    member_pairs[(member, other_unit)][(member if member == u else other_unit, edge_type)].append(event)
+                    expanded_share[(self.expandable[member], unit_pair)][(unit_u, edge_type)].append(event)
+
+        self.unit_pairs = {pair: {key: _timeline(events) for key, events in by_type.items()} for pair, by_type in unit_pairs.items()}
+        self.member_pairs = {pair: {key: _timeline(events) for key, events in by_type.items()} for pair, by_type in member_pairs.items()}
+        self.expanded_share = {share: {key: _timeline(events) for key, events in by_type.items()} for share, by_type in expanded_share.items()}
+        self.unit_events = {unit: {t: _timeline(events) for t, events in by_type.items()} for unit, by_type in unit_events.items()}
+        self.member_events = {member: {t: _timeline(events) for t, events in by_type.items()} for member, by_type in member_events.items()}
+        self.min_timestamp = min(all_timestamps) if all_timestamps else 0
+        self.max_timestamp = max(all_timestamps) if all_timestamps else 0
+
+    def _precompute_positions(self):
+        units = self.units = self.core_nodes + self.detail_nodes + list(self.clusters)
+        unit_index = {unit: i for i, unit in enumerate(units)}
+        pairs = list(self.unit_pairs)
+        self.positions = positions_from_pairs(
+            units,
+            np.array([unit_index[a] for a, _ in pairs], dtype=np.int64),
+            np.array([unit_index[b] for _, b in pairs], dtype=np.int64),
+            np.array([sum(_timeline_total(timeline) for timeline in self.unit_pairs[pair].values()) for pair in pairs], dtype=float),
+            np.array([min(timestamps[0] for timestamps, _ in self.unit_pairs[pair].values()) for pair in pairs], dtype=float),
+            [unit_index[node] for node in self.core_nodes]
+        )
+
+        # Expanded members sit on a ring around their cluster node
+        for cluster_id, cluster in self.clusters.items():
+            members = [member for member in cluster['members'] if member in self.expandable]
+            centre = self.positions[cluster_id]
+            radius = LAYOUT_IDEAL_EDGE_LENGTH * (0.5 + math.sqrt(len(members)) / 4)
+            for i, member in enumerate(members):
+                angle = 2 * math.pi * i / max(len(members), 1)
+                self.positions[member] = {
+                    'x': round(centre['x'] + radius * math.cos(angle), 1),
+                    'y': round(centre['y'] + radius * math.sin(angle), 1)
+                }
+
+    def unit_pair_weights(self, timestamp, edge_types=None):
+        """Interactions (of `edge_types`) up to `timestamp` per unit pair, as `(i, j, counts)` indices into `units`."""
+        unit_index = {unit: i for i, unit in enumerate(self.units)}
+        pairs, counts = [], []
+        for pair, timelines in self.unit_pairs.items():
+            count = sum(
+                _count_between(ts, None, timestamp) for key, ts in timelines.items()
+                if edge_types is None or key[1] in edge_types
+            )
+            if count > 0:
+                pairs.append((unit_index[pair[0]], unit_index[pair[1]]))
+                counts.append(count)
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1], np.array(counts, dtype=np.int64)
+
+    def _edge_element(self, source, target, counts_by_key, core_nodes):
+        interactions = {source: Counter(), target: Counter()}
+        edge_types = Counter()
+        for (initiator, edge_type), count in counts_by_key.items():
+            if count <= 0:
+                continue
+            interactions[initiator][edge_type] += count
+            edge_types[edge_type] += count
+        return {
+            'data': {
+                'id': f"{min(source, target)}-{max(source, target)}",
+                'source': source,
+                'target': target,
+                'source_username': self.labels.get(source, source),
+                'target_username': self.labels.get(target, target),
+                'weight': sum(edge_types.values()),
+                'edge_types': edge_types,
+                'edge_to_core': 'true' if source in core_nodes or target in core_nodes else 'false',
+                'interactions': interactions
+            }
+        }
+
+    def elements(self, timestamp, expanded=(), start_timestamp=None, edge_types=None):
+        """
+        Cytoscape elements for the view at `timestamp` with the given clusters expanded.
+
+        With `start_timestamp` only interactions in the window `[start_timestamp, timestamp]` count,
+        and with `edge_types` only interactions of those types. Clusters and detail nodes stay
+        as built; edge weights, visibility and centrality follow the selection.
+
+        Edges lighter than `LOD_MIN_EDGE_WEIGHT` interactions are dropped. Expanded members are
+        shown as children of their (compound) cluster node, with edges to the collapsed units.
+        """
+        core_nodes = set(self.core_nodes)
+        expanded = [cluster_id for cluster_id in expanded if cluster_id in self.clusters]
+        if timestamp <= self.min_timestamp:
+            return [self._node_element(node, start_timestamp, timestamp, {}, {}, core_nodes, edge_types) for node in self.core_nodes]
+
+        def selected(key):
+            return edge_types is None or key[1] in edge_types
+
+        edges = []
+        for (a, b), timelines in self.unit_pairs.items():
+            counts = {key: _count_between(ts, start_timestamp, timestamp) for key, ts in timelines.items() if selected(key)}
+            # The part of the pair covered by expanded members is drawn from the members instead
+            for cluster_id in expanded:
+                for key, ts in self.expanded_share.get((cluster_id, (a, b)), {}).items():
+                    if selected(key):
+                        counts[key] -= _count_between(ts, start_timestamp, timestamp)
+            if sum(counts.values()) >= LOD_MIN_EDGE_WEIGHT:
+                edges.append(self._edge_element(a, b, counts, core_nodes))
+
+        for (member, other_unit), timelines in self.member_pairs.items():
+            if self.expandable[member] not in expanded:
+                continue
+            counts = {key: _count_between(ts, start_timestamp, timestamp) for key, ts in timelines.items() if selected(key)}
+            if sum(counts.values()) >= LOD_MIN_EDGE_WEIGHT:
+                edges.append(self._edge_element(member, other_unit, counts, core_nodes))
+
+        if edges:
+            max_weight = max(edge['data']['weight'] for edge in edges)
+            for edge in edges:
+                edge['data']['normalized_weight'] = normalize_value(
+                    edge['data']['weight'], 1, max_weight, MIN_EDGE_WIDTH, MAX_EDGE_WIDTH
+                )
+
+        visible = set(core_nodes)
+        for unit in self.detail_nodes + list(self.clusters):
+            if _count_types(self.unit_events.get(unit, {}), start_timestamp, timestamp, edge_types) > 0:
+                visible.add(unit)
+        for edge in edges:
+            visible.update((edge['data']['source'], edge['data']['target']))
+        for cluster_id in expanded:
+            visible.add(cluster_id)
+            visible.update(member for member in self.clusters[cluster_id]['members'] if member in self.expandable
+                           and _count_types(self.member_events.get(member, {}), start_timestamp, timestamp, edge_types) > 0)
+
+        # Centrality on the aggregated graph is cheap: it only has a few hundred units
+        unit_graph = nx.Graph()
+        unit_graph.add_nodes_from(visible)
+        unit_graph.add_edges_from((edge['data']['source'], edge['data']['target']) for edge in edges)
+        with observe_stage('centrality'):
+            centrality = nx.degree_centrality(unit_graph)
+            betweenness = nx.betweenness_centrality(unit_graph)
+
+        nodes = [
+            self._node_element(node, start_timestamp, timestamp, centrality, betweenness, core_nodes, edge_types)
+            for node in visible
+        ]
+        max_interactions = max((node['data']['interactions_count'] for node in nodes), default=0) or 1
+        max_betweenness = max(betweenness.values(), default=0)
+        for node in nodes:
+            data = node['data']
+            data['size'] = NON_CORE_BASE_SIZE * (1 + data['interactions_count'] / max_interactions)
+            data['connected_core_nodes'] = sum(
+                1 for core_node in core_nodes if unit_graph.has_edge(data['id'], core_node)
+            )
+            if data['is_cluster'] == 'true':
+                data['size'] *= 1 + math.log10(data['member_count'])
+                # Always set: the client keeps an element's old classes when the key is dropped
+                node['classes'] = 'expanded' if data['id'] in expanded else ''
+            elif data['is_core'] != 'true' and max_betweenness > 0:
+                data['color'] = f"rgb({int(255 * betweenness.get(data['id'], 0) / max_betweenness)}, 0, 255)"
+            if data['id'] in self.expandable and self.expandable[data['id']] in expanded:
+                data['parent'] = self.expandable[data['id']]
+
+        return nodes + edges
+
+    def _node_element(self, node, start_timestamp, timestamp, centrality, betweenness, core_nodes, edge_types=None):
+        is_core = node in core_nodes
+        if is_cluster(node):
+            events = self.unit_events.get(node, {})
+            metadata = {}
+            member_count = len(self.clusters[node]['members'])
+        else:
+            events = self.member_events.get(node) if node in self.expandable else self.unit_events.get(node, {})
+            metadata = self.node_metadata.get(node, {})
+            member_count = 1
+
+        element = {
+            'data': {
+                'id': node,
+                'label': self.labels.get(node, node),
+                'size': NON_CORE_BASE_SIZE,
+                'fid': node,
+                'display_name': metadata.get('username', 'N/A'),
+                'follower_count': metadata.get('follower_count', 0),
+                'following_count': metadata.get('following_count', 0),
+                'is_core': 'true' if is_core else 'false',
+                'is_cluster': 'true' if is_cluster(node) else 'false',
+                'member_count': member_count,
+                'centrality': centrality.get(node, 0) if not is_core else 'N/A',
+                'betweenness': betweenness.get(node, 0) if not is_core else 'N/A',
+                'color': 'rgb(0, 0, 255)',
+                'connected_core_nodes': 0,
+                'interactions_count': _count_types(events or {}, start_timestamp, timestamp, edge_types),
+                'pfp_url': thumbnail_url(metadata.get('pfp_url'))
+            }
+        }
+        if node in self.positions:
+            element['position'] = self.positions[node]
+        return element
+
+    def unit_graph(self, timestamp, expanded=(), start_timestamp=None, edge_types=None):
+        """Aggregated graph at `timestamp`, with usernames as labels, for the matrices view."""
+        G = nx.Graph()
+        for element in self.elements(timestamp, expanded, start_timestamp, edge_types):
+            data = element['data']
+            if 'source' in data:
+                G.add_edge(data['source'], data['target'])
+            else:
+                G.add_node(data['id'], username=data['label'])
+        return G
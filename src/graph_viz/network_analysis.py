@@ -1,24 +1,37 @@
-import networkx as nx
 import numpy as np
 from collections import Counter
 
+from src.graph_viz.pfp_proxy import thumbnail_url
+from src.graph_viz.temporal_index import TemporalIndex
+from src.graph_viz.config import MIN_EDGE_WIDTH, MAX_EDGE_WIDTH
+from src.monitoring.metrics import observe_stage, timed_stage
+from src.utils.lazy_import import lazy_import
+
+nx = lazy_import('networkx')
+
+def interaction_count(G, u, v):
+    """Interactions from `u` to `v`; an edge built from a rollup stands for `count` of them."""
+    return sum(d.get('count', 1) for d in G.get_edge_data(u, v, default={}).values())
+
 def calculate_connection_strength(G, core_nodes):
     connection_strength = {}
     for node in G.nodes():
         if node not in core_nodes:
             strengths = []
             for core_node in core_nodes:
-                edge_count = (
-                    len(G.get_edge_data(node, core_node, default={}))
-                    + len(G.get_edge_data(core_node, node, default={}))
-                )
+                edge_count = interaction_count(G, node, core_node) + interaction_count(G, core_node, node)
                 strengths.append(edge_count)
             connection_strength[node] = min(strengths) if strengths else 0
     return connection_strength
 
-def filter_graph(G, core_nodes, top_n=25):
+def top_connected_nodes(G, core_nodes, top_n):
+    """The `top_n` non-core nodes with the strongest connection to all core nodes."""
     connection_strength = calculate_connection_strength(G, core_nodes)
-    top_nodes = sorted(connection_strength, key=connection_strength.get, reverse=True)[:top_n]
+    return sorted(connection_strength, key=connection_strength.get, reverse=True)[:top_n]
+
+@timed_stage('filter_graph')
+def filter_graph(G, core_nodes, top_n=25):
+    top_nodes = top_connected_nodes(G, core_nodes, top_n)
     filtered_nodes = set(top_nodes + core_nodes)
     return G.subgraph(filtered_nodes).copy()
 
@@ -27,63 +40,104 @@ def normalize_value(value, min_val, max_val, new_min, new_max):
         return new_min
     return ((value - min_val) / (max_val - min_val)) * (new_max - new_min) + new_min
 
-def get_elements(G, timestamp, core_nodes, tapNodeData=None):
-    cyto_elements = []
-    active_nodes = set(core_nodes)  # Initialize with core nodes
+def aggregate_edges(G, index, start_timestamp, timestamp, edge_types=None):
+    """
+    Aggregate the interactions in the window (of `edge_types`, if given) into one Cytoscape edge per node pair.
+
+    Works as a columnar group-by on the `TemporalIndex`: counts per
+    `(pair, edge type, direction)` group come out as one array, pair weights and
+    normalized widths are array reductions over it, and element dicts are only built
+    for the pairs that end up visible.
+
+    Returns:
+        Dict[tuple, dict]: Edge elements keyed by the sorted `(source, target)` pair.
+    """
+    group_counts = index.group_counts(start_timestamp, timestamp, edge_types)
+    pair_weights = index.pair_counts(start_timestamp, timestamp, group_counts=group_counts)
+    forward = group_counts * (index.group_direction == 0)
+    forward_counts = np.bincount(index.group_pair, weights=forward, minlength=index.num_pairs)
+
+    visible_pairs = np.flatnonzero(pair_weights)
+    if not len(visible_pairs):
+        return {}
+
+    # Edges point from the endpoint earlier in node order when it initiated anything in the window,
+    # i.e. the direction of the first interaction in MultiDiGraph iteration order
+    source_ids = np.where(forward_counts > 0, index.pair_low, index.pair_high)
+    target_ids = np.where(forward_counts > 0, index.pair_high, index.pair_low)
+
+    # Normalize edge weights and increase thickness for relationships with lots of interactions
+    max_weight = pair_weights.max()
+    if max_weight == 1:
+        normalized_weights = np.full(index.num_pairs, MIN_EDGE_WIDTH)
+    else:
+        normalized_weights = ((pair_weights - 1) / (max_weight - 1)) * (MAX_EDGE_WIDTH - MIN_EDGE_WIDTH) + MIN_EDGE_WIDTH
 
     edge_dict = {}
-    edges_up_to_timestamp = []
+    pair_keys = {}
+    for pair in visible_pairs.tolist():
+        source, target = index.nodes[source_ids[pair]], index.nodes[target_ids[pair]]
+        key = tuple(sorted((source, target)))  # Ensure consistent ordering
+        pair_keys[pair] = key
+        edge_dict[key] = {
+            'data': {
+                'id': f"{key[0]}-{key[1]}",  # Stable id so elements can be diffed
+                'source': source,
+                'target': target,
+                'source_username': G.nodes[source].get('username', source),
+                'target_username': G.nodes[target].get('username', target),
+                'weight': int(pair_weights[pair]),
+                'edge_types': Counter(),
+                'edge_to_core': 'false',  # Default value
+                'interactions': {
+                    source: Counter(),
+                    target: Counter()
+                },
+                'normalized_weight': float(normalized_weights[pair])
+            }
+        }
+
+    # Per-type and per-direction counts, only for groups with interactions in the window
+    for group in np.flatnonzero(group_counts).tolist():
+        pair = int(index.group_pair[group])
+        data = edge_dict[pair_keys[pair]]['data']
+        edge_type = index.edge_types[index.group_type[group]]
+        initiator = index.pair_high[pair] if index.group_direction[group] else index.pair_low[pair]
+        count = int(group_counts[group])
+        data['edge_types'][edge_type] += count
+        data['interactions'][index.nodes[initiator]][edge_type] += count
+
+    return edge_dict
+
+def get_elements(G, timestamp, core_nodes, tapNodeData=None, positions=None, start_timestamp=None, index=None,
+                 edge_types=None):
+    """
+    Build the Cytoscape elements for the interactions up to `timestamp`.
+
+    With `start_timestamp` only interactions in the window `[start_timestamp, timestamp]`
+    are shown. Pass the graph's cached `TemporalIndex` as `index` to avoid rebuilding it.
+    `edge_types` (e.g. ['FOLLOWING']) restricts everything, including the connection strength
+    ranking and centrality, to those interaction types.
+    """
+    cyto_elements = []
+    if index is None:
+        index = TemporalIndex(G)
+
+    # Interaction counts per node are prefix-count differences on the index
+    node_counts = index.node_counts(start_timestamp, timestamp, edge_types)
     interactions_count = {node: 0 for node in G.nodes()}  # Count for all nodes
-    
-    for edge in G.edges(data=True):
-        if edge[2]['timestamp'] <= timestamp:
-            source = str(edge[0])
-            target = str(edge[1])
-            active_nodes.add(source)
-            active_nodes.add(target)
-            edges_up_to_timestamp.append(edge)
-            
-            # Count interactions for all nodes
-            interactions_count[source] += 1
-            interactions_count[target] += 1
-            
-            if source != target:
-                edge_type = edge[2].get('edge_type', 'Unknown')
-                key = tuple(sorted((source, target)))  # Ensure consistent ordering
-                if key not in edge_dict:
-                    edge_dict[key] = {
-                        'data': {
-                            'source': source,
-                            'target': target,
-                            'source_username': G.nodes[source].get('username', source),  # Add username
-                            'target_username': G.nodes[target].get('username', target),  # Add username
-                            'weight': 1,
-                            'edge_types': Counter([edge_type]),
-                            'edge_to_core': 'false',  # Default value
-                            'interactions': {
-                                source: Counter([edge_type]),
-                                target: Counter()
-                            }
-                        }
-                    }
-                else:
-                    edge_dict[key]['data']['weight'] += 1
-                    edge_dict[key]['data']['edge_types'][edge_type] += 1
-                    edge_dict[key]['data']['interactions'][source][edge_type] += 1
+    interactions_count.update(zip(index.nodes, node_counts.tolist()))
+    active_nodes = set(core_nodes)  # Initialize with core nodes
+    active_nodes.update(index.nodes[i] for i in np.flatnonzero(node_counts))
 
-    # Normalize edge weights and increase thickness for relationships with lots of interactions
-    if edge_dict:
-        max_weight = max(edge['data']['weight'] for edge in edge_dict.values())
-        for edge in edge_dict.values():
-            normalized_weight = normalize_value(
-                edge['data']['weight'], 1, max_weight, 1.5, 15
-            )  # Increased max thickness by 2x
-            edge['data']['normalized_weight'] = normalized_weight
+    edge_dict = aggregate_edges(G, index, start_timestamp, timestamp, edge_types)
 
     # Build a temporary graph up to the current timestamp
     temp_G = nx.Graph()
     temp_G.add_nodes_from(active_nodes)
-    temp_G.add_edges_from([(e[0], e[1]) for e in edges_up_to_timestamp])
+    temp_G.add_edges_from((edge['data']['source'], edge['data']['target']) for edge in edge_dict.values())
+    loop_counts = index.loop_counts(start_timestamp, timestamp, edge_types)
+    temp_G.add_edges_from((index.nodes[i], index.nodes[i]) for i in np.flatnonzero(loop_counts))
 
     # Calculate connection strength for non-core nodes
     connection_strength = {}
@@ -101,9 +155,7 @@ def get_elements(G, timestamp, core_nodes, tapNodeData=None):
     # Sort non-core nodes by their connection strength to core nodes
     sorted_nodes = sorted(connection_strength, key=connection_strength.get, reverse=True)
 
-    # Get all timestamps and sort them
-    all_timestamps = sorted([edge[2]['timestamp'] for edge in G.edges(data=True)])
-    min_timestamp, max_timestamp = min(all_timestamps), max(all_timestamps)
+    min_timestamp, max_timestamp = index.min_timestamp, index.max_timestamp
 
     # Determine N based on timestamp
     N = min(int(normalize_value(timestamp, min_timestamp, max_timestamp, 1, 10)), 10)
@@ -121,13 +173,14 @@ def get_elements(G, timestamp, core_nodes, tapNodeData=None):
             edge['data']['edge_to_core'] = 'false'
 
     # Calculate node metrics for non-core nodes
-    centrality = nx.degree_centrality(temp_G)
-    betweenness = nx.betweenness_centrality(temp_G)
+    with observe_stage('centrality'):
+        centrality = nx.degree_centrality(temp_G)
+        betweenness = nx.betweenness_centrality(temp_G)
     max_centrality = max(centrality.values()) if centrality else 1
     max_betweenness = max(betweenness.values()) if betweenness else 1
 
     # Find the maximum interaction count for normalization
-    max_interactions = max(interactions_count.values()) if interactions_count else 1
+    max_interactions = max(interactions_count.values(), default=0) or 1  # Zero when nothing is in the window
 
     for node in active_nodes:
         data = G.nodes[node]
@@ -153,26 +206,28 @@ def get_elements(G, timestamp, core_nodes, tapNodeData=None):
             else:
                 node_color = "rgb(0, 0, 255)"  # Default color if max_betweenness is 0
 
-        cyto_elements.append(
-            {
-                'data': {
-                    'id': node,
-                    'label': data.get('username', node),
-                    'size': node_size,
-                    'fid': node,
-                    'display_name': data.get('username', 'N/A'),
-                    'follower_count': data.get('follower_count', 0),
-                    'following_count': data.get('following_count', 0),
-                    'is_core': 'true' if is_core else 'false',
-                    'centrality': centrality.get(node, 0) if not is_core else 'N/A',
-                    'betweenness': betweenness.get(node, 0) if not is_core else 'N/A',
-                    'color': node_color,
-                    'connected_core_nodes': connected_core_nodes,
-                    'interactions_count': interactions_count[node],
-                    'pfp_url': data.get('pfp_url')
-                }
+        node_element = {
+            'data': {
+                'id': node,
+                'label': data.get('username', node),
+                'size': node_size,
+                'fid': node,
+                'display_name': data.get('username', 'N/A'),
+                'follower_count': data.get('follower_count', 0),
+                'following_count': data.get('following_count', 0),
+                'is_core': 'true' if is_core else 'false',
+                'centrality': centrality.get(node, 0) if not is_core else 'N/A',
+                'betweenness': betweenness.get(node, 0) if not is_core else 'N/A',
+                'color': node_color,
+                'connected_core_nodes': connected_core_nodes,
+                'interactions_count': interactions_count[node],
+                'pfp_url': thumbnail_url(data.get('pfp_url'))
             }
-        )
+        }
+        # Precomputed positions are used by the 'preset' layout
+        if positions and node in positions:
+            node_element['position'] = positions[node]
+        cyto_elements.append(node_element)
     
     # Only include edges if it's not the initial stage (timestamp > min_timestamp)
     if timestamp > min_timestamp:
@@ -226,12 +281,31 @@ def get_node_edge_counts(G, timestamp, core_nodes):
         if data['timestamp'] <= timestamp:
             visible_nodes.add(u)
             visible_nodes.add(v)
-            visible_edges += 1
+            visible_edges += data.get('count', 1)
 
     return len(visible_nodes), visible_edges
 
+def interaction_graph(G, start_timestamp, end_timestamp, edge_types=None):
+    """
+    Undirected graph of who interacted in `[start_timestamp, end_timestamp]` (no lower bound
+    when start is None), optionally only through `edge_types`; the view used for the matrices.
+    """
+    window_start = -np.inf if start_timestamp is None else start_timestamp
+    G_filtered = nx.Graph(
+        (u, v, d) for (u, v, d) in G.edges(data=True)
+        if window_start <= d['timestamp'] <= end_timestamp and (edge_types is None or d.get('edge_type') in edge_types)
+    )
+
+    # Ensure node attributes are copied to the filtered graph
+    for node, data in G.nodes(data=True):
+        if node in G_filtered:
+            G_filtered.nodes[node].update(data)
+    return G_filtered
+
+@timed_stage('adjacency_matrix')
 def get_adjacency_matrix(G):
-    adj_matrix = nx.to_numpy_array(G)
+    # Multigraph entries count interactions (rollup edges stand for `count` of them); simple graphs are 0/1
+    adj_matrix = nx.to_numpy_array(G, weight='count' if G.is_multigraph() else None)
     username_mapping = nx.get_node_attributes(G, 'username')
     usernames = [username_mapping.get(node, str(node)) for node in G.nodes()]
     
@@ -240,6 +314,7 @@ def get_adjacency_matrix(G):
     
     return adj_matrix, usernames
 
+@timed_stage('shortest_path_matrix')
 def get_shortest_path_matrix(G):
     username_mapping = nx.get_node_attributes(G, 'username')
     shortest_paths = dict(nx.all_pairs_shortest_path_length(G))
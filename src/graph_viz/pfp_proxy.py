@@ -0,0 +1,324 @@
+import hashlib
+import hmac
+import io
+import ipaddress
+import logging
+import os
+import secrets
+import socket
+import threading
+from urllib.parse import quote, urljoin, urlparse
+
+from flask import Blueprint, abort, request, send_file
+
+from src.data_caching.cache import make_cache
+from src.data_caching.single_flight import SingleFlight
+from src.monitoring.metrics import observe_stage, record_cache, record_fetch
+from src.utils.lazy_import import lazy_import
+
+Image = lazy_import('PIL.Image')
+ImageOps = lazy_import('PIL.ImageOps')
+requests = lazy_import('requests')
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails live on disk, shared by the server's workers; least recently served go first
+PFP_CACHE_DIR = os.getenv('CLOUD_CARTOGRAPHY_PFP_CACHE_DIR', 'data/cache/pfp')
+PFP_CACHE_MAX_BYTES = int(os.getenv('CLOUD_CARTOGRAPHY_PFP_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Signs proxied URLs, so the route only fetches pictures the app itself linked to
+PFP_SECRET_ENV_VAR = 'CLOUD_CARTOGRAPHY_PFP_SECRET'
+# Without the env var, a key is generated once per host, outside the repository
+PFP_SECRET_PATH = os.getenv(
+    'CLOUD_CARTOGRAPHY_PFP_SECRET_FILE',
+    os.path.join(os.getenv('XDG_STATE_HOME') or os.path.expanduser('~/.local/state'), 'cloud-cartography', 'pfp_secret')
+)
+PFP_THUMBNAIL_SIZE = 128  # Pixels; larger than any node, and sharp in the node modal
+PFP_MAX_SOURCE_BYTES = 10 * 1024 * 1024
+PFP_FETCH_TIMEOUT_SECONDS = 5
+PFP_MAX_REDIRECTS = 3
+PFP_BROWSER_CACHE_SECONDS = 365 * 86400  # A new picture means a new source URL, so thumbnails never change
+PFP_FAILURE_TTL_SECONDS = 600
+
+# Only raster formats are served; an SVG from our origin could run scripts
+IMAGE_EXTENSIONS = {'image/webp': '.webp', 'image/png': '.png', 'image/jpeg': '.jpg', 'image/gif': '.gif'}
+MIMETYPES = {extension: mimetype for mimetype, extension in IMAGE_EXTENSIONS.items()}
+
+pfp_proxy = Blueprint('pfp_proxy', __name__, url_prefix='/pfp')
+
+# Sources that failed recently aren't fetched again on every render
+_failures = make_cache('pfp_failures', max_entries=4096, ttl_seconds=PFP_FAILURE_TTL_SECONDS)
+_flight = SingleFlight('pfp')
+_secret = None
+_secret_lock = threading.Lock()
+_cache_bytes = None
+_cache_lock = threading.Lock()
+
+
+def _signing_key():
+    """Key from `CLOUD_CARTOGRAPHY_PFP_SECRET`, or one generated once at `PFP_SECRET_PATH` for every worker on the host."""
+    global _secret
+    if _secret is None:
+        with _secret_lock:
+            if _secret is None:
+                secret = os.getenv(PFP_SECRET_ENV_VAR)
+                if not secret:
+                    os.makedirs(os.path.dirname(PFP_SECRET_PATH), mode=0o700, exist_ok=True)
+                    try:
+                        fd = os.open(PFP_SECRET_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                        with os.fdopen(fd, 'w') as f:
+                            f.write(secrets.token_hex(32))
+                        logger.warning(f"{PFP_SECRET_ENV_VAR} is not set; generated a profile picture signing key at {PFP_SECRET_PATH}")
+                    except FileExistsError:
+                        pass
+                    with open(PFP_SECRET_PATH) as f:
+                        secret = f.read().strip()
+                _secret = secret.encode('utf-8')
+    return _secret
+
+def _signature(source_url):
+    return hmac.new(_signing_key(), source_url.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+def _is_public_address(address):
+    try:
+        ip = ipaddress.ip_address(address.split('%')[0])
+    except ValueError:
+        return False
+    return ip.is_global and not ip.is_multicast
+
+def _allowed_url(url):
+    """
+    Whether `url` may be proxied: http(s) on the default port of a public host.
+
+    Anyone can set their `pfp_url`, so without this the server would fetch internal
+    addresses (metadata endpoints, localhost services) on their behalf. Names are only
+    checked here; `_public_address` resolves them when the picture is fetched.
+    """
+    try:
+        parsed = urlparse(url)
+        port = parsed.port
+    except ValueError:
+        return False
+    hostname = (parsed.hostname or '').rstrip('.').lower()
+    if parsed.scheme not in ('http', 'https') or not hostname or parsed.username or parsed.password:
+        return False
+    if port not in (None, 80, 443):
+        return False
+    try:
+        ipaddress.ip_address(hostname.split('%')[0])
+    except ValueError:
+        # A name: single-label and local names are never public
+        return not ('.' not in hostname or hostname == 'localhost' or hostname.endswith(('.localhost', '.local', '.internal')))
+    return _is_public_address(hostname)
+
+def _public_address(url):
+    """The address to fetch an allowed `url` from, or None unless every address its host resolves to is public."""
+    parsed = urlparse(url)
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or parsed.scheme, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        return None
+    addresses = [info[4][0] for info in infos]
+    if not addresses or not all(_is_public_address(address) for address in addresses):
+        return None
+    return addresses[0]
+
+def _pinned_get(url, address):
+    """
+    GET `url` from `address` without resolving its host again.
+
+    A second lookup could return a different (internal) address than the one checked, so the
+    connection goes to `address` while the Host header, TLS SNI and certificate check keep
+    the URL's host name.
+
+    Returns:
+        Tuple[requests.Session, requests.Response]: The response streams; close both when done.
+    """
+    parsed = urlparse(url)
+    host = f"[{address}]" if ':' in address else address
+    pinned_url = parsed._replace(netloc=host if parsed.port is None else f"{host}:{parsed.port}").geturl()
+    adapter = requests.adapters.HTTPAdapter(max_retries=0)
+    if parsed.scheme == 'https':
+        adapter.poolmanager.connection_pool_kw.update(server_hostname=parsed.hostname, assert_hostname=parsed.hostname)
+    session = requests.Session()
+    session.mount(f"{parsed.scheme}://", adapter)
+    try:
+        response = session.get(
+            pinned_url, headers={'Host': parsed.netloc}, timeout=PFP_FETCH_TIMEOUT_SECONDS, stream=True,
+            allow_redirects=False
+        )
+    except Exception:
+        session.close()
+        raise
+    return session, response
+
+def thumbnail_url(source_url):
+    """Local URL of the thumbnail of a profile picture, or None if there is no picture it may proxy."""
+    if not source_url or not _allowed_url(source_url):
+        return None
+    return f"{pfp_proxy.url_prefix}/{_signature(source_url)}?url={quote(source_url, safe='')}"
+
+def _cache_path(key, extension):
+    return os.path.join(PFP_CACHE_DIR, f"{key}{extension}")
+
+def _cached_file(key):
+    for extension in MIMETYPES:
+        path = _cache_path(key, extension)
+        if os.path.exists(path):
+            return path
+    return None
+
+def _fetch(source_url):
+    with observe_stage('pfp_fetch'):
+        # Redirects are followed by hand, so every hop is resolved, checked and pinned
+        url = source_url
+        for _ in range(PFP_MAX_REDIRECTS + 1):
+            address = _public_address(url) if _allowed_url(url) else None
+            if address is None:
+                raise ValueError(f"Refusing to fetch {url}: not a public http(s) URL")
+            session, response = _pinned_get(url, address)
+            if not response.is_redirect:
+                break
+            response.close()
+            session.close()
+            url = urljoin(url, response.headers['Location'])
+        else:
+            raise ValueError(f"More than {PFP_MAX_REDIRECTS} redirects")
+        try:
+            response.raise_for_status()
+            body = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                body.extend(chunk)
+                if len(body) > PFP_MAX_SOURCE_BYTES:
+                    raise ValueError(f"Profile picture larger than {PFP_MAX_SOURCE_BYTES} bytes")
+        finally:
+            response.close()
+            session.close()
+    record_fetch('pfp', 'image', len(body))
+    return bytes(body), response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+
+_pillow_available = None
+
+def pillow_available():
+    """Whether Pillow can be imported; without it the original images are cached and served as they are."""
+    global _pillow_available
+    if _pillow_available is None:
+        try:
+            ImageOps.fit
+            _pillow_available = True
+        except ImportError:
+            _pillow_available = False
+    return _pillow_available
+
+def make_thumbnail(body, size=PFP_THUMBNAIL_SIZE):
+    """Square, centre-cropped WebP thumbnail of an image; the first frame of animations."""
+    with Image.open(io.BytesIO(body)) as image:
+        image.draft('RGB', (size, size))  # JPEGs decode at a fraction of their size
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        thumbnail.save(output, format='WEBP', quality=80, method=4)
+    return output.getvalue(), '.webp'
+
+def _store(key, data, extension):
+    global _cache_bytes
+    os.makedirs(PFP_CACHE_DIR, exist_ok=True)
+    path = _cache_path(key, extension)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    with _cache_lock:
+        if _cache_bytes is None:
+            _cache_bytes = sum(size for _, size, _ in _cache_entries())
+        else:
+            _cache_bytes += len(data)
+        if _cache_bytes > PFP_CACHE_MAX_BYTES:
+            _cache_bytes = _evict(PFP_CACHE_MAX_BYTES * 0.9)
+    return path
+
+def _cache_entries():
+    """(path, size, last served) of every cached image."""
+    entries = []
+    with os.scandir(PFP_CACHE_DIR) as scan:
+        for entry in scan:
+            if entry.is_file() and os.path.splitext(entry.name)[1] in MIMETYPES:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+    return entries
+
+def _evict(target_bytes):
+    """Delete the least recently served images until the cache fits in `target_bytes`; return its new size."""
+    entries = sorted(_cache_entries(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    for path, size, _ in entries:
+        if total <= target_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    logger.info(f"Evicted {evicted} profile pictures, {total} bytes left in {PFP_CACHE_DIR}")
+    return total
+
+def get_thumbnail(source_url):
+    """Path of the cached thumbnail of `source_url`, fetching and resizing it on a miss; None if it can't be had."""
+    key = hashlib.sha256(source_url.encode('utf-8')).hexdigest()[:40]
+    path = _cached_file(key)
+    record_cache('pfp_thumbnails', path is not None)
+    if path is not None:
+        return path
+    if key in _failures:
+        return None
+
+    def fetch_and_store():
+        # Another worker may have stored it while this one waited
+        path = _cached_file(key)
+        if path is not None:
+            return path
+        try:
+            body, mimetype = _fetch(source_url)
+            if pillow_available():
+                data, extension = make_thumbnail(body)
+            elif mimetype in IMAGE_EXTENSIONS:
+                data, extension = body, IMAGE_EXTENSIONS[mimetype]
+            else:
+                raise ValueError(f"Unsupported profile picture type '{mimetype}'")
+        except Exception as e:
+            logger.warning(f"Could not proxy profile picture {source_url}: {e}")
+            _failures.set(key, True)
+            return None
+        return _store(key, data, extension)
+
+    return _flight.do(key, fetch_and_store)
+
+@pfp_proxy.route('/<signature>')
+def serve_thumbnail(signature):
+    source_url = request.args.get('url', '')
+    if not source_url or not _allowed_url(source_url) or not hmac.compare_digest(signature, _signature(source_url)):
+        abort(404)
+
+    path = get_thumbnail(source_url)
+    if path is None:
+        abort(404)
+    try:
+        # Bump the modification time: eviction goes by when an image was last served
+        os.utime(path)
+        # The default ETag follows the modification time, so name the file's content instead
+        response = send_file(
+            path, mimetype=MIMETYPES[os.path.splitext(path)[1]], max_age=PFP_BROWSER_CACHE_SECONDS,
+            etag=os.path.basename(path)
+        )
+    except FileNotFoundError:
+        abort(404)  # Evicted in between
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
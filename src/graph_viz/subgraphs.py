@@ -0,0 +1,201 @@
+from src.data_caching.cache import make_cache
+from src.data_caching.cast_index import get_cast_index
+from src.data_caching.inbound_index import EDGE_TYPES, get_inbound_index
+from src.data_ingestion.fetch_data import get_data_fetcher
+from src.data_ingestion.prefetch import get_prefetcher
+from src.graph_processing.build_graph import get_graph_builder
+from src.graph_processing.snapshot import GraphSnapshot, snapshot_bytes
+from src.graph_viz.network_analysis import filter_graph, top_connected_nodes
+from src.graph_viz.layout_engine import compute_positions, graph_hash
+from src.graph_viz.level_of_detail import LevelOfDetailView, get_lod_view, store_lod_view
+from src.graph_viz.config import (
+    TOP_N_NODES, LOD_TOP_N_NODES, SUBGRAPH_CACHE_SIZE, SUBGRAPH_CACHE_TTL_SECONDS, PREFETCH_ENABLED, PREFETCH_TOP_K,
+    USE_ROLLUPS, EDGE_DETAIL_EVENTS, EDGE_DETAIL_CASTS
+)
+from src.monitoring.metrics import observe_stage, record_graph_size
+from src.utils.lazy_import import lazy_import
+
+nx = lazy_import('networkx')
+
+# Built subgraphs per (FID set, large graph mode, top N, with layout)
+_subgraph_cache = make_cache('subgraphs', max_entries=SUBGRAPH_CACHE_SIZE, ttl_seconds=SUBGRAPH_CACHE_TTL_SECONDS)
+# Uncompressed binary snapshots of the graphs sent to the browser, per graph key
+_graph_snapshots = make_cache('graph_snapshots', max_entries=SUBGRAPH_CACHE_SIZE, ttl_seconds=SUBGRAPH_CACHE_TTL_SECONDS)
+
+
+def _cached_subgraph(cache_key, lod):
+    cached = _subgraph_cache.get(cache_key)
+    # LOD views live in their own cache and may have been evicted since
+    if cached is not None and (not lod or get_lod_view(cached['graph_data']['graph_key']) is not None):
+        return cached
+    return None
+
+def graph_from_data(graph_data):
+    """
+    The networkx graph of a subgraph's node-link `graph_data`.
+
+    Callbacks get the graph back from the browser on every slider move; after the first
+    decode it is rebuilt from a binary snapshot, several times faster than `node_link_graph`.
+    """
+    graph_key = graph_data.get('graph_key')
+    snapshot = _graph_snapshots.get(graph_key) if graph_key else None
+    if snapshot is not None:
+        return GraphSnapshot(snapshot).to_networkx()
+
+    G = nx.readwrite.json_graph.node_link_graph(graph_data, multigraph=True)
+    if graph_key:
+        _graph_snapshots.set(graph_key, snapshot_bytes(G, compression='none'))
+    return G
+
+def subgraph_cache_key(core_nodes, lod, top_n, layout, paths=False):
+    return (tuple(core_nodes), lod, top_n, layout or lod, paths)
+
+def build_subgraph(G, core_nodes, lod=False, top_n=None, layout=True, paths=False):
+    """
+    Filter the full graph `G` down to the subgraph sent to the UI and API.
+
+    With `paths`, the shortest paths between the core nodes over the cached corpus are
+    added, intermediate accounts included, and listed in `graph_data['paths']`.
+
+    Returns:
+        Tuple[dict, nx.MultiDiGraph]: The subgraph (see `get_subgraph`) and the filtered graph.
+    """
+    top_n = top_n or (LOD_TOP_N_NODES if lod else TOP_N_NODES)
+    filtered_G = filter_graph(G, core_nodes, top_n=top_n)
+    connecting_paths = get_graph_builder().add_connecting_paths(filtered_G, core_nodes, full_G=G) if paths else None
+    record_graph_size('filtered', filtered_G)
+
+    all_timestamps = sorted([edge[2]['timestamp'] for edge in filtered_G.edges(data=True)])
+    min_timestamp, max_timestamp = min(all_timestamps), max(all_timestamps)
+
+    graph_key = graph_hash(filtered_G, core_nodes)
+    if lod:
+        # Large neighbourhoods stay server-side; the browser only gets a handle to the view
+        with observe_stage('lod_view'):
+            store_lod_view(graph_key, LevelOfDetailView(filtered_G, core_nodes))
+        graph_data = {'lod': True}
+    else:
+        with observe_stage('serialize_graph'):
+            graph_data = nx.readwrite.json_graph.node_link_data(filtered_G)
+        if layout:
+            with observe_stage('layout'):
+                graph_data['positions'] = compute_positions(filtered_G, core_nodes, key=graph_key)
+    graph_data['graph_key'] = graph_key
+    graph_data['min_timestamp'] = min_timestamp
+    graph_data['max_timestamp'] = max_timestamp
+    graph_data['core_nodes'] = core_nodes
+    if paths:
+        graph_data['paths'] = connecting_paths
+
+    subgraph = {
+        'graph_data': graph_data,
+        'node_count': filtered_G.number_of_nodes(),
+        # Interactions rather than edges, so graphs built from rollups report the same number
+        'edge_count': sum(d.get('count', 1) for _, _, d in filtered_G.edges(data=True))
+    }
+    return subgraph, filtered_G
+
+def store_subgraph(core_nodes, subgraph, lod=False, top_n=None, layout=True, paths=False):
+    top_n = top_n or (LOD_TOP_N_NODES if lod else TOP_N_NODES)
+    _subgraph_cache.set(subgraph_cache_key(core_nodes, lod, top_n, layout, paths), subgraph)
+
+def get_subgraph(core_nodes, lod=False, top_n=None, layout=True, paths=False):
+    """
+    Build the filtered subgraph tying `core_nodes` together, or return it from the shared cache.
+
+    Both the UI and the HTTP API go through here, so a graph built by either (in any worker)
+    serves the other.
+
+    Args:
+        core_nodes (List[str]): Core FIDs, in the order given by the user.
+        lod (bool): Build a level-of-detail view instead of sending the whole graph.
+        top_n (int): Non-core nodes to keep; defaults depend on `lod`.
+        layout (bool): Compute preset positions (skipped by API clients that don't need them).
+        paths (bool): Add the shortest paths between the core nodes over the cached corpus.
+
+    Returns:
+        dict: `graph_data` (node-link data with `graph_key`, `min_timestamp`, `max_timestamp`,
+        `core_nodes` and optionally `positions` and `paths`, or only the handle in LOD mode), `node_count`
+        and `edge_count`.
+    """
+    top_n = top_n or (LOD_TOP_N_NODES if lod else TOP_N_NODES)
+    cached = _cached_subgraph(subgraph_cache_key(core_nodes, lod, top_n, layout, paths), lod)
+    if cached is None and not layout:
+        # A graph built for the UI has everything an API client needs
+        cached = _cached_subgraph(subgraph_cache_key(core_nodes, lod, top_n, True, paths), lod)
+    if cached is not None:
+        return cached
+
+    fetcher = get_data_fetcher()
+    gb = get_graph_builder()
+    prefetcher = get_prefetcher()
+    # Background prefetches hold off while this build is fetching
+    with prefetcher.foreground(core_nodes):
+        if USE_ROLLUPS:
+            G = gb.build_graph_from_rollups(fetcher.get_all_users_rollups(core_nodes))
+        else:
+            G = gb.build_graph_from_data(fetcher.get_all_users_data(core_nodes))
+    subgraph, filtered_G = build_subgraph(G, core_nodes, lod=lod, top_n=top_n, layout=layout, paths=paths)
+
+    # Users usually add one of the best connected accounts next; warm them up
+    if PREFETCH_ENABLED:
+        prefetcher.schedule(top_connected_nodes(filtered_G, core_nodes, PREFETCH_TOP_K), rollups=USE_ROLLUPS)
+
+    store_subgraph(core_nodes, subgraph, lod=lod, top_n=top_n, layout=layout, paths=paths)
+    return subgraph
+
+def interaction_events(core_nodes, source, target, limit=EDGE_DETAIL_EVENTS):
+    """
+    The latest raw interactions between `source` and `target`, for the edge details.
+
+    Graphs built from rollups only know daily counts, so this goes back to the raw
+    records: the core users' own, plus the inbound index for interactions initiated by
+    other accounts. Edges between two non-core accounts have no raw events to show.
+
+    Returns:
+        List[dict]: `source`, `target`, `edge_type` and `timestamp` of each interaction, latest first.
+    """
+    core_nodes = [str(fid) for fid in core_nodes]
+    owners = [fid for fid in (str(source), str(target)) if fid in core_nodes]
+    events = []
+    for owner, user_data in get_data_fetcher().get_all_users_data(owners).items():
+        other = str(target) if owner == str(source) else str(source)
+        for edge_type in EDGE_TYPES:
+            events.extend(
+                {'source': owner, 'target': other, 'edge_type': edge_type.upper(), 'timestamp': int(record['timestamp'])}
+                for record in user_data.get(edge_type) or []
+                if str(record.get('target')) == other and 'timestamp' in record
+            )
+
+    index = get_inbound_index()
+    if index is not None:
+        for owner in owners:
+            other = str(target) if owner == str(source) else str(source)
+            if other in core_nodes or not other.isdigit():
+                continue  # A core account's own record already has its side
+            sources, edge_types, timestamps = index.postings(owner)
+            keep = sources == int(other)
+            events.extend(
+                {'source': other, 'target': owner, 'edge_type': EDGE_TYPES[edge_type].upper(), 'timestamp': timestamp}
+                for edge_type, timestamp in zip(edge_types[keep].tolist(), timestamps[keep].tolist())
+            )
+
+    events.sort(key=lambda event: event['timestamp'], reverse=True)
+    return events[:limit]
+
+def interaction_casts(source, target, limit=EDGE_DETAIL_CASTS):
+    """
+    The casts behind an edge: each account's casts that the other liked, recast or replied to.
+
+    Answered from the cast index, so it covers the whole cached corpus (not only the core
+    users' records) without loading any raw data. Empty if the index hasn't been built.
+
+    Returns:
+        List[dict]: See `CastIndex.casts_between`; the most engaged with first.
+    """
+    index = get_cast_index()
+    if index is None:
+        return []
+    casts = index.casts_between(source, target) + index.casts_between(target, source)
+    casts.sort(key=lambda cast: (len(cast['engagements']), cast['last_timestamp']), reverse=True)
+    return casts[:limit]
@@ -0,0 +1,163 @@
+import numpy as np
+
+from src.data_caching.cache import make_cache
+
+# Indexes per graph, keyed by the graph hash stored in `graph-store`
+_temporal_indexes = make_cache('temporal_index', max_entries=32)
+
+
+def get_temporal_index(G, graph_key=None):
+    """Return the cached index for `graph_key`, building it from `G` on a miss."""
+    if graph_key is None:
+        return TemporalIndex(G)
+    index = _temporal_indexes.get(graph_key)
+    if index is None:
+        index = TemporalIndex(G)
+        _temporal_indexes.set(graph_key, index)
+    return index
+
+
+class TemporalIndex:
+    """
+    Sorted-timestamp index over the edges of a MultiDiGraph.
+
+    Every edge gets its rank in global timestamp order. Edges are also sorted by
+    `(group, rank)` and `(node, edge type, rank)` into composite integer keys, where a group
+    is one `(pair, edge type, direction)` combination. The number of interactions of every
+    group (or node and type) inside a time window is then the difference of two
+    `searchsorted` results: one prefix count at each end of the window. Any window, including
+    the cumulative `timestamp <= t` view, costs the same, regardless of how many interactions
+    a pair has, and so does restricting the counts to some edge types.
+
+    Edges built from rollups carry a `count`; each key then also gets a running total of
+    the counts, and a window's count is the difference of the totals at its two ends.
+    """
+
+    def __init__(self, G):
+        self.nodes = [str(node) for node in G.nodes()]
+        self.node_index = {node: i for i, node in enumerate(self.nodes)}
+
+        src, dst, timestamps, edge_types, counts = [], [], [], [], []
+        for u, v, d in G.edges(data=True):
+            src.append(self.node_index[str(u)])
+            dst.append(self.node_index[str(v)])
+            timestamps.append(d['timestamp'])
+            edge_types.append(d.get('edge_type', 'Unknown'))
+            counts.append(d.get('count', 1))
+
+        order = np.argsort(np.asarray(timestamps, dtype=float), kind='stable')
+        self.timestamps = np.asarray(timestamps, dtype=float)[order]
+        self.src = np.asarray(src, dtype=np.int64)[order]
+        self.dst = np.asarray(dst, dtype=np.int64)[order]
+        self.edge_types, type_ids = np.unique(np.asarray(edge_types, dtype=str), return_inverse=True)
+        type_ids = type_ids.reshape(-1)[order]
+        counts = np.asarray(counts, dtype=np.int64)[order]
+        # Plain event graphs skip the running totals: every event counts once
+        weights = counts if np.any(counts != 1) else None
+        self.edge_types = self.edge_types.tolist()
+        self.num_events = len(self.timestamps)
+        num_nodes = max(len(self.nodes), 1)
+        num_types = self._num_types = max(len(self.edge_types), 1)
+        rank = np.arange(self.num_events, dtype=np.int64)
+
+        # Undirected pairs (self-loops excluded), as in the element list; low/high follow node order
+        low, high = np.minimum(self.src, self.dst), np.maximum(self.src, self.dst)
+        not_loop = low != high
+        unique_pairs, event_pair = np.unique(low[not_loop] * num_nodes + high[not_loop], return_inverse=True)
+        self.pair_low = unique_pairs // num_nodes
+        self.pair_high = unique_pairs % num_nodes
+        self.num_pairs = len(unique_pairs)
+
+        # Groups of (pair, edge type, direction); direction 1 means the later node in node order initiated
+        direction = (self.src[not_loop] != low[not_loop]).astype(np.int64)
+        group_codes = (event_pair.reshape(-1) * num_types + type_ids[not_loop]) * 2 + direction
+        unique_groups, event_group = np.unique(group_codes, return_inverse=True)
+        self.group_pair = unique_groups // (2 * num_types)
+        self.group_type = (unique_groups // 2) % num_types
+        self.group_direction = unique_groups % 2
+        self.num_groups = len(unique_groups)
+        self._group_keys, self._group_totals = self._sorted_keys(
+            event_group.reshape(-1) * (self.num_events + 1) + rank[not_loop],
+            weights[not_loop] if weights is not None else None
+        )
+
+        # Self-loops only matter for the temporary graph used for centrality
+        loop_node_types = self.src[~not_loop] * num_types + type_ids[~not_loop]
+        self._loop_keys, self._loop_totals = self._sorted_keys(
+            loop_node_types * (self.num_events + 1) + rank[~not_loop],
+            weights[~not_loop] if weights is not None else None
+        )
+
+        # Each event counts once for both of its endpoints (twice for a self-loop), per edge type
+        src_types, dst_types = self.src * num_types + type_ids, self.dst * num_types + type_ids
+        self._node_keys, self._node_totals = self._sorted_keys(
+            np.concatenate([src_types * (self.num_events + 1) + rank, dst_types * (self.num_events + 1) + rank]),
+            np.concatenate([weights, weights]) if weights is not None else None
+        )
+
+    @staticmethod
+    def _sorted_keys(keys, weights):
+        """Sorted `keys`, and the running totals of `weights` in that order (None if unweighted)."""
+        if weights is None:
+            return np.sort(keys), None
+        order = np.argsort(keys, kind='stable')
+        totals = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(weights[order], out=totals[1:])
+        return keys[order], totals
+
+    @property
+    def min_timestamp(self):
+        return self.timestamps[0] if self.num_events else 0
+
+    @property
+    def max_timestamp(self):
+        return self.timestamps[-1] if self.num_events else 0
+
+    def rank_range(self, start_timestamp, end_timestamp):
+        """Half-open range of event ranks with `start_timestamp <= timestamp <= end_timestamp`."""
+        low = 0 if start_timestamp is None else int(np.searchsorted(self.timestamps, start_timestamp, side='left'))
+        high = int(np.searchsorted(self.timestamps, end_timestamp, side='right'))
+        return low, max(low, high)
+
+    def _window_counts(self, keys, totals, num_groups, low, high):
+        base = np.arange(num_groups, dtype=np.int64) * (self.num_events + 1)
+        upper, lower = np.searchsorted(keys, base + high), np.searchsorted(keys, base + low)
+        if totals is None:
+            return upper - lower
+        return totals[upper] - totals[lower]
+
+    def type_mask(self, edge_types):
+        """Boolean mask over `edge_types` (the index's) of the selected types; None selects all."""
+        if edge_types is None:
+            return None
+        selected = set(edge_types)
+        return np.array([edge_type in selected for edge_type in self.edge_types], dtype=bool)
+
+    def _node_type_counts(self, keys, totals, low, high, edge_types):
+        counts = self._window_counts(keys, totals, len(self.nodes) * self._num_types, low, high)
+        counts = counts.reshape(len(self.nodes), self._num_types)
+        mask = self.type_mask(edge_types)
+        return (counts if mask is None else counts[:, mask]).sum(axis=1)
+
+    def group_counts(self, start_timestamp, end_timestamp, edge_types=None):
+        """Number of interactions per `(pair, edge type, direction)` group in the window, zero for unselected types."""
+        low, high = self.rank_range(start_timestamp, end_timestamp)
+        counts = self._window_counts(self._group_keys, self._group_totals, self.num_groups, low, high)
+        mask = self.type_mask(edge_types)
+        return counts if mask is None else counts * mask[self.group_type]
+
+    def pair_counts(self, start_timestamp, end_timestamp, group_counts=None, edge_types=None):
+        """Number of interactions per pair (aligned with `pair_low`/`pair_high`) in the window."""
+        if group_counts is None:
+            group_counts = self.group_counts(start_timestamp, end_timestamp, edge_types)
+        return np.bincount(self.group_pair, weights=group_counts, minlength=self.num_pairs).astype(np.int64)
+
+    def loop_counts(self, start_timestamp, end_timestamp, edge_types=None):
+        """Number of self-loop interactions per node in the window."""
+        low, high = self.rank_range(start_timestamp, end_timestamp)
+        return self._node_type_counts(self._loop_keys, self._loop_totals, low, high, edge_types)
+
+    def node_counts(self, start_timestamp, end_timestamp, edge_types=None):
+        """Number of interactions per node (aligned with `nodes`) in the window."""
+        low, high = self.rank_range(start_timestamp, end_timestamp)
+        return self._node_type_counts(self._node_keys, self._node_totals, low, high, edge_types)
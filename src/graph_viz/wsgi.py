@@ -0,0 +1,13 @@
+"""
+Production entry point: `gunicorn -c src/graph_viz/gunicorn_config.py src.graph_viz.wsgi:server`.
+"""
+# The app defers these until first use; with `preload_app` importing them here lets every
+# forked worker share one copy instead of importing them on its first request
+import boto3  # noqa: F401
+import networkx  # noqa: F401
+import pandas  # noqa: F401
+import plotly.graph_objs  # noqa: F401
+
+from src.graph_viz.app import app
+
+server = app.server
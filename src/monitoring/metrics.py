@@ -0,0 +1,130 @@
+import functools
+import os
+import time
+from contextlib import contextmanager
+
+from dash.exceptions import PreventUpdate
+from flask import Response
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+METRICS_PREFIX = 'cloud_cartography'
+
+# Wide buckets: stages range from sub-millisecond cache lookups to minute-long hub crawls
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000, 1000000)
+
+STAGE_LATENCY = Histogram(
+    f'{METRICS_PREFIX}_stage_seconds',
+    'Latency of pipeline stages (S3, hub paging, JSON parsing, graph building, centrality, ...)',
+    ['stage'],
+    buckets=LATENCY_BUCKETS
+)
+CALLBACK_LATENCY = Histogram(
+    f'{METRICS_PREFIX}_callback_seconds',
+    'Latency of Dash callbacks',
+    ['callback'],
+    buckets=LATENCY_BUCKETS
+)
+CALLBACK_ERRORS = Counter(
+    f'{METRICS_PREFIX}_callback_errors_total',
+    'Dash callbacks that raised an exception (PreventUpdate excluded)',
+    ['callback']
+)
+PAGES_FETCHED = Counter(
+    f'{METRICS_PREFIX}_pages_fetched_total',
+    'Pages fetched from remote sources',
+    ['source', 'endpoint']
+)
+BYTES_FETCHED = Counter(
+    f'{METRICS_PREFIX}_bytes_fetched_total',
+    'Response bytes fetched from remote sources',
+    ['source', 'endpoint']
+)
+CACHE_REQUESTS = Counter(
+    f'{METRICS_PREFIX}_cache_requests_total',
+    'Cache lookups by cache and result; the hit ratio is hit / (hit + miss)',
+    ['cache', 'result']
+)
+COALESCED_CALLS = Counter(
+    f'{METRICS_PREFIX}_coalesced_calls_total',
+    'Calls that waited for an identical in-flight call instead of fetching themselves',
+    ['flight', 'scope']
+)
+PREFETCHES = Counter(
+    f'{METRICS_PREFIX}_prefetches_total',
+    'Speculative background fetches by outcome',
+    ['result']
+)
+GRAPH_SIZE = Histogram(
+    f'{METRICS_PREFIX}_graph_size',
+    'Number of nodes and edges of built graphs',
+    ['graph', 'dimension'],
+    buckets=SIZE_BUCKETS
+)
+
+
+@contextmanager
+def observe_stage(stage):
+    """Record the time spent in the `with` block under `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start)
+
+def timed_stage(stage):
+    """Decorator version of `observe_stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_callback(fn):
+    """Record latency and errors of a Dash callback; apply it below `@app.callback`."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except PreventUpdate:
+            raise
+        except Exception:
+            CALLBACK_ERRORS.labels(name).inc()
+            raise
+        finally:
+            CALLBACK_LATENCY.labels(name).observe(time.perf_counter() - start)
+    return wrapper
+
+def record_fetch(source, endpoint, num_bytes, pages=1):
+    PAGES_FETCHED.labels(source, endpoint).inc(pages)
+    BYTES_FETCHED.labels(source, endpoint).inc(num_bytes)
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+def record_coalesced(flight, scope):
+    COALESCED_CALLS.labels(flight, scope).inc()
+
+def record_prefetch(result):
+    PREFETCHES.labels(result).inc()
+
+def record_graph_size(graph, G):
+    GRAPH_SIZE.labels(graph, 'nodes').observe(G.number_of_nodes())
+    GRAPH_SIZE.labels(graph, 'edges').observe(G.number_of_edges())
+
+def metrics_view():
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        # Under the multi-worker server every worker writes its own samples; merge them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+def register_metrics_endpoint(server, path='/metrics'):
+    """Expose the metrics in Prometheus text format on the Flask `server`."""
+    server.add_url_rule(path, 'metrics', metrics_view)
@@ -0,0 +1,134 @@
+import cProfile
+import functools
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+
+from flask import has_request_context, request, jsonify
+
+logger = logging.getLogger(__name__)
+
+# Profile every call when set; otherwise only requests made from a page opened with `?profile=1`
+PROFILE_ENV_VAR = 'CLOUD_CARTOGRAPHY_PROFILE'
+PROFILE_QUERY_FLAG = 'profile'
+PROFILE_DIR = os.getenv('CLOUD_CARTOGRAPHY_PROFILE_DIR', 'data/profiles')
+PROFILE_TOP_N = int(os.getenv('CLOUD_CARTOGRAPHY_PROFILE_TOP_N', 20))
+SLOWEST_FILE = 'slowest.json'
+
+_TRUTHY = ('1', 'true', 'yes', 'on')
+
+# cProfile can't nest, so the outermost profiled call owns the profiler for its thread
+_active = threading.local()
+
+# Min-heap of the slowest profiled calls: (duration, sequence number, record)
+_slowest = []
+_slowest_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def profiling_requested():
+    """Whether the current call should be profiled, from the env var or the page's query flag."""
+    if os.getenv(PROFILE_ENV_VAR, '').lower() in _TRUTHY:
+        return True
+    if not has_request_context():
+        return False
+    if request.args.get(PROFILE_QUERY_FLAG, '').lower() in _TRUTHY:
+        return True
+    # Dash callbacks are POSTed to /_dash-update-component; the flag is on the page URL
+    if request.referrer:
+        values = parse_qs(urlparse(request.referrer).query).get(PROFILE_QUERY_FLAG, [])
+        return any(value.lower() in _TRUTHY for value in values)
+    return False
+
+def _slug(value, max_length=60):
+    if value is None:
+        return 'none'
+    if isinstance(value, (list, tuple, set)):
+        value = '-'.join(str(v) for v in value)
+    value = re.sub(r'[^A-Za-z0-9.]+', '-', str(value)).strip('-')
+    return value[:max_length] or 'none'
+
+def profile_filename(name, fids, slider_value, duration):
+    started = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    return f"{started}_{_slug(name)}_fids-{_slug(fids)}_slider-{_slug(slider_value)}_{int(duration * 1000)}ms.prof"
+
+def _record(record):
+    with _slowest_lock:
+        entry = (record['duration_seconds'], next(_sequence), record)
+        if len(_slowest) < PROFILE_TOP_N:
+            heapq.heappush(_slowest, entry)
+        elif entry[0] > _slowest[0][0]:
+            heapq.heapreplace(_slowest, entry)
+        else:
+            return
+        try:
+            with open(os.path.join(PROFILE_DIR, SLOWEST_FILE), 'w') as f:
+                json.dump(slowest_requests(), f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write the slowest profiled requests: {e}")
+
+def slowest_requests():
+    """The slowest profiled calls so far, slowest first."""
+    return [record for _, _, record in sorted(_slowest, key=lambda entry: entry[0], reverse=True)]
+
+def profiled(name, context=None):
+    """
+    Profile calls of the decorated function with cProfile when profiling is requested.
+
+    Each profiled call writes a `.prof` file (readable with `pstats` or snakeviz) to
+    `PROFILE_DIR`, named after the FID set and slider value, and is considered for the
+    rolling list of slowest calls in `slowest.json`.
+
+    Args:
+        name (str): Name used in filenames and records.
+        context (callable): Called with the function's arguments; returns `(fids, slider_value)`.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_active, 'profiling', False) or not profiling_requested():
+                return fn(*args, **kwargs)
+
+            fids, slider_value = None, None
+            if context is not None:
+                try:
+                    fids, slider_value = context(*args, **kwargs)
+                except Exception:
+                    pass  # A missing FID set must never break the call itself
+
+            profiler = cProfile.Profile()
+            _active.profiling = True
+            start = time.perf_counter()
+            try:
+                return profiler.runcall(fn, *args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                _active.profiling = False
+                try:
+                    os.makedirs(PROFILE_DIR, exist_ok=True)
+                    path = os.path.join(PROFILE_DIR, profile_filename(name, fids, slider_value, duration))
+                    profiler.dump_stats(path)
+                    _record({
+                        'name': name,
+                        'fids': fids,
+                        'slider_value': slider_value,
+                        'duration_seconds': duration,
+                        'profile': path,
+                        'recorded_at': datetime.now(timezone.utc).isoformat()
+                    })
+                    logger.info(f"Profiled {name} in {duration:.3f}s, written to {path}")
+                except OSError as e:
+                    logger.warning(f"Could not write profile for {name}: {e}")
+        return wrapper
+    return decorator
+
+def register_profiling_endpoint(server, path='/profiles'):
+    """Expose the rolling list of slowest profiled calls as JSON on the Flask `server`."""
+    server.add_url_rule(path, 'profiles', lambda: jsonify(slowest_requests()))
@@ -0,0 +1,37 @@
+import importlib
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is only imported on first attribute access.
+
+    Unlike `importlib.util.LazyLoader` the real module is imported normally (and only once,
+    under a lock), so it's safe to first touch it from concurrent request threads.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def _load(self):
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """Return `name` if it's already imported, otherwise a `LazyModule` that imports it when used."""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)